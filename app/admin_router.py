@@ -2,22 +2,56 @@
 
 from __future__ import annotations
 
-from typing import Optional
+from datetime import date, datetime, time, timedelta
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlencode
 
-from fastapi import APIRouter, Depends, Form, HTTPException, Request, status
+import anyio
+from fastapi import APIRouter, Form, HTTPException, Request, status
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy import desc, func, select
 from sqlalchemy.orm import Session
 
 from .admin_service import AdminUserService
-from .db import get_db
+from .config import get_settings
+from .db import session_scope
 from .models import HealthMetric
+from .repositories import (
+    MetricRepository,
+    StatsRepository,
+    estimate_row_count,
+    keyset_condition,
+)
+from .utils import decode_cursor, encode_cursor
 
 templates = Jinja2Templates(directory="app/templates")
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
+_worker_limiter: Optional[anyio.CapacityLimiter] = None
+
+
+async def _run_blocking(func: Callable[..., Any], *args: Any) -> Any:
+    """Run ``func(*args, session)`` in a worker thread with its own session.
+
+    Admin pages issue slow aggregate queries and bcrypt checks, so they run
+    off the event loop under a dedicated limiter: a busy dashboard can neither
+    stall the loop nor exhaust the shared threadpool used by ``/mcp/tools``.
+    """
+    global _worker_limiter
+    if _worker_limiter is None:
+        _worker_limiter = anyio.CapacityLimiter(get_settings().admin_worker_threads)
+    return await anyio.to_thread.run_sync(
+        partial(_in_session, func, *args), limiter=_worker_limiter
+    )
+
+
+def _in_session(func: Callable[..., Any], *args: Any) -> Any:
+    with session_scope() as session:
+        return func(*args, session)
+
 
 def _current_admin(
     request: Request, session: Session
@@ -33,7 +67,11 @@ def _current_admin(
 
 
 @router.get("/login", response_class=HTMLResponse)
-async def login_page(request: Request, db: Session = Depends(get_db)) -> HTMLResponse:
+async def login_page(request: Request) -> HTMLResponse:
+    return await _run_blocking(_login_page, request)
+
+
+def _login_page(request: Request, db: Session) -> HTMLResponse:
     admin_id = _current_admin(request, db)
     if admin_id:
         return RedirectResponse(url="/admin/dashboard", status_code=status.HTTP_303_SEE_OTHER)
@@ -45,8 +83,11 @@ async def login_action(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db),
 ):
+    return await _run_blocking(_login_action, request, username, password)
+
+
+def _login_action(request: Request, username: str, password: str, db: Session):
     service = AdminUserService(db)
     user = service.authenticate(username, password)
     if not user:
@@ -63,7 +104,11 @@ async def logout(request: Request):
 
 
 @router.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(request: Request, db: Session = Depends(get_db)) -> HTMLResponse:
+async def dashboard(request: Request) -> HTMLResponse:
+    return await _run_blocking(_dashboard, request)
+
+
+def _dashboard(request: Request, db: Session) -> HTMLResponse:
     if not _current_admin(request, db):
         return RedirectResponse(url="/admin/login", status_code=status.HTTP_303_SEE_OTHER)
     service = AdminUserService(db)
@@ -85,45 +130,144 @@ async def dashboard(request: Request, db: Session = Depends(get_db)) -> HTMLResp
 @router.get("/metrics", response_class=HTMLResponse)
 async def metrics_list(
     request: Request,
-    db: Session = Depends(get_db),
-    page: int = 1,
     page_size: int = 20,
     user_id: Optional[str] = None,
     type_code: Optional[str] = None,
+    source: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    exact_total: bool = False,
+):
+    filters = {
+        "user_id": user_id or "",
+        "type_code": type_code or "",
+        "source": source or "",
+        "start_date": start_date or "",
+        "end_date": end_date or "",
+    }
+    return await _run_blocking(
+        _metrics_list, request, page_size, filters, after, before, exact_total
+    )
+
+
+def _metrics_list(
+    request: Request,
+    page_size: int,
+    filters: Dict[str, str],
+    after: Optional[str],
+    before: Optional[str],
+    exact_total: bool,
+    db: Session,
 ):
+    """Browse newest-first with keyset navigation on ``(recorded_at, id)``.
+
+    ``after`` continues past the last row of the previous page, ``before``
+    walks back from the first row of the current one; neither needs OFFSET.
+    """
     if not _current_admin(request, db):
         return RedirectResponse(url="/admin/login", status_code=status.HTTP_303_SEE_OTHER)
-    page = max(page, 1)
     page_size = max(1, min(page_size, 100))
     stmt = select(HealthMetric).where(HealthMetric.deleted.is_(False))
-    if user_id:
-        stmt = stmt.where(HealthMetric.user_id == user_id)
-    if type_code:
-        stmt = stmt.where(HealthMetric.type_code == type_code)
-    total = db.execute(
-        select(func.count()).select_from(stmt.subquery())
-    ).scalar_one()
-    stmt = stmt.order_by(desc(HealthMetric.recorded_at)).offset((page - 1) * page_size).limit(page_size)
-    rows = db.execute(stmt).scalars().all()
+    if filters["user_id"]:
+        stmt = stmt.where(HealthMetric.user_id == filters["user_id"])
+    if filters["type_code"]:
+        stmt = stmt.where(HealthMetric.type_code == filters["type_code"])
+    if filters["source"]:
+        stmt = stmt.where(HealthMetric.source == filters["source"])
+    start_date = _parse_date(filters["start_date"])
+    if start_date:
+        stmt = stmt.where(HealthMetric.recorded_at >= datetime.combine(start_date, time.min))
+    end_date = _parse_date(filters["end_date"])
+    if end_date:
+        next_day = datetime.combine(end_date + timedelta(days=1), time.min)
+        stmt = stmt.where(HealthMetric.recorded_at < next_day)
+
+    total, total_exact = _metrics_total(db, stmt, filters, exact_total)
+    try:
+        if before:
+            # Walk backwards (ascending) from the first row, then restore order.
+            position = decode_cursor(before, "asc")
+            page_stmt = stmt.where(keyset_condition(position, "asc")).order_by(
+                HealthMetric.recorded_at.asc(), HealthMetric.id.asc()
+            )
+        else:
+            page_stmt = stmt.order_by(HealthMetric.recorded_at.desc(), HealthMetric.id.desc())
+            if after:
+                page_stmt = page_stmt.where(keyset_condition(decode_cursor(after, "desc"), "desc"))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    rows = db.execute(page_stmt.limit(page_size + 1)).scalars().all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before:
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = bool(after), has_more
+
     context = {
         "request": request,
         "metrics": rows,
-        "page": page,
         "page_size": page_size,
-        "total": total or 0,
-        "user_id": user_id or "",
-        "type_code": type_code or "",
+        "total": total,
+        "total_exact": total_exact,
+        "filter_query": urlencode({**filters, "page_size": page_size}),
+        "prev_cursor": (
+            encode_cursor(rows[0].recorded_at, rows[0].id, "asc") if rows and has_prev else None
+        ),
+        "next_cursor": (
+            encode_cursor(rows[-1].recorded_at, rows[-1].id, "desc") if rows and has_next else None
+        ),
+        "exact_total": exact_total,
+        **filters,
     }
     return templates.TemplateResponse("admin/metrics.html", context)
 
 
+def _metrics_total(
+    db: Session, stmt, filters: Dict[str, str], exact: bool
+) -> Tuple[Optional[int], bool]:
+    """Return ``(total, is_exact)`` without scanning unless ``exact`` is asked for.
+
+    A listing of one user, optionally narrowed by type and dates, is counted
+    exactly: the count stays inside that user's range of a
+    ``(user_id, deleted, ...)`` index. Unfiltered and type-only listings read
+    the maintained per-type counters, which also include archived records
+    (not listed here) and drift until the next reconciliation, so they are
+    reported as approximate. Other filters fall back to the optimizer's row
+    estimate, if any.
+    """
+    if exact or (filters["user_id"] and not filters["source"]):
+        return db.execute(select(func.count()).select_from(stmt.subquery())).scalar_one(), True
+    if not any(value for key, value in filters.items() if key != "type_code"):
+        counts = dict(StatsRepository(db).type_counts())
+        if filters["type_code"]:
+            return counts.get(filters["type_code"], 0), False
+        return sum(counts.values()), False
+    return estimate_row_count(db, stmt), False
+
+
+def _parse_date(value: str) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+
+
 @router.post("/metrics/{record_id}/delete")
-async def delete_metric(record_id: str, request: Request, db: Session = Depends(get_db)):
+async def delete_metric(record_id: str, request: Request):
+    return await _run_blocking(_delete_metric, record_id, request)
+
+
+def _delete_metric(record_id: str, request: Request, db: Session):
     if not _current_admin(request, db):
         return RedirectResponse(url="/admin/login", status_code=status.HTTP_303_SEE_OTHER)
     metric = db.get(HealthMetric, record_id)
     if not metric or metric.deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="记录不存在或已删除")
-    metric.deleted = True
-    db.add(metric)
+    MetricRepository(db).delete_metric(metric.user_id, metric.id)
     return RedirectResponse(url=request.headers.get("referer", "/admin/metrics"), status_code=status.HTTP_303_SEE_OTHER)
@@ -6,11 +6,13 @@ import logging
 import secrets
 from typing import Optional, Tuple
 
-from sqlalchemy import func, select
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from .cache import metric_cache
 from .config import get_settings
-from .models import AdminUser, HealthMetric
+from .models import AdminUser
+from .repositories import StatsRepository
 from .security import hash_password, verify_password
 
 
@@ -60,22 +62,14 @@ class AdminUserService:
         return self.session.execute(stmt).scalars().first()
 
     def dashboard_stats(self) -> dict:
-        total_metrics = self.session.execute(
-            select(func.count()).select_from(HealthMetric).where(HealthMetric.deleted.is_(False))
-        ).scalar_one()
-        total_users = self.session.execute(
-            select(func.count(func.distinct(HealthMetric.user_id))).where(HealthMetric.deleted.is_(False))
-        ).scalar_one()
-        type_counts = self.session.execute(
-            select(HealthMetric.type_code, func.count())
-            .where(HealthMetric.deleted.is_(False))
-            .group_by(HealthMetric.type_code)
-            .order_by(func.count().desc())
-        ).all()
+        """Read maintained counters; cost does not grow with the metrics table."""
+        stats = StatsRepository(self.session)
+        type_counts = stats.type_counts()
         return {
-            "total_metrics": total_metrics or 0,
-            "total_users": total_users or 0,
+            "total_metrics": sum(count for _, count in type_counts),
+            "total_users": stats.distinct_users(),
             "type_counts": type_counts,
+            "cache": metric_cache.stats(),
         }
 
 
@@ -1,20 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 
+from .config import get_settings
 from .db import get_db
+from .export import EXPORT_FORMATS, iter_export
+from .importer import IMPORT_FORMATS, ImportConflict, get_import, run_import, start_import
 from .schemas import (
+    ExportFilters,
     HealthBatchStoreMetricsInput,
     HealthBatchStoreMetricsOutput,
     HealthDeleteRecordOutput,
     HealthQueryMetricsOutput,
     HealthStoreMetricInput,
     HealthStoreMetricOutput,
+    MultiTrendSummaryInput,
+    MultiTrendSummaryOutput,
     TrendSummaryInput,
     TrendSummaryOutput,
     QueryFilters,
     HealthListMetricTypesOutput,
+    SeriesSamplesOutput,
 )
 from .services import MetricService
+from .utils import parse_tag_params
 
 router = APIRouter(prefix="/api", tags=["health"])
 
@@ -53,40 +66,112 @@ def batch_store_metrics(
     payload: HealthBatchStoreMetricsInput, session: Session = Depends(get_db)
 ):
     service = _service(session)
-    created = []
-    for record in payload.records:
-        try:
-            metric, deduplicated = service.store_metric(
-                user_id=record.user_id,
-                type_code=record.type,
-                value=record.value,
-                unit=record.unit,
-                recorded_at=record.recorded_at,
-                source=record.source,
-                metadata=record.metadata,
-                tags=record.tags,
-            )
-        except ValueError as exc:  # pragma: no cover
-            raise HTTPException(status_code=400, detail=str(exc))
-        created.append(
-            HealthStoreMetricOutput(record_id=metric.id, deduplicated=deduplicated)
+    try:
+        stored = service.batch_store_metrics(
+            [
+                {
+                    "user_id": record.user_id,
+                    "type_code": record.type,
+                    "value": record.value,
+                    "unit": record.unit,
+                    "recorded_at": record.recorded_at,
+                    "source": record.source,
+                    "metadata": record.metadata,
+                    "tags": record.tags,
+                }
+                for record in payload.records
+            ]
         )
-    return HealthBatchStoreMetricsOutput(records=created)
+    except ValueError as exc:  # pragma: no cover
+        raise HTTPException(status_code=400, detail=str(exc))
+    return HealthBatchStoreMetricsOutput(
+        records=[
+            HealthStoreMetricOutput(record_id=metric.id, deduplicated=deduplicated)
+            for metric, deduplicated in stored
+        ]
+    )
 
 
 @router.get("/metrics", response_model=HealthQueryMetricsOutput)
-def query_metrics(filters: QueryFilters = Depends(), session: Session = Depends(get_db)):
+def query_metrics(
+    filters: QueryFilters = Depends(),
+    tag: List[str] = Query(default=[], description="key=value, repeatable (all must match)"),
+    session: Session = Depends(get_db),
+):
     service = _service(session)
-    metrics = service.query_metrics(
+    try:
+        page = service.query_metrics(
+            user_id=filters.user_id,
+            type_code=filters.type,
+            limit=filters.limit,
+            order=filters.order,
+            start_time=filters.start_time,
+            end_time=filters.end_time,
+            source=filters.source,
+            cursor=filters.cursor,
+            tags=parse_tag_params(tag),
+            max_points=filters.max_points,
+            downsample_method=filters.downsample,
+            metric_field=filters.metric_field,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return HealthQueryMetricsOutput(**page)
+
+
+@router.get("/metrics/export")
+def export_metrics(filters: ExportFilters = Depends()):
+    body = iter_export(
+        filters.format,
         user_id=filters.user_id,
         type_code=filters.type,
-        limit=filters.limit,
-        order=filters.order,
         start_time=filters.start_time,
         end_time=filters.end_time,
         source=filters.source,
     )
-    return HealthQueryMetricsOutput(records=[metric.to_dict() for metric in metrics])
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_FORMATS[filters.format],
+        headers={
+            "Content-Disposition": f'attachment; filename="health-metrics.{filters.format}"'
+        },
+    )
+
+
+@router.post("/metrics/import")
+async def import_metrics(
+    request: Request, format: str = "ndjson", import_id: Optional[str] = None
+):
+    """Stream an NDJSON/CSV body into storage, committing one chunk at a time.
+
+    Progress is published on ``/mcp/stream``. A failed import is resumed by
+    re-sending the same body with the returned ``import_id``.
+    """
+    if format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    try:
+        job = await run_in_threadpool(start_import, format, import_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if job is None:
+        raise HTTPException(status_code=404, detail="import not found")
+    if job["status"] == "completed":
+        return job
+    try:
+        result = await run_import(job, request.stream(), get_settings().import_chunk_size)
+    except ImportConflict as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    if result["status"] != "completed":
+        return JSONResponse(status_code=400, content=result)
+    return result
+
+
+@router.get("/metrics/import/{import_id}")
+def import_status(import_id: str):
+    job = get_import(import_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="import not found")
+    return job
 
 
 @router.post("/metrics/trend", response_model=TrendSummaryOutput)
@@ -99,12 +184,47 @@ def trend_summary(payload: TrendSummaryInput, session: Session = Depends(get_db)
             metric_field=payload.metric_field,
             group_by=payload.group_by,
             lookback_days=payload.lookback_days,
+            max_points=payload.max_points,
+            downsample_method=payload.downsample,
         )
     except ValueError as exc:  # pragma: no cover
         raise HTTPException(status_code=400, detail=str(exc))
     return TrendSummaryOutput(**summary)
 
 
+@router.post("/metrics/trend/multi", response_model=MultiTrendSummaryOutput)
+def multi_trend_summary(payload: MultiTrendSummaryInput, session: Session = Depends(get_db)):
+    service = _service(session)
+    try:
+        summary = service.multi_trend_summary(
+            user_id=payload.user_id,
+            series=payload.series_keys(),
+            group_by=payload.group_by,
+            lookback_days=payload.lookback_days,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return MultiTrendSummaryOutput(**summary)
+
+
+@router.get("/metrics/{record_id}/samples", response_model=SeriesSamplesOutput)
+def record_samples(
+    record_id: str,
+    user_id: str,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    session: Session = Depends(get_db),
+):
+    """Samples of a series record; only blocks overlapping the range are decoded."""
+    service = _service(session)
+    found = service.record_samples(
+        user_id=user_id, record_id=record_id, start_time=start_time, end_time=end_time
+    )
+    if found is None:
+        raise HTTPException(status_code=404, detail="series record not found")
+    return SeriesSamplesOutput(**found)
+
+
 @router.delete("/metrics/{record_id}", response_model=HealthDeleteRecordOutput)
 def delete_metric(record_id: str, user_id: str, session: Session = Depends(get_db)):
     service = _service(session)
@@ -0,0 +1,291 @@
+"""Columnar segment files of the cold-storage tier.
+
+Records older than ``ARCHIVE_AFTER_DAYS`` are moved out of ``health_metrics``
+into immutable per-user segments, one directory each:
+
+- ``manifest.json``: format version, owner, record count, time range,
+  per-type counts and the dictionaries of the ``type`` and ``source`` codes;
+- ``<column>.npy``: fixed-width columns (``recorded_at``, ``id``,
+  ``dedup_hash``, ``type``, ``source``, ``value_number``), opened
+  memory-mapped so a query only pages in the ranges it scans;
+- ``<column>.json.zz``: every other column as zlib-compressed JSON arrays of
+  ``SIDE_GROUP_ROWS`` rows each, so a query only decodes the groups holding
+  rows it returns.
+
+Rows are sorted by ``(recorded_at, id)``, so time ranges and keyset
+positions are binary searches. Which segments are live, and which of their
+records were deleted since, is kept in the database (see
+``ArchiveRepository``).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import zlib
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .models import HealthMetric
+from .rollups import numeric_text
+
+ARCHIVE_FORMAT_VERSION = 1
+OPEN_SEGMENT_CACHE_SIZE = 64
+SIDE_GROUP_ROWS = 1024
+SIDE_COLUMNS = (
+    "unit",
+    "value_text",
+    "value_json",
+    "metadata_json",
+    "tags_json",
+    "created_at",
+    "updated_at",
+)
+_MANIFEST = "manifest.json"
+_TIMESTAMP = "datetime64[us]"
+_NULL_CODE = np.iinfo(np.uint16).max
+
+
+def user_directory(root: str, user_id: str) -> str:
+    digest = hashlib.sha256(user_id.encode("utf-8")).hexdigest()
+    return os.path.join(root, digest[:2], digest[:32])
+
+
+def write_segment(path: str, user_id: str, metrics: Sequence[HealthMetric]) -> Dict[str, Any]:
+    """Write ``metrics`` as a segment at ``path`` and return its manifest.
+
+    Files go to a temporary directory renamed into place at the end, so a
+    segment directory is either complete or absent.
+    """
+    metrics = sorted(metrics, key=lambda metric: (metric.recorded_at, metric.id))
+    types = sorted({metric.type_code for metric in metrics})
+    sources = sorted({metric.source for metric in metrics})
+    type_codes = {code: index for index, code in enumerate(types)}
+    source_codes = {source: index for index, source in enumerate(sources)}
+    columns = {
+        "recorded_at": np.array([metric.recorded_at for metric in metrics], dtype=_TIMESTAMP),
+        "id": np.array([metric.id.encode("ascii") for metric in metrics], dtype="S36"),
+        "dedup_hash": np.array([metric.dedup_hash.encode("ascii") for metric in metrics], dtype="S64"),
+        "type": np.array([type_codes[metric.type_code] for metric in metrics], dtype=np.uint16),
+        "source": np.array([source_codes[metric.source] for metric in metrics], dtype=np.uint16),
+        "value_number": np.array(
+            [np.nan if metric.value_number is None else metric.value_number for metric in metrics],
+            dtype=np.float64,
+        ),
+    }
+    type_counts: Dict[str, int] = {}
+    for metric in metrics:
+        type_counts[metric.type_code] = type_counts.get(metric.type_code, 0) + 1
+    staging = path + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name, column in columns.items():
+        np.save(os.path.join(staging, f"{name}.npy"), column)
+    side_offsets: Dict[str, List[int]] = {}
+    for name in SIDE_COLUMNS:
+        offsets = [0]
+        with open(os.path.join(staging, f"{name}.json.zz"), "wb") as handle:
+            for start in range(0, len(metrics), SIDE_GROUP_ROWS):
+                group = [_side_value(getattr(metric, name)) for metric in metrics[start:start + SIDE_GROUP_ROWS]]
+                encoded = json.dumps(group, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                offsets.append(offsets[-1] + handle.write(zlib.compress(encoded)))
+        side_offsets[name] = offsets
+    manifest = {
+        "version": ARCHIVE_FORMAT_VERSION,
+        "user_id": user_id,
+        "count": len(metrics),
+        "start": metrics[0].recorded_at.isoformat(),
+        "end": metrics[-1].recorded_at.isoformat(),
+        "types": types,
+        "sources": sources,
+        "type_counts": type_counts,
+        "side_group_rows": SIDE_GROUP_ROWS,
+        "side_offsets": side_offsets,
+    }
+    with open(os.path.join(staging, _MANIFEST), "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle, ensure_ascii=False)
+    os.replace(staging, path)
+    return manifest
+
+
+class Segment:
+    """Read-only view of one segment directory."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, _MANIFEST), encoding="utf-8") as handle:
+            self.manifest = json.load(handle)
+        if self.manifest.get("version") != ARCHIVE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported archive segment format: {self.manifest.get('version')}")
+        self.user_id: str = self.manifest["user_id"]
+        self.types: Dict[str, int] = {code: i for i, code in enumerate(self.manifest["types"])}
+        self.sources: Dict[str, int] = {name: i for i, name in enumerate(self.manifest["sources"])}
+        self.recorded_at = self._column("recorded_at")
+        self.ids = self._column("id")
+        self.dedup_hashes = self._column("dedup_hash")
+        self.type_codes = self._column("type")
+        self.source_codes = self._column("source")
+        self.value_number = self._column("value_number")
+
+    def __len__(self) -> int:
+        return len(self.recorded_at)
+
+    def select(
+        self,
+        type_code: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        source: Optional[str] = None,
+        after: Optional[Tuple[datetime, str]] = None,
+        order: str = "asc",
+        inclusive_end: bool = True,
+        excluded: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Ascending row indexes matching the filters.
+
+        ``after`` is a keyset position in ``order``; ``excluded`` holds ids
+        (as bytes) to leave out, i.e. the tombstones of the segment.
+        """
+        timestamps = self.recorded_at
+        lo, hi = 0, len(self)
+        if start is not None:
+            lo = int(np.searchsorted(timestamps, _timestamp(start), "left"))
+        if end is not None:
+            hi = int(np.searchsorted(timestamps, _timestamp(end), "right" if inclusive_end else "left"))
+        if after is not None:
+            position = _timestamp(after[0])
+            if order == "asc":
+                lo = max(lo, int(np.searchsorted(timestamps, position, "left")))
+            else:
+                hi = min(hi, int(np.searchsorted(timestamps, position, "right")))
+        if lo >= hi:
+            return np.empty(0, dtype=np.int64)
+        mask = np.ones(hi - lo, dtype=bool)
+        if type_code is not None:
+            code = self.types.get(type_code, _NULL_CODE)
+            mask &= self.type_codes[lo:hi] == code
+        if source is not None:
+            code = self.sources.get(source, _NULL_CODE)
+            mask &= self.source_codes[lo:hi] == code
+        if after is not None:
+            boundary = self.recorded_at[lo:hi] == _timestamp(after[0])
+            record_id = after[1].encode("ascii")
+            past = self.ids[lo:hi] > record_id if order == "asc" else self.ids[lo:hi] < record_id
+            mask &= ~boundary | past
+        if excluded is not None and len(excluded):
+            mask &= ~np.isin(self.ids[lo:hi], excluded)
+        return lo + np.flatnonzero(mask)
+
+    def find(self, column: str, values: Iterable[str]) -> np.ndarray:
+        """Indexes whose ``id`` or ``dedup_hash`` is one of ``values``."""
+        data = self.ids if column == "id" else self.dedup_hashes
+        wanted = np.array([value.encode("ascii") for value in values], dtype=data.dtype)
+        return np.flatnonzero(np.isin(data, wanted))
+
+    def side(self, name: str, indexes: np.ndarray) -> List[Any]:
+        """Values of side column ``name`` at ``indexes``."""
+        reader = _SideReader(self, name)
+        return [reader[index] for index in indexes.tolist()]
+
+    def values(
+        self, indexes: np.ndarray, metric_field: Optional[str] = None, fields_only: bool = False
+    ) -> np.ndarray:
+        """Numeric value of each row at ``indexes``, NaN where it has none.
+
+        Mirrors the SQL value expression: the number column, then
+        ``metric_field`` of an object value, then a numeric text value. With
+        ``fields_only`` only the object field counts.
+        """
+        if fields_only:
+            values = np.full(len(indexes), np.nan)
+        else:
+            values = np.array(self.value_number[indexes], dtype=np.float64)
+        fallbacks = ["value_json"] if metric_field else []
+        if not fields_only:
+            fallbacks.append("value_text")
+        for name in fallbacks:
+            missing = np.flatnonzero(np.isnan(values))
+            if not len(missing):
+                break
+            for position, value in zip(missing.tolist(), self.side(name, indexes[missing])):
+                if name == "value_json":
+                    value = value.get(metric_field) if isinstance(value, dict) else None
+                values[position] = _number(value)
+        return values
+
+    def metrics(self, indexes: np.ndarray) -> Iterator[HealthMetric]:
+        """Transient ``HealthMetric`` objects for ``indexes``, built lazily in the given order."""
+        side = {name: _SideReader(self, name) for name in SIDE_COLUMNS}
+        types, sources = self.manifest["types"], self.manifest["sources"]
+        for index in indexes.tolist():
+            number = float(self.value_number[index])
+            created_at, updated_at = side["created_at"][index], side["updated_at"][index]
+            yield HealthMetric(
+                id=self.ids[index].decode("ascii"),
+                user_id=self.user_id,
+                type_code=types[self.type_codes[index]],
+                value_number=None if np.isnan(number) else number,
+                value_text=side["value_text"][index],
+                value_json=side["value_json"][index],
+                recorded_at=self.recorded_at[index].item(),
+                source=sources[self.source_codes[index]],
+                unit=side["unit"][index],
+                metadata_json=side["metadata_json"][index],
+                tags_json=side["tags_json"][index],
+                dedup_hash=self.dedup_hashes[index].decode("ascii"),
+                deleted=False,
+                created_at=datetime.fromisoformat(created_at) if created_at else None,
+                updated_at=datetime.fromisoformat(updated_at) if updated_at else None,
+            )
+
+    def _column(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+
+
+class _SideReader:
+    """Random access to one side column, keeping only the last decoded group."""
+
+    def __init__(self, segment: Segment, name: str) -> None:
+        self.path = os.path.join(segment.path, f"{name}.json.zz")
+        self.offsets = segment.manifest["side_offsets"][name]
+        self.rows = segment.manifest["side_group_rows"]
+        self.group: Optional[int] = None
+        self.values: List[Any] = []
+
+    def __getitem__(self, index: int) -> Any:
+        group, position = divmod(index, self.rows)
+        if group != self.group:
+            with open(self.path, "rb") as handle:
+                handle.seek(self.offsets[group])
+                data = handle.read(self.offsets[group + 1] - self.offsets[group])
+            self.group, self.values = group, json.loads(zlib.decompress(data))
+        return self.values[position]
+
+
+@lru_cache(maxsize=OPEN_SEGMENT_CACHE_SIZE)
+def open_segment(path: str) -> Segment:
+    """Open (and keep mapped) a committed segment; segments never change."""
+    return Segment(path)
+
+
+def _timestamp(moment: datetime) -> np.datetime64:
+    return np.datetime64(moment, "us")
+
+
+def _number(value: Any) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        number = numeric_text(value)
+        if number is not None:
+            return number
+    return np.nan
+
+
+def _side_value(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
@@ -0,0 +1,280 @@
+"""Read-through cache for metric reads with per-(user, type) version invalidation."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .config import get_settings
+from .utils import run_blocking
+
+try:  # pragma: no cover - optional dependency
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+ALL_TYPES = "*"
+_PENDING_KEY = "metric_cache_invalidations"
+# Bumped by a process that reconnects after an outage, since invalidations
+# it issued meanwhile never reached Redis; part of every key.
+_EPOCH_KEY = "hm:epoch"
+
+
+class LocalLRUBackend:
+    """In-process fallback used when Redis is not reachable (single worker only)."""
+
+    name = "local"
+
+    def __init__(self, max_entries: int) -> None:
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def counters(self, keys: List[str]) -> List[int]:
+        with self._lock:
+            return [self._counters.get(key, 0) for key in keys]
+
+    def incr(self, key: str) -> None:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+
+class RedisBackend:
+    name = "redis"
+
+    def __init__(self, client) -> None:
+        self._client = client
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._client.get(key)
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        self._client.set(key, value, ex=ttl)
+
+    def counters(self, keys: List[str]) -> List[int]:
+        return [int(value) if value is not None else 0 for value in self._client.mget(keys)]
+
+    def incr(self, key: str) -> None:
+        self._client.incr(key)
+
+
+class MetricCache:
+    """Cache serialized read results keyed by normalized filters.
+
+    Every key embeds the current version counter of its ``(user_id, type)``
+    scope, so bumping the counter after a committed write makes all older
+    entries unreachable; they then age out through the TTL or LRU bound.
+
+    While Redis is unreachable it is retried every ``CACHE_RETRY_SECONDS``.
+    Meanwhile a single-worker deployment (``WEB_CONCURRENCY`` 1) uses a
+    process-local LRU; with more workers the cache is bypassed, since local
+    version counters would not see the other workers' writes. A process
+    that reconnects after an outage bumps a global epoch, dropping entries
+    that its lost invalidations should have reached.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        ttl: Optional[int] = None,
+        enabled: Optional[bool] = None,
+        retry_seconds: Optional[float] = None,
+    ):
+        settings = get_settings()
+        # An explicit backend is used as is, without reconnect handling.
+        self._fixed = backend is not None
+        self._backend = backend
+        self._connected = self._fixed
+        self._outage = False
+        self._retry_at = 0.0
+        self._retry_seconds = (
+            retry_seconds if retry_seconds is not None else settings.cache_retry_seconds
+        )
+        self._ttl = ttl if ttl is not None else settings.cache_ttl_seconds
+        self.enabled = settings.cache_enabled if enabled is None else enabled
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def backend(self):
+        """Backend for the next operation; None bypasses the cache."""
+        if not self._connected and time.monotonic() >= self._retry_at:
+            with self._lock:
+                if not self._connected and time.monotonic() >= self._retry_at:
+                    self._connect()
+        return self._backend
+
+    def _connect(self) -> None:
+        client = _redis_client()
+        if client is not None:
+            try:
+                client.ping()
+                if self._outage:
+                    client.incr(_EPOCH_KEY)
+                    logger.info("Redis reachable again; metric cache epoch bumped")
+                else:
+                    logger.info("Metric cache using Redis at %s", get_settings().redis_connection_url)
+                self._backend, self._connected, self._outage = RedisBackend(client), True, False
+                return
+            except Exception as exc:  # pragma: no cover - depends on external service
+                logger.warning("Redis unavailable (%s); retrying in %ss", exc, self._retry_seconds)
+        self._fall_back()
+
+    def _fall_back(self) -> None:
+        self._outage = True
+        self._connected = False
+        self._retry_at = time.monotonic() + self._retry_seconds
+        if get_settings().web_concurrency > 1:
+            self._backend = None
+        elif not isinstance(self._backend, LocalLRUBackend):
+            self._backend = LocalLRUBackend(get_settings().cache_local_max_entries)
+
+    def _failed(self, message: str) -> None:
+        logger.warning(message, exc_info=True)
+        self.errors += 1
+        if not self._fixed and isinstance(self._backend, RedisBackend):
+            with self._lock:
+                if isinstance(self._backend, RedisBackend):
+                    self._fall_back()
+
+    def get_or_load(
+        self,
+        kind: str,
+        user_id: str,
+        type_code: Optional[str],
+        filters: Dict[str, Any],
+        loader: Callable[[], Any],
+    ) -> Any:
+        if not self.enabled:
+            return loader()
+        try:
+            found = run_blocking(self._lookup, kind, user_id, type_code, filters)
+        except Exception:  # pragma: no cover - cache outages must not fail reads
+            self._failed("Metric cache lookup failed")
+            return loader()
+        if found is None:
+            return loader()
+        backend, key, cached = found
+        if cached is not None:
+            self.hits += 1
+            return json.loads(cached)
+        self.misses += 1
+        value = loader()
+        try:
+            run_blocking(self._store, backend, key, value)
+        except Exception:  # pragma: no cover
+            self._failed("Metric cache store failed")
+        return value
+
+    def invalidate(self, user_id: str, type_code: str) -> None:
+        try:
+            run_blocking(self._bump, user_id, type_code)
+        except Exception:  # pragma: no cover
+            self._failed("Metric cache invalidation failed")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        backend = self.backend if self.enabled else None
+        return {
+            "enabled": self.enabled,
+            "backend": (backend.name if backend else "bypass") if self.enabled else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _lookup(
+        self, kind: str, user_id: str, type_code: Optional[str], filters: Dict[str, Any]
+    ) -> Optional[Tuple[Any, str, Optional[str]]]:
+        """``(backend, key, cached value)``, or None while the cache is bypassed."""
+        backend = self.backend
+        if backend is None:
+            return None
+        key = self._key(backend, kind, user_id, type_code, filters)
+        return backend, key, backend.get(key)
+
+    def _store(self, backend, key: str, value: Any) -> None:
+        backend.set(key, json.dumps(value, ensure_ascii=False, default=str), self._ttl)
+
+    def _bump(self, user_id: str, type_code: str) -> None:
+        backend = self.backend
+        if backend is None:
+            return
+        backend.incr(_version_key(user_id, type_code))
+        backend.incr(_version_key(user_id, ALL_TYPES))
+
+    def _key(
+        self, backend, kind: str, user_id: str, type_code: Optional[str], filters: Dict[str, Any]
+    ) -> str:
+        scope = type_code or ALL_TYPES
+        epoch, version = backend.counters([_EPOCH_KEY, _version_key(user_id, scope)])
+        normalized = json.dumps(filters, sort_keys=True, default=str)
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        return f"hm:{kind}:{user_id}:{scope}:e{epoch}:v{version}:{digest}"
+
+
+def _version_key(user_id: str, scope: str) -> str:
+    return f"hm:ver:{user_id}:{scope}"
+
+
+def _redis_client():
+    if redis is None:
+        return None
+    url = get_settings().redis_connection_url
+    return redis.Redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5)
+
+
+def mark_dirty(session: Session, user_id: str, type_code: str) -> None:
+    """Queue an invalidation that is applied once ``session`` commits."""
+    pending: Set[Tuple[str, str]] = session.info.setdefault(_PENDING_KEY, set())
+    pending.add((user_id, type_code))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidations(session: Session) -> None:
+    # Releasing a savepoint also fires after_commit; wait for the outer commit.
+    # Pending marks survive rollbacks on purpose: a spurious bump is harmless.
+    if session.in_nested_transaction():
+        return
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending or not metric_cache.enabled:
+        return
+    for user_id, type_code in pending:
+        metric_cache.invalidate(user_id, type_code)
+
+
+metric_cache = MetricCache()
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 
 @dataclass(frozen=True)
@@ -11,6 +11,8 @@ class MetricType:
     unit: Optional[str]
     description: str
     value_schema: str
+    # Numeric sub-fields of object values, materialized into health_metric_fields.
+    fields: Tuple[str, ...] = ()
 
 
 CATALOG: List[MetricType] = [
@@ -55,6 +57,21 @@ CATALOG: List[MetricType] = [
         unit=None,
         description="单次跑步训练记录",
         value_schema="object",
+        fields=("distance_km", "duration_min", "pace_min_per_km", "avg_heart_rate", "cadence"),
+    ),
+    MetricType(
+        type_code="device/heart_rate_series",
+        name="心率序列",
+        unit="bpm",
+        description="穿戴设备连续心率采样，value 为 {\"samples\": [[偏移秒数, 数值], ...]}",
+        value_schema="series",
+    ),
+    MetricType(
+        type_code="device/step_series",
+        name="步数序列",
+        unit="steps",
+        description="穿戴设备按时间间隔采集的步数，value 格式同心率序列",
+        value_schema="series",
     ),
 ]
 
@@ -68,3 +85,15 @@ def list_metric_types() -> List[MetricType]:
 
 def get_metric_type(type_code: str) -> Optional[MetricType]:
     return CATALOG_INDEX.get(type_code)
+
+
+def materialized_fields(type_code: str) -> Tuple[str, ...]:
+    metric_type = CATALOG_INDEX.get(type_code)
+    if metric_type is None or metric_type.value_schema != "object":
+        return ()
+    return metric_type.fields
+
+
+def is_series(type_code: str) -> bool:
+    metric_type = CATALOG_INDEX.get(type_code)
+    return metric_type is not None and metric_type.value_schema == "series"
@@ -2,6 +2,13 @@ from functools import lru_cache
 from pydantic import BaseSettings, AnyUrl
 from typing import Optional
 
+from sqlalchemy.engine import make_url
+
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
 
 class Settings(BaseSettings):
     app_name: str = "Health MCP Server"
@@ -15,17 +22,46 @@ class Settings(BaseSettings):
     mysql_db: str = "health_mcp"
     mysql_driver: str = "mysql+pymysql"
     database_url: Optional[str] = None
+    async_database_url: Optional[str] = None
+    mcp_async_db: bool = False
+    compact_ids: bool = False
+    mcp_batch_concurrency: int = 8
+    mcp_batch_max_size: int = 100
 
     redis_host: str = "localhost"
     redis_port: int = 6379
     redis_url: Optional[AnyUrl] = None
 
+    cache_enabled: bool = True
+    cache_ttl_seconds: int = 300
+    cache_local_max_entries: int = 1024
+    cache_retry_seconds: int = 30
+    # Worker processes serving the app (uvicorn/gunicorn read the same variable).
+    web_concurrency: int = 1
+
+    event_backend: str = "memory"
+    event_channel: str = "hm:events"
+    sse_queue_size: int = 256
+    sse_overflow_policy: str = "drop_oldest"
+    sse_replay_size: int = 1000
+    sse_replay_max_bytes: int = 4 * 1024 * 1024
+    sse_replay_grace_seconds: int = 300
+
+    query_max_limit: int = 1000
+    downsample_max_points: int = 5000
+    import_chunk_size: int = 1000
+    stats_reconcile_interval_seconds: int = 3600
+    archive_dir: Optional[str] = None
+    archive_after_days: int = 365
+    archive_segment_max_records: int = 100000
+
     api_key: Optional[str] = None
     log_level: str = "INFO"
 
     admin_username: Optional[str] = None
     admin_password: Optional[str] = None
     default_admin_username: str = "admin"
+    admin_worker_threads: int = 4
     session_secret_key: Optional[str] = None
 
     class Config:
@@ -41,6 +77,23 @@ class Settings(BaseSettings):
             f"@{self.mysql_host}:{self.mysql_port}/{self.mysql_db}"
         )
 
+    @property
+    def redis_connection_url(self) -> str:
+        if self.redis_url:
+            return str(self.redis_url)
+        return f"redis://{self.redis_host}:{self.redis_port}/0"
+
+    @property
+    def async_sqlalchemy_database_uri(self) -> str:
+        """Async-driver twin of ``sqlalchemy_database_uri`` for the MCP path."""
+        if self.async_database_url:
+            return self.async_database_url
+        url = make_url(self.sqlalchemy_database_uri)
+        driver = ASYNC_DRIVERS.get(url.get_backend_name())
+        if driver is None:
+            raise ValueError(f"No async driver known for {url.drivername}; set ASYNC_DATABASE_URL")
+        return str(url.set(drivername=driver))
+
 
 @lru_cache
 def get_settings() -> Settings:
@@ -1,7 +1,8 @@
-from contextlib import contextmanager
-from typing import Iterator
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, Optional
 
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
 
 from .config import get_settings
@@ -36,3 +37,44 @@ def session_scope() -> Iterator[Session]:
 def get_db() -> Iterator[Session]:
     with session_scope() as session:
         yield session
+
+
+_async_engine: Optional[AsyncEngine] = None
+_AsyncSessionLocal: Optional[sessionmaker] = None
+
+
+def get_async_engine() -> AsyncEngine:
+    """Create the async engine on first use so the async drivers stay optional."""
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        _async_engine = create_async_engine(
+            settings.async_sqlalchemy_database_uri, pool_pre_ping=True
+        )
+        _AsyncSessionLocal = sessionmaker(
+            bind=_async_engine,
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False,
+        )
+    return _async_engine
+
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncIterator[AsyncSession]:
+    get_async_engine()
+    session = _AsyncSessionLocal()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+async def dispose_async_engine() -> None:
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = _AsyncSessionLocal = None
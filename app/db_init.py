@@ -1,17 +1,26 @@
 """Utility helpers for initializing the database schema."""
 
+import argparse
 import logging
 import time
+from datetime import datetime, timedelta
 from typing import Optional
 
-from sqlalchemy import text
+from sqlalchemy import select, text
+from sqlalchemy.engine import Connection
 from sqlalchemy.exc import OperationalError
 
-from .db import engine
-from .models import Base
+from . import migrations, query_plans
+from .config import get_settings
+from .db import engine, session_scope
+from .migrations.compact_ids import migrate_to_compact_ids
+from .models import Base, HealthMetric, detect_compact_storage
+from .repositories import ArchiveRepository, RollupRepository, StatsRepository
 
 logger = logging.getLogger(__name__)
 
+STATS_LEADER_LOCK = "health_mcp.reconcile_stats"
+
 
 def wait_for_database(max_attempts: int = 30, delay_seconds: float = 2.0) -> None:
     """Poll the configured database until a simple query succeeds."""
@@ -32,9 +41,11 @@ def wait_for_database(max_attempts: int = 30, delay_seconds: float = 2.0) -> Non
 
 
 def init_database_schema() -> None:
-    """Create all database tables defined in the SQLAlchemy metadata."""
+    """Create missing tables, then apply pending schema migrations."""
+    detect_compact_storage(engine)
     Base.metadata.create_all(bind=engine)
     logger.info("Database schema ensured via create_all")
+    migrations.upgrade(engine)
 
 
 def initialize_database(*, attempts: Optional[int] = None, delay: Optional[float] = None) -> None:
@@ -43,5 +54,189 @@ def initialize_database(*, attempts: Optional[int] = None, delay: Optional[float
     init_database_schema()
 
 
+def rebuild_rollups(user_id: Optional[str] = None) -> int:
+    """Recompute trend rollups from raw records, one transaction per user."""
+    if user_id:
+        user_ids = [user_id]
+    else:
+        with session_scope() as session:
+            user_ids = list(session.execute(select(HealthMetric.user_id).distinct()).scalars())
+            user_ids += sorted(set(ArchiveRepository(session).user_ids()) - set(user_ids))
+    processed = 0
+    for current in user_ids:
+        with session_scope() as session:
+            count = RollupRepository(session).rebuild(current)
+        logger.info("Rebuilt rollups for user %s from %s records", current, count)
+        processed += count
+    return processed
+
+
+def reconcile_stats(only_if_empty: bool = False) -> Optional[dict]:
+    """Recompute the dashboard statistics tables from raw records.
+
+    With ``only_if_empty`` the (full-table) recomputation only runs when the
+    statistics have never been populated, e.g. right after an upgrade.
+    """
+    with session_scope() as session:
+        if engine.dialect.name == "mysql":
+            # One snapshot for every read; see StatsRepository.reconcile.
+            session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        stats = StatsRepository(session)
+        if only_if_empty and not stats.is_empty():
+            return None
+        result = stats.reconcile()
+    logger.info(
+        "Reconciled statistics: %s records in %s types, ~%s users (%s counters corrected)",
+        result["records"],
+        result["types"],
+        result["users"],
+        result["corrected"],
+    )
+    return result
+
+
+class LeaderLock:
+    """A named MySQL lock held on a dedicated connection, electing one process.
+
+    ``acquire`` is cheap to call on every round: it keeps a lock it already
+    holds and otherwise tries to take it without waiting. MySQL frees the
+    lock when the holder's connection closes, so another process takes over
+    after the leader exits. Other databases have no such lock and every
+    caller leads.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._connection: Optional[Connection] = None
+
+    def acquire(self) -> bool:
+        if engine.dialect.name != "mysql":
+            return True
+        if self._connection is not None:
+            try:
+                if self._query("SELECT IS_USED_LOCK(:name) = CONNECTION_ID()"):
+                    return True
+            except OperationalError:
+                logger.warning("Lost the connection holding lock %s", self.name)
+            self.release()
+        # Autocommit, so holding the connection keeps no transaction open.
+        self._connection = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        if self._query("SELECT GET_LOCK(:name, 0)") == 1:
+            logger.info("Acquired lock %s", self.name)
+            return True
+        self.release()
+        return False
+
+    def release(self) -> None:
+        if self._connection is None:
+            return
+        # Dropping the connection instead of pooling it releases the lock.
+        self._connection.invalidate()
+        self._connection.close()
+        self._connection = None
+
+    def _query(self, sql: str):
+        return self._connection.execute(text(sql), {"name": self.name}).scalar()
+
+
+def archive_records(user_id: Optional[str] = None, older_than_days: Optional[int] = None) -> int:
+    """Move records older than ``older_than_days`` (default ``ARCHIVE_AFTER_DAYS``) to cold storage.
+
+    Each segment is committed in its own transaction, so the run can be
+    interrupted and resumed at any point.
+    """
+    settings = get_settings()
+    if not settings.archive_dir:
+        raise RuntimeError("Set ARCHIVE_DIR to enable the cold-storage tier")
+    before = datetime.utcnow() - timedelta(days=older_than_days or settings.archive_after_days)
+    if user_id:
+        user_ids = [user_id]
+    else:
+        with session_scope() as session:
+            user_ids = ArchiveRepository(session).candidates(before)
+    archived = 0
+    for current in user_ids:
+        while True:
+            with session_scope() as session:
+                moved = ArchiveRepository(session).archive(
+                    current, before, settings.archive_segment_max_records
+                )
+            if not moved:
+                break
+            logger.info("Archived %s records of user %s", moved, current)
+            archived += moved
+    return archived
+
+
+def check_query_plans() -> bool:
+    """Log the index each hot query uses; False if any deviates from its design."""
+    with session_scope() as session:
+        results = query_plans.check_query_plans(session)
+    for result in results:
+        log = logger.info if result.ok else logger.error
+        log(
+            "%s: expected %s, used %s%s",
+            result.name,
+            result.expected,
+            result.used or "no index",
+            " + in-memory sort" if result.sorted_in_memory else "",
+        )
+    return all(result.ok for result in results)
+
+
 if __name__ == "__main__":  # pragma: no cover - CLI utility
+    parser = argparse.ArgumentParser(description="Database maintenance commands")
+    parser.add_argument(
+        "--rebuild-rollups",
+        action="store_true",
+        help="recompute trend rollup tables from the raw health_metrics rows",
+    )
+    parser.add_argument(
+        "--user-id", help="limit --rebuild-rollups or --archive-records to a single user"
+    )
+    parser.add_argument(
+        "--reconcile-stats",
+        action="store_true",
+        help="recompute dashboard counters and the distinct-user sketch",
+    )
+    parser.add_argument(
+        "--migrate-compact-ids",
+        action="store_true",
+        help="copy health_metrics into binary id/hash columns online (needs COMPACT_IDS=true)",
+    )
+    parser.add_argument(
+        "--archive-records",
+        action="store_true",
+        help="move records older than ARCHIVE_AFTER_DAYS into cold-storage segments",
+    )
+    parser.add_argument(
+        "--older-than-days",
+        type=int,
+        help="override ARCHIVE_AFTER_DAYS for --archive-records",
+    )
+    parser.add_argument(
+        "--check-query-plans",
+        action="store_true",
+        help="EXPLAIN the hot health_metrics queries and fail if one misses its index",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
     initialize_database()
+    if args.rebuild_rollups:
+        rebuild_rollups(args.user_id)
+    if args.reconcile_stats:
+        # Corrections are deltas: never run two reconciliations at once.
+        leader = LeaderLock(STATS_LEADER_LOCK)
+        if leader.acquire():
+            try:
+                reconcile_stats()
+            finally:
+                leader.release()
+        else:
+            logger.warning("An application worker holds %s and reconciles; skipped", STATS_LEADER_LOCK)
+    if args.migrate_compact_ids:
+        migrate_to_compact_ids(engine)
+    if args.archive_records:
+        archive_records(args.user_id, args.older_than_days)
+    if args.check_query_plans and not check_query_plans():
+        raise SystemExit(1)
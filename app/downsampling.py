@@ -0,0 +1,128 @@
+"""Single-pass downsampling of ordered numeric series for charts.
+
+Both methods consume samples in ``x`` order exactly once and keep at most a
+couple of buckets in memory, so they can sit directly on a streaming
+cursor. ``total`` (the number of samples the stream will produce) fixes the
+bucket boundaries up front; if the stream turns out longer, the surplus
+lands in the final bucket.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Any, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+MIN_POINTS = 3
+
+
+class Sample(NamedTuple):
+    x: float
+    y: float
+    item: Any
+
+
+def downsample(
+    samples: Iterable[Sample], total: int, max_points: int, method: str = "lttb"
+) -> Iterator[Sample]:
+    """Reduce ``samples`` to at most ``max_points``, passing short series through."""
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Unsupported downsampling method: {method}")
+    if max_points < MIN_POINTS:
+        raise ValueError(f"max_points must be at least {MIN_POINTS}")
+    if total <= max_points:
+        return iter(samples)
+    if method == "minmax":
+        return min_max(samples, total, max_points)
+    return lttb(samples, total, max_points)
+
+
+def lttb(samples: Iterable[Sample], total: int, threshold: int) -> Iterator[Sample]:
+    """Largest-Triangle-Three-Buckets (Steinarsson, 2013).
+
+    The first and last samples are kept; the ``threshold - 2`` buckets in
+    between each contribute the sample forming the largest triangle with the
+    previously kept sample and the centroid of the following bucket.
+    """
+    iterator = iter(samples)
+    first = next(iterator, None)
+    if first is None:
+        return
+    yield first
+    every = (total - 2) / (threshold - 2)
+    last_bucket = threshold - 3
+    selected = first
+    pending: Optional[List[Sample]] = None
+    bucket: List[Sample] = []
+    number = 0
+    index = 1
+    # One-sample lookahead: the final sample is kept as is, never bucketed.
+    held = next(iterator, None)
+    for sample in iterator:
+        # Bucket j spans indexes floor(j * every) + 1 .. floor((j + 1) * every).
+        held_number = min(math.ceil(index / every) - 1, last_bucket)
+        if held_number != number:
+            if pending is not None:
+                selected = _largest_triangle(pending, selected, _centroid(bucket))
+                yield selected
+            pending, bucket, number = bucket, [], held_number
+        bucket.append(held)
+        held = sample
+        index += 1
+    if held is None:
+        return
+    if pending is not None:
+        selected = _largest_triangle(pending, selected, _centroid(bucket))
+        yield selected
+    if bucket:
+        yield _largest_triangle(bucket, selected, (held.x, held.y))
+    yield held
+
+
+def min_max(samples: Iterable[Sample], total: int, threshold: int) -> Iterator[Sample]:
+    """Keep the lowest and highest sample of ``threshold // 2`` equal-count buckets.
+
+    Cheaper than LTTB and never hides a spike, at the cost of emitting two
+    points per bucket even where the series is flat.
+    """
+    buckets = threshold // 2
+    every = total / buckets
+    number = 0
+    low: Optional[Sample] = None
+    high: Optional[Sample] = None
+    for index, sample in enumerate(samples):
+        sample_number = min(int(index / every), buckets - 1)
+        if sample_number != number and low is not None:
+            yield from _in_order(low, high)
+            low = high = None
+            number = sample_number
+        if low is None or sample.y < low.y:
+            low = sample
+        if high is None or sample.y > high.y:
+            high = sample
+    if low is not None:
+        yield from _in_order(low, high)
+
+
+def _largest_triangle(
+    bucket: List[Sample], previous: Sample, following: Tuple[float, float]
+) -> Sample:
+    ax, ay = previous.x, previous.y
+    cx, cy = following
+    best, best_area = bucket[0], -1.0
+    for sample in bucket:
+        area = abs((ax - cx) * (sample.y - ay) - (ax - sample.x) * (cy - ay))
+        if area > best_area:
+            best, best_area = sample, area
+    return best
+
+
+def _centroid(bucket: List[Sample]) -> Tuple[float, float]:
+    size = len(bucket)
+    return sum(sample.x for sample in bucket) / size, sum(sample.y for sample in bucket) / size
+
+
+def _in_order(low: Sample, high: Sample) -> List[Sample]:
+    if low is high:
+        return [low]
+    return [low, high] if low.x <= high.x else [high, low]
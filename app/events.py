@@ -2,43 +2,387 @@ from __future__ import annotations
 
 import asyncio
 import json
+import logging
 import threading
-from typing import Any, Dict, Optional, Set, Tuple
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple, Union
+
+from fastapi.encoders import jsonable_encoder
+
+from .config import get_settings
+
+try:  # pragma: no cover - optional dependency
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce")
+EVENT_BACKENDS = ("memory", "redis")
+PUBLISH_BUFFER = 1024
+RECONNECT_SECONDS = 1.0
+
+Payload = Union[Dict[str, Any], Callable[[], Dict[str, Any]]]
+# ``(event_id, event, json)`` as delivered to subscribers and kept for replay.
+Entry = Tuple[int, str, str]
+Deliver = Callable[[int, str, str], None]
+
+# Atomically number an event, append it to the replay list and broadcast it,
+# so ids are published in increasing order across all processes. The list is
+# trimmed to ``ARGV[2]`` entries and, through a running total kept in
+# ``KEYS[3]``, to ``ARGV[4]`` bytes (``0`` for no byte limit); the newest
+# entry is always kept.
+_PUBLISH_SCRIPT = """
+local id = redis.call('INCR', KEYS[1])
+local data = id .. '\\n' .. ARGV[1]
+local length = redis.call('RPUSH', KEYS[2], data)
+local size
+if length == 1 then
+  size = #data
+  redis.call('SET', KEYS[3], size)
+else
+  size = redis.call('INCRBY', KEYS[3], #data)
+end
+local max_entries = tonumber(ARGV[2])
+local max_bytes = tonumber(ARGV[4])
+while length > 1 and (length > max_entries or (max_bytes > 0 and size > max_bytes)) do
+  local oldest = redis.call('LPOP', KEYS[2])
+  size = redis.call('DECRBY', KEYS[3], #oldest)
+  length = length - 1
+end
+redis.call('PUBLISH', ARGV[3], data)
+return id
+"""
+
+
+class SubscriberQueue:
+    """Bounded per-subscriber buffer of ``(event_id, event, json)`` entries.
+
+    When full, ``drop_oldest`` discards the oldest pending message, while
+    ``coalesce`` first replaces a pending message of the same event name so a
+    slow reader still sees the latest state of every event type. Must only be
+    touched from the event loop thread.
+    """
+
+    def __init__(self, maxsize: int, policy: str) -> None:
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self._items: Deque[Entry] = deque()
+        self._ready = asyncio.Event()
+
+    def put(self, event_id: int, event: str, message: str) -> None:
+        if len(self._items) >= self.maxsize:
+            self.dropped += 1
+            if not (self.policy == "coalesce" and self._discard_pending(event)):
+                self._items.popleft()
+        self._items.append((event_id, event, message))
+        self._ready.set()
+
+    async def get(self) -> Entry:
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._items.popleft()
+
+    def _discard_pending(self, event: str) -> bool:
+        for index, (_, pending, _) in enumerate(self._items):
+            if pending == event:
+                del self._items[index]
+                return True
+        return False
+
+
+class MemoryEventBackend:
+    """Default backend: events only reach subscribers of this process.
+
+    Ids come from a process-local counter and the replay buffer holds the
+    most recent ``replay_size`` events, further trimmed to ``replay_max_bytes``
+    of serialized payload (``0`` for no byte limit; the newest event is always
+    kept).
+    """
+
+    name = "memory"
+    # Whether events must be published even with no local subscriber.
+    broadcasts = False
+
+    def __init__(self, replay_size: int = 0, replay_max_bytes: int = 0) -> None:
+        self._deliver: Optional[Deliver] = None
+        self._last_id = 0
+        self._replay_size = replay_size
+        self._replay_max_bytes = replay_max_bytes
+        self._recent: Deque[Tuple[Entry, int]] = deque()
+        self._recent_bytes = 0
+
+    def attach(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def start(self) -> None:
+        return None
+
+    async def stop(self) -> None:
+        return None
+
+    def publish(self, event: str, message: str) -> None:
+        self._last_id += 1
+        entry = (self._last_id, event, message)
+        if self._replay_size:
+            self._remember(entry)
+        self._deliver(*entry)
+
+    async def replay(self, after_id: int) -> Tuple[List[Entry], int]:
+        """Buffered events newer than ``after_id`` and the latest issued id."""
+        return [entry for entry, _ in self._recent if entry[0] > after_id], self._last_id
+
+    def _remember(self, entry: Entry) -> None:
+        size = len(entry[1]) + len(entry[2].encode("utf-8"))
+        self._recent.append((entry, size))
+        self._recent_bytes += size
+        while len(self._recent) > 1 and (
+            len(self._recent) > self._replay_size
+            or (self._replay_max_bytes and self._recent_bytes > self._replay_max_bytes)
+        ):
+            _, dropped = self._recent.popleft()
+            self._recent_bytes -= dropped
+
+
+class RedisEventBackend:
+    """Share events between processes through one Redis pub/sub channel.
+
+    Each process holds a single upstream subscription and fans messages out
+    to its local subscribers, including the ones it published itself.
+    Publishing goes through a bounded outbox drained by one task, so event
+    order is preserved and a slow Redis never blocks the caller. Ids come
+    from a shared ``INCR`` counter and the replay buffer is a list capped by
+    count and bytes, so a client may resume against any process.
+    """
+
+    name = "redis"
+    broadcasts = True
+
+    def __init__(self, client, channel: str, replay_size: int = 0, replay_max_bytes: int = 0) -> None:
+        self._client = client
+        self._channel = channel
+        self._replay_size = replay_size
+        self._replay_max_bytes = replay_max_bytes
+        self._seq_key = f"{channel}:seq"
+        self._replay_key = f"{channel}:replay"
+        self._replay_bytes_key = f"{channel}:replay:bytes"
+        self._publish_script = client.register_script(_PUBLISH_SCRIPT)
+        self._deliver: Optional[Deliver] = None
+        self._outbox: Optional[asyncio.Queue[str]] = None
+        self._tasks: List[asyncio.Task] = []
+        self._local_id = 0
+        self.dropped = 0
+
+    def attach(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._outbox = asyncio.Queue(maxsize=PUBLISH_BUFFER)
+        subscribed = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._listen(subscribed)),
+            asyncio.create_task(self._drain()),
+        ]
+        try:
+            await asyncio.wait_for(subscribed.wait(), timeout=RECONNECT_SECONDS * 5)
+        except asyncio.TimeoutError:
+            logger.warning("Event bus subscription to %s is still pending", self._channel)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._outbox = None
+
+    def publish(self, event: str, message: str) -> None:
+        if self._outbox is None:
+            # Not started (e.g. scripts without the app lifespan): stay local.
+            self._local_id += 1
+            self._deliver(self._local_id, event, message)
+            return
+        try:
+            self._outbox.put_nowait(f"{event}\n{message}")
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Event bus outbox full; dropping %s event", event)
+
+    async def _drain(self) -> None:
+        while True:
+            data = await self._outbox.get()
+            try:
+                await self._publish_script(
+                    keys=[self._seq_key, self._replay_key, self._replay_bytes_key],
+                    args=[data, max(self._replay_size, 1), self._channel, self._replay_max_bytes],
+                )
+            except Exception:  # pragma: no cover - depends on external service
+                logger.warning("Publishing to event bus failed", exc_info=True)
+
+    async def _listen(self, subscribed: asyncio.Event) -> None:
+        while True:
+            pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self._channel)
+                subscribed.set()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = message["data"]
+                    if isinstance(data, bytes):
+                        data = data.decode("utf-8")
+                    event_id, event, payload = data.split("\n", 2)
+                    self._deliver(int(event_id), event, payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pragma: no cover - depends on external service
+                logger.warning("Event bus subscription lost; reconnecting", exc_info=True)
+                await asyncio.sleep(RECONNECT_SECONDS)
+            finally:
+                await pubsub.aclose()
+
+    async def replay(self, after_id: int) -> Tuple[List[Entry], int]:
+        raw_entries = await self._client.lrange(self._replay_key, 0, -1)
+        latest = await self._client.get(self._seq_key)
+        entries = []
+        for raw in raw_entries:
+            if isinstance(raw, bytes):
+                raw = raw.decode("utf-8")
+            event_id, event, payload = raw.split("\n", 2)
+            if int(event_id) > after_id:
+                entries.append((int(event_id), event, payload))
+        return entries, int(latest or 0)
+
+
+def create_event_backend():
+    settings = get_settings()
+    if settings.event_backend not in EVENT_BACKENDS:
+        raise ValueError(f"Unsupported event backend: {settings.event_backend}")
+    if settings.event_backend == "memory":
+        return MemoryEventBackend(settings.sse_replay_size, settings.sse_replay_max_bytes)
+    if aioredis is None:
+        raise RuntimeError("EVENT_BACKEND=redis requires the redis package")
+    client = aioredis.Redis.from_url(settings.redis_connection_url)
+    return RedisEventBackend(
+        client, settings.event_channel, settings.sse_replay_size, settings.sse_replay_max_bytes
+    )
 
 
 class SSEManager:
-    """Lightweight server-sent event subscription hub."""
+    """Lightweight server-sent event subscription hub.
 
-    def __init__(self) -> None:
-        self._subscribers: Set[asyncio.Queue[Tuple[str, str]]] = set()
+    Publishing never blocks the caller: delivery is scheduled on the event
+    loop and the payload is built and serialized once per event. With the
+    in-memory backend nothing is built while nobody is subscribed, except
+    during a short grace period after the last subscriber leaves so that a
+    reconnecting client can replay what it missed. A broadcasting backend
+    always publishes, since other processes may be listening.
+    """
+
+    def __init__(
+        self,
+        queue_size: Optional[int] = None,
+        policy: Optional[str] = None,
+        backend=None,
+    ) -> None:
+        settings = get_settings()
+        self.queue_size = queue_size or settings.sse_queue_size
+        self.policy = policy or settings.sse_overflow_policy
+        if self.policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unsupported SSE overflow policy: {self.policy}")
+        self._subscribers: Set[SubscriberQueue] = set()
         self._lock = threading.Lock()
         self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._idle_since: Optional[float] = None
+        self._replay_grace = settings.sse_replay_grace_seconds if settings.sse_replay_size else 0
+        self.backend = backend or create_event_backend()
+        self.backend.attach(self._fan_out)
+
+    async def start(self) -> None:
+        await self.backend.start()
+
+    async def stop(self) -> None:
+        await self.backend.stop()
 
     def set_loop(self, loop: asyncio.AbstractEventLoop) -> None:
         self._loop = loop
 
-    def subscribe(self) -> asyncio.Queue[Tuple[str, str]]:
-        queue: asyncio.Queue[Tuple[str, str]] = asyncio.Queue()
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def subscribe(self) -> SubscriberQueue:
+        queue = SubscriberQueue(self.queue_size, self.policy)
         with self._lock:
             self._subscribers.add(queue)
         return queue
 
-    def unsubscribe(self, queue: asyncio.Queue[Tuple[str, str]]) -> None:
+    def unsubscribe(self, queue: SubscriberQueue) -> None:
         with self._lock:
             self._subscribers.discard(queue)
+            if not self._subscribers:
+                self._idle_since = time.monotonic()
+
+    async def replay(self, last_event_id: int) -> Tuple[List[Entry], bool]:
+        """Events after ``last_event_id`` and whether some could not be replayed.
+
+        An id newer than anything issued means the sequence restarted (for
+        example after a restart of the in-memory backend); the whole buffer is
+        then replayed and reported as incomplete.
+        """
+        entries, latest = await self.backend.replay(last_event_id)
+        if last_event_id > latest:
+            entries, _ = await self.backend.replay(0)
+            return entries, True
+        missing = latest > last_event_id and (not entries or entries[0][0] > last_event_id + 1)
+        return entries, missing
+
+    def _wants_events(self) -> bool:
+        if self._subscribers or self.backend.broadcasts:
+            return True
+        idle_since = self._idle_since
+        return idle_since is not None and time.monotonic() - idle_since < self._replay_grace
+
+    def emit(self, event: str, payload: Payload) -> None:
+        """Schedule delivery of ``payload`` to current subscribers.
+
+        ``payload`` may be a zero-argument callable; it is only invoked when
+        the event will actually be delivered or buffered for replay.
+        """
+        if not self._wants_events():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = self._loop
+            if not loop or not loop.is_running():
+                return
+            loop.call_soon_threadsafe(self._deliver, event, payload)
+            return
+        loop.call_soon(self._deliver, event, payload)
+
+    async def publish(self, event: str, payload: Payload) -> None:
+        self.emit(event, payload)
 
-    async def publish(self, event: str, payload: Dict[str, Any]) -> None:
-        message = json.dumps(payload, ensure_ascii=False)
+    def publish_from_thread(self, event: str, payload: Payload) -> None:
+        self.emit(event, payload)
+
+    def _deliver(self, event: str, payload: Payload) -> None:
+        if not self._wants_events():
+            return
+        data = payload() if callable(payload) else payload
+        self.backend.publish(event, json.dumps(jsonable_encoder(data), ensure_ascii=False))
+
+    def _fan_out(self, event_id: int, event: str, message: str) -> None:
         with self._lock:
             subscribers = list(self._subscribers)
         for queue in subscribers:
-            await queue.put((event, message))
-
-    def publish_from_thread(self, event: str, payload: Dict[str, Any]) -> None:
-        loop = self._loop
-        if not loop or not loop.is_running():
-            return
-        asyncio.run_coroutine_threadsafe(self.publish(event, payload), loop)
+            queue.put(event_id, event, message)
 
 
 event_manager = SSEManager()
@@ -0,0 +1,124 @@
+"""Streaming serializers for full-history metric exports."""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+from datetime import datetime
+from itertools import islice
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import urlencode
+
+from .catalog import is_series
+from .db import session_scope
+from .repositories import STREAM_BATCH_SIZE, MetricRepository
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+CSV_COLUMNS = [
+    "record_id",
+    "user_id",
+    "type",
+    "value",
+    "unit",
+    "recorded_at",
+    "source",
+    "metadata",
+    "tags",
+    "created_at",
+]
+FLUSH_BYTES = 64 * 1024
+
+
+def iter_export(
+    fmt: str,
+    *,
+    user_id: str,
+    type_code: Optional[str] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    source: Optional[str] = None,
+) -> Iterator[str]:
+    """Yield the export body in ~64 KiB chunks.
+
+    The generator owns its session because it outlives the request handler;
+    rows are read in keyset pages so memory stays flat, and the samples of
+    the series records of each page are fetched in one query.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n") if fmt == "csv" else None
+    if writer:
+        writer.writerow(CSV_COLUMNS)
+    with session_scope() as session:
+        repository = MetricRepository(session)
+        metrics = repository.iter_metrics(
+            user_id,
+            type_code=type_code,
+            start_time=start_time,
+            end_time=end_time,
+            source=source,
+        )
+        for page in iter(lambda: list(islice(metrics, STREAM_BATCH_SIZE)), []):
+            # Export the samples themselves so the file can be re-imported.
+            samples = repository.series.load_many(
+                metric for metric in page if is_series(metric.type_code)
+            )
+            for metric in page:
+                record = metric.to_dict()
+                if metric.id in samples:
+                    record["value"] = samples[metric.id].to_value()
+                if writer:
+                    writer.writerow(_csv_row(record))
+                else:
+                    buffer.write(json.dumps(_export_record(record), ensure_ascii=False))
+                    buffer.write("\n")
+                if buffer.tell() >= FLUSH_BYTES:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_url(arguments: Dict[str, Any]) -> str:
+    """Relative URL of the REST export matching MCP tool ``arguments``."""
+    params = {
+        key: arguments[key]
+        for key in ("user_id", "type", "start_time", "end_time", "source", "format")
+        if arguments.get(key) is not None
+    }
+    return f"/api/metrics/export?{urlencode(params)}"
+
+
+def _export_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    value = record["value"]
+    if value is None:
+        value = record["value_number"]
+    if value is None:
+        value = record["value_text"]
+    return {
+        "record_id": record["record_id"],
+        "user_id": record["user_id"],
+        "type": record["type"],
+        "value": value,
+        "unit": record["unit"],
+        "recorded_at": record["recorded_at"],
+        "source": record["source"],
+        "metadata": record["metadata"],
+        "tags": record["tags"],
+        "created_at": record["created_at"],
+    }
+
+
+def _csv_row(record: Dict[str, Any]) -> list:
+    exported = _export_record(record)
+    row = []
+    for column in CSV_COLUMNS:
+        value = exported[column]
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, ensure_ascii=False)
+        row.append("" if value is None else value)
+    return row
@@ -0,0 +1,248 @@
+"""Incremental NDJSON/CSV parsing and chunked, resumable bulk imports."""
+
+from __future__ import annotations
+
+import codecs
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import OperationalError
+
+from .db import session_scope
+from .events import event_manager
+from .models import MetricImport
+from .schemas import HealthStoreMetricInput
+from .services import MetricService
+
+IMPORT_FORMATS = {"ndjson", "csv"}
+
+
+class ImportConflict(ValueError):
+    """Another request is writing the same import job right now."""
+
+
+class RecordParser:
+    """Turn arbitrarily split body bytes into decoded record dicts."""
+
+    def __init__(self, fmt: str) -> None:
+        self.fmt = fmt
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._partial_line = ""
+        self._csv_record = ""
+        self._header: Optional[List[str]] = None
+
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        lines = (self._partial_line + self._decoder.decode(data)).split("\n")
+        self._partial_line = lines.pop()
+        records: List[Dict[str, Any]] = []
+        for line in lines:
+            records.extend(self._parse_line(line + "\n"))
+        return records
+
+    def close(self) -> List[Dict[str, Any]]:
+        tail = self._partial_line + self._decoder.decode(b"", final=True)
+        self._partial_line = ""
+        records = self._parse_line(tail) if tail else []
+        if self._csv_record:
+            raise ValueError("Unterminated quoted CSV field at end of input")
+        return records
+
+    def _parse_line(self, line: str) -> List[Dict[str, Any]]:
+        if self.fmt == "ndjson":
+            stripped = line.strip()
+            return [json.loads(stripped)] if stripped else []
+        # A quoted CSV field may span lines; wait until the quotes balance.
+        self._csv_record += line
+        if self._csv_record.count('"') % 2:
+            return []
+        row = next(csv.reader(io.StringIO(self._csv_record)), [])
+        self._csv_record = ""
+        if not any(row):
+            return []
+        if self._header is None:
+            self._header = row
+            return []
+        return [_csv_record(self._header, row)]
+
+
+def get_import(import_id: str) -> Optional[Dict[str, Any]]:
+    with session_scope() as session:
+        job = session.get(MetricImport, import_id)
+        return job.to_dict() if job else None
+
+
+def start_import(fmt: str, import_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Create a new import job, or reopen ``import_id`` for resumption."""
+    with session_scope() as session:
+        if import_id:
+            job = session.get(MetricImport, import_id)
+            if job is None:
+                return None
+            if job.format != fmt:
+                raise ValueError(f"Import {import_id} was started with format {job.format}")
+            if job.status != "completed":
+                job.status = "running"
+                job.error = None
+        else:
+            job = MetricImport(
+                format=fmt,
+                status="running",
+                committed_rows=0,
+                inserted_rows=0,
+                deduplicated_rows=0,
+            )
+            session.add(job)
+        session.flush()
+        return job.to_dict()
+
+
+def ingest_chunk(import_id: str, offset: int, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Store one chunk and advance the job's offset in the same transaction."""
+    with session_scope() as session:
+        try:
+            job = session.get(MetricImport, import_id, with_for_update=True)
+        except OperationalError as exc:
+            # Lock wait timeout or deadlock against a concurrent resume.
+            raise ImportConflict(f"Import {import_id} is locked by another request: {exc.orig}")
+        if job.committed_rows != offset:
+            raise ImportConflict(
+                f"Import {import_id} is at row {job.committed_rows}, expected {offset}; "
+                "is it being resumed concurrently?"
+            )
+        stored = MetricService(session).batch_store_metrics(records)
+        inserted = sum(1 for _, deduplicated in stored if not deduplicated)
+        job.committed_rows += len(records)
+        job.inserted_rows += inserted
+        job.deduplicated_rows += len(records) - inserted
+        session.flush()
+        return job.to_dict()
+
+
+def finish_import(import_id: str, status: str, error: Optional[str] = None) -> Dict[str, Any]:
+    with session_scope() as session:
+        job = session.get(MetricImport, import_id)
+        job.status = status
+        job.error = error
+        session.flush()
+        return job.to_dict()
+
+
+async def run_import(
+    job: Dict[str, Any], body: AsyncIterator[bytes], chunk_size: int
+) -> Dict[str, Any]:
+    """Parse ``body`` incrementally and commit it in ``chunk_size`` record chunks.
+
+    Records already committed by a previous attempt of the same job are
+    skipped, so a failed import resumes by re-sending the same body. An invalid
+    record stops the import right after the records before it are committed;
+    the result names it in ``blocking_record`` since resuming needs a body with
+    that record corrected. ``ImportConflict`` is raised, leaving the job as
+    it is, when a concurrent request owns the job.
+    """
+    import_id = job["import_id"]
+    parser = RecordParser(job["format"])
+    skip = offset = job["committed_rows"]
+    position = 0
+    chunk: List[Dict[str, Any]] = []
+
+    async def accept(records: List[Dict[str, Any]]) -> None:
+        nonlocal position
+        for record in records:
+            position += 1
+            if position <= skip:
+                continue
+            try:
+                kwargs = _store_kwargs(record)
+            except ValueError as exc:
+                await flush()
+                raise _InvalidRecord(position, exc)
+            chunk.append(kwargs)
+            if len(chunk) >= chunk_size:
+                await flush()
+
+    async def flush() -> None:
+        nonlocal offset, chunk
+        if not chunk:
+            return
+        progress = await run_in_threadpool(ingest_chunk, import_id, offset, chunk)
+        offset = progress["committed_rows"]
+        chunk = []
+        _publish("metrics.import.progress", progress)
+
+    try:
+        async for data in body:
+            await accept(parser.feed(data))
+        await accept(parser.close())
+        await flush()
+    except ImportConflict:
+        raise
+    except _InvalidRecord as exc:
+        error = (
+            f"Invalid record #{exc.position}: {exc.reason}; the records before it are committed, "
+            f"correct this record and re-send the body with import_id={import_id} to resume"
+        )
+        failed = await run_in_threadpool(finish_import, import_id, "failed", error)
+        _publish("metrics.import.failed", failed)
+        return {**failed, "blocking_record": exc.position}
+    except Exception as exc:
+        failed = await run_in_threadpool(finish_import, import_id, "failed", str(exc))
+        _publish("metrics.import.failed", failed)
+        if isinstance(exc, ValueError):
+            return failed
+        raise
+    completed = await run_in_threadpool(finish_import, import_id, "completed")
+    _publish("metrics.import.completed", completed)
+    return completed
+
+
+class _InvalidRecord(Exception):
+    def __init__(self, position: int, reason: ValueError) -> None:
+        super().__init__(position, reason)
+        self.position = position
+        self.reason = reason
+
+
+def _store_kwargs(record: Dict[str, Any]) -> Dict[str, Any]:
+    payload = HealthStoreMetricInput.parse_obj(record)
+    return {
+        "user_id": payload.user_id,
+        "type_code": payload.type,
+        "value": payload.value,
+        "unit": payload.unit,
+        "recorded_at": payload.recorded_at,
+        "source": payload.source,
+        "metadata": payload.metadata,
+        "tags": payload.tags,
+    }
+
+
+def _csv_record(header: List[str], row: List[str]) -> Dict[str, Any]:
+    record: Dict[str, Any] = {}
+    for column, raw in zip(header, row):
+        if raw == "":
+            continue
+        if column in {"metadata", "tags"}:
+            record[column] = json.loads(raw)
+        elif column == "value":
+            record[column] = _csv_value(raw)
+        else:
+            record[column] = raw
+    return record
+
+
+def _csv_value(raw: str) -> Any:
+    if raw[0] in "{[":
+        return json.loads(raw)
+    try:
+        return float(raw)
+    except ValueError:
+        return raw
+
+
+def _publish(event: str, payload: Dict[str, Any]) -> None:
+    timestamp = datetime.now(timezone.utc).isoformat()
+    event_manager.emit(event, lambda: {**payload, "timestamp": timestamp})
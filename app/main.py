@@ -3,16 +3,18 @@ import logging
 import secrets
 
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 
 from .admin_router import router as admin_router
 from .admin_service import ensure_default_admin
 from .api import router as api_router
 from .config import get_settings
-from .db import SessionLocal, engine
+from .db import SessionLocal, dispose_async_engine, engine
+from .db_init import STATS_LEADER_LOCK, LeaderLock, reconcile_stats
 from .events import event_manager
 from .mcp import router as mcp_router
-from .models import Base
+from .models import Base, detect_compact_storage
 
 settings = get_settings()
 
@@ -26,14 +28,50 @@ app.add_middleware(SessionMiddleware, secret_key=session_secret, max_age=60 * 60
 
 logger = logging.getLogger(__name__)
 
+_background_tasks = set()
+
+
+async def _reconcile_stats_periodically(interval: int) -> None:
+    # Only the worker holding the lock reconciles; the others retry each round
+    # so one of them takes over when the leader exits.
+    leader = LeaderLock(STATS_LEADER_LOCK)
+    # The first pass only fills empty statistics (fresh install or upgrade).
+    only_if_empty = True
+    try:
+        while True:
+            try:
+                if await run_in_threadpool(leader.acquire):
+                    await run_in_threadpool(reconcile_stats, only_if_empty)
+                    only_if_empty = False
+            except Exception:  # pragma: no cover - logged and retried next round
+                logger.exception("Statistics reconciliation failed")
+            await asyncio.sleep(interval)
+    finally:
+        leader.release()
+
 
 @app.on_event("startup")
 async def startup_event():
     event_manager.set_loop(asyncio.get_running_loop())
+    await event_manager.start()
+    detect_compact_storage(engine)
     Base.metadata.create_all(bind=engine)
     with SessionLocal() as session:
         ensure_default_admin(session, logger=logger)
         session.commit()
+    if settings.stats_reconcile_interval_seconds > 0:
+        task = asyncio.create_task(
+            _reconcile_stats_periodically(settings.stats_reconcile_interval_seconds)
+        )
+        _background_tasks.add(task)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in _background_tasks:
+        task.cancel()
+    await event_manager.stop()
+    await dispose_async_engine()
 
 
 @app.middleware("http")
@@ -2,60 +2,158 @@ from __future__ import annotations
 
 import asyncio
 import json
+import logging
 from datetime import datetime, timezone
-from typing import Any, Dict
+from functools import partial
+from typing import Any, Dict, List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Body, HTTPException, Request, Response
 from fastapi.concurrency import run_in_threadpool
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
 
-from .db import get_db
+from .config import get_settings
+from .db import async_session_scope, session_scope
 from .events import event_manager
-from .schemas import MCPRequest, MCPResponse
-from .services import MetricService
+from .export import EXPORT_FORMATS, export_url
+from .schemas import MCPRequest, MCPResponse, MultiTrendSummaryInput
+from .services import AsyncMetricService, MetricService
 
 router = APIRouter(prefix="/mcp", tags=["mcp"])
 
+logger = logging.getLogger(__name__)
+
 
 TOOLS = {
     "health_store_metric": "Store a single health metric record",
     "health_batch_store_metrics": "Store multiple health metric records in batch",
     "health_query_metrics": "Query stored metrics",
     "health_trend_summary": "Return aggregated trend information",
+    "health_multi_trend_summary": "Return aligned trend series for several (type, metric_field) pairs at once",
     "health_delete_record": "Delete a metric record",
     "health_list_metric_types": "List supported metric types",
+    "health_export_metrics": "Return a download URL streaming all matching records as NDJSON or CSV",
 }
 
 
 HEARTBEAT_SECONDS = 15
 
+METHODS = {"tools.list", "tools.call"}
+
+# JSON-RPC 2.0 error codes used for batch items.
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-@router.post("/tools", response_model=MCPResponse)
+@router.post("/tools", response_model=Union[MCPResponse, List[MCPResponse]])
 async def handle_json_rpc(
-    request: MCPRequest, session: Session = Depends(get_db)
-) -> Dict[str, Any]:
+    payload: Union[MCPRequest, List[Any]] = Body(...)
+):
+    """Serve a single JSON-RPC request or a JSON-RPC 2.0 batch.
+
+    Single requests keep reporting failures as HTTP errors. Batch items run
+    concurrently, bounded by ``MCP_BATCH_CONCURRENCY``, and failures become
+    per-item JSON-RPC error objects.
+    """
+    if isinstance(payload, MCPRequest):
+        return await _dispatch(payload)
+    return await _handle_batch(payload)
+
+
+async def _handle_batch(items: List[Any]):
+    settings = get_settings()
+    if not items:
+        return JSONResponse(
+            _batch_entry(_error_response(None, INVALID_REQUEST, "Invalid Request: empty batch"))
+        )
+    if len(items) > settings.mcp_batch_max_size:
+        message = f"Invalid Request: batch exceeds {settings.mcp_batch_max_size} items"
+        return JSONResponse(_batch_entry(_error_response(None, INVALID_REQUEST, message)))
+    semaphore = asyncio.Semaphore(settings.mcp_batch_concurrency)
+
+    async def run(item: Any) -> Optional[MCPResponse]:
+        async with semaphore:
+            return await _dispatch_batch_item(item)
+
+    responses = await asyncio.gather(*(run(item) for item in items))
+    body = [_batch_entry(response) for response in responses if response is not None]
+    if not body:
+        # A batch made only of notifications gets no body at all.
+        return Response(status_code=204)
+    return JSONResponse(body)
+
+
+def _batch_entry(response: MCPResponse) -> Dict[str, Any]:
+    """JSON-RPC response object carrying either ``result`` or ``error``, not both."""
+    entry = jsonable_encoder(response)
+    entry.pop("result" if response.error is not None else "error")
+    return entry
+
+
+async def _dispatch_batch_item(item: Any) -> Optional[MCPResponse]:
+    """Dispatch one batch entry; notifications (no ``id`` member) return None."""
+    if not isinstance(item, dict):
+        return _error_response(None, INVALID_REQUEST, "Invalid Request")
+    request_id = item.get("id")
+    try:
+        request = MCPRequest.parse_obj(item)
+    except ValidationError as exc:
+        return _error_response(request_id, INVALID_REQUEST, "Invalid Request", exc.errors())
+    try:
+        response = await _dispatch(request)
+    except HTTPException as exc:
+        response = _error_response(request.id, *_rpc_error(request, exc))
+    except (KeyError, TypeError, ValueError) as exc:
+        # Missing or mistyped tool arguments surface from the argument handling.
+        message = f"missing argument {exc}" if isinstance(exc, KeyError) else str(exc)
+        response = _error_response(request.id, INVALID_PARAMS, f"Invalid params: {message}")
+    except Exception:
+        logger.exception("MCP batch item %r failed", request.id)
+        response = _error_response(request.id, INTERNAL_ERROR, "Internal error")
+    return response if "id" in item else None
+
+
+def _rpc_error(request: MCPRequest, exc: HTTPException):
+    if request.jsonrpc != "2.0":
+        code = INVALID_REQUEST
+    elif request.method not in METHODS:
+        code = METHOD_NOT_FOUND
+    elif exc.status_code in (400, 404):
+        code = INVALID_PARAMS
+    else:
+        code = INTERNAL_ERROR
+    return code, str(exc.detail), {"status": exc.status_code}
+
+
+def _error_response(
+    request_id: Any, code: int, message: str, data: Any = None
+) -> MCPResponse:
+    error: Dict[str, Any] = {"code": code, "message": message}
+    if data is not None:
+        error["data"] = data
+    return MCPResponse(id=request_id, error=error)
+
+
+async def _dispatch(request: MCPRequest) -> MCPResponse:
     if request.jsonrpc != "2.0":
-        await event_manager.publish(
+        event_manager.emit(
             "mcp.error",
-            jsonable_encoder(
-                {
-                    "id": request.id,
-                    "method": request.method,
-                    "error": "Unsupported JSON-RPC version",
-                    "timestamp": _now_iso(),
-                }
-            ),
+            lambda: {
+                "id": request.id,
+                "method": request.method,
+                "error": "Unsupported JSON-RPC version",
+                "timestamp": _now_iso(),
+            },
         )
         raise HTTPException(status_code=400, detail="Unsupported JSON-RPC version")
 
-    service = MetricService(session)
-
     if request.method == "tools.list":
         response = MCPResponse(
             id=request.id,
@@ -66,15 +164,13 @@ async def handle_json_rpc(
                 ]
             },
         )
-        await event_manager.publish(
+        event_manager.emit(
             "mcp.tools.list",
-            jsonable_encoder(
-                {
-                    "id": request.id,
-                    "tool_names": list(TOOLS.keys()),
-                    "timestamp": _now_iso(),
-                }
-            ),
+            lambda: {
+                "id": request.id,
+                "tool_names": list(TOOLS.keys()),
+                "timestamp": _now_iso(),
+            },
         )
         return response
     if request.method == "tools.call":
@@ -82,69 +178,74 @@ async def handle_json_rpc(
         name = params.get("name")
         arguments = params.get("arguments", {})
         if name not in TOOLS:
-            await event_manager.publish(
+            event_manager.emit(
                 "mcp.tools.error",
-                jsonable_encoder(
-                    {
-                        "id": request.id,
-                        "method": request.method,
-                        "tool": name,
-                        "error": "Unknown tool",
-                        "timestamp": _now_iso(),
-                    }
-                ),
+                lambda: {
+                    "id": request.id,
+                    "method": request.method,
+                    "tool": name,
+                    "error": "Unknown tool",
+                    "timestamp": _now_iso(),
+                },
             )
             raise HTTPException(status_code=404, detail=f"Unknown tool: {name}")
         try:
-            result = await run_in_threadpool(_invoke_tool, name, arguments, service)
+            result = await _call_tool(name, arguments)
         except HTTPException as exc:
-            await event_manager.publish(
+            # ``exc`` is unbound once the handler exits; capture what the event needs.
+            error, status = exc.detail, exc.status_code
+            event_manager.emit(
                 "mcp.tools.error",
-                jsonable_encoder(
-                    {
-                        "id": request.id,
-                        "method": request.method,
-                        "tool": name,
-                        "error": exc.detail,
-                        "status": exc.status_code,
-                        "timestamp": _now_iso(),
-                    }
-                ),
-            )
-            raise
-        await event_manager.publish(
-            "mcp.tools.call",
-            jsonable_encoder(
-                {
+                lambda: {
                     "id": request.id,
+                    "method": request.method,
                     "tool": name,
-                    "arguments": arguments,
-                    "result": result,
+                    "error": error,
+                    "status": status,
                     "timestamp": _now_iso(),
-                }
-            ),
+                },
+            )
+            raise
+        event_manager.emit(
+            "mcp.tools.call",
+            lambda: {
+                "id": request.id,
+                "tool": name,
+                "arguments": arguments,
+                "result": result,
+                "timestamp": _now_iso(),
+            },
         )
         return MCPResponse(id=request.id, result=result)
 
-    await event_manager.publish(
+    event_manager.emit(
         "mcp.error",
-        jsonable_encoder(
-            {
-                "id": request.id,
-                "method": request.method,
-                "error": "Unknown method",
-                "timestamp": _now_iso(),
-            }
-        ),
+        lambda: {
+            "id": request.id,
+            "method": request.method,
+            "error": "Unknown method",
+            "timestamp": _now_iso(),
+        },
     )
     raise HTTPException(status_code=404, detail=f"Unknown method: {request.method}")
 
 
 @router.get("/stream")
 async def stream_events(request: Request) -> StreamingResponse:
+    """Stream events; a ``Last-Event-ID`` header replays what was missed.
+
+    The subscription is opened before reading the replay buffer so nothing
+    published in between is lost; live events already replayed are skipped.
+    """
     queue = event_manager.subscribe()
+    last_event_id = _parse_event_id(request.headers.get("last-event-id"))
+    backlog: List[Any] = []
+    missing = False
+    if last_event_id is not None:
+        backlog, missing = await event_manager.replay(last_event_id)
 
     async def event_generator():
+        last_sent = backlog[-1][0] if backlog else (last_event_id or 0)
         try:
             yield _format_sse(
                 "ready",
@@ -153,26 +254,61 @@ async def stream_events(request: Request) -> StreamingResponse:
                     "message": "MCP SSE stream established",
                 },
             )
+            if missing:
+                # Older events fell out of the replay buffer; the client
+                # should re-query instead of trusting the stream alone.
+                yield _format_sse(
+                    "stream.gap", {"last_event_id": last_event_id, "timestamp": _now_iso()}
+                )
+            for event_id, event, payload in backlog:
+                yield _format_sse_message(event, payload, event_id)
             while True:
                 if await request.is_disconnected():
                     break
                 try:
-                    event, payload = await asyncio.wait_for(
+                    event_id, event, payload = await asyncio.wait_for(
                         queue.get(), timeout=HEARTBEAT_SECONDS
                     )
                 except asyncio.TimeoutError:
                     yield _format_sse("heartbeat", {"timestamp": _now_iso()})
                     continue
-                yield _format_sse(event, json.loads(payload))
+                if event_id <= last_sent:
+                    continue
+                last_sent = event_id
+                yield _format_sse_message(event, payload, event_id)
         finally:
             event_manager.unsubscribe(queue)
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 
+def _parse_event_id(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
 def _format_sse(event: str, data: Dict[str, Any]) -> str:
-    payload = json.dumps(data, ensure_ascii=False)
-    return f"event: {event}\ndata: {payload}\n\n"
+    return _format_sse_message(event, json.dumps(data, ensure_ascii=False))
+
+
+def _format_sse_message(event: str, payload: str, event_id: Optional[int] = None) -> str:
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {payload}\n\n"
+
+
+async def _call_tool(name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a tool in its own transaction, natively async when MCP_ASYNC_DB is set."""
+    if get_settings().mcp_async_db:
+        async with async_session_scope() as session:
+            return await AsyncMetricService(session).run(partial(_invoke_tool, name, arguments))
+    return await run_in_threadpool(_invoke_tool_in_session, name, arguments)
+
+
+def _invoke_tool_in_session(name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    with session_scope() as session:
+        return _invoke_tool(name, arguments, MetricService(session))
 
 
 def _invoke_tool(name: str, arguments: Dict[str, Any], service: MetricService) -> Dict[str, Any]:
@@ -180,22 +316,35 @@ def _invoke_tool(name: str, arguments: Dict[str, Any], service: MetricService) -
         metric, dedup = _safe_store_metric(arguments, service)
         return {"record_id": metric.id, "deduplicated": dedup}
     if name == "health_batch_store_metrics":
-        records = []
-        for record in arguments.get("records", []):
-            metric, dedup = _safe_store_metric(record, service)
-            records.append({"record_id": metric.id, "deduplicated": dedup})
-        return {"records": records}
+        try:
+            stored = service.batch_store_metrics(
+                [_store_kwargs(record) for record in arguments.get("records", [])]
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        return {
+            "records": [
+                {"record_id": metric.id, "deduplicated": dedup} for metric, dedup in stored
+            ]
+        }
     if name == "health_query_metrics":
-        metrics = service.query_metrics(
-            user_id=arguments["user_id"],
-            type_code=arguments.get("type"),
-            limit=arguments.get("limit", 20),
-            order=arguments.get("order", "desc"),
-            start_time=arguments.get("start_time"),
-            end_time=arguments.get("end_time"),
-            source=arguments.get("source"),
-        )
-        return {"records": [metric.to_dict() for metric in metrics]}
+        try:
+            return service.query_metrics(
+                user_id=arguments["user_id"],
+                type_code=arguments.get("type"),
+                limit=arguments.get("limit", 20),
+                order=arguments.get("order", "desc"),
+                start_time=arguments.get("start_time"),
+                end_time=arguments.get("end_time"),
+                source=arguments.get("source"),
+                cursor=arguments.get("cursor"),
+                tags=arguments.get("tags"),
+                max_points=arguments.get("max_points"),
+                downsample_method=arguments.get("downsample", "lttb"),
+                metric_field=arguments.get("metric_field"),
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
     if name == "health_trend_summary":
         try:
             summary = service.trend_summary(
@@ -204,29 +353,55 @@ def _invoke_tool(name: str, arguments: Dict[str, Any], service: MetricService) -
                 metric_field=arguments.get("metric_field"),
                 group_by=arguments.get("group_by", "week"),
                 lookback_days=arguments.get("lookback_days"),
+                max_points=arguments.get("max_points"),
+                downsample_method=arguments.get("downsample", "lttb"),
             )
         except ValueError as exc:
             raise HTTPException(status_code=400, detail=str(exc))
         return summary
+    if name == "health_multi_trend_summary":
+        try:
+            payload = MultiTrendSummaryInput.parse_obj(arguments)
+            return service.multi_trend_summary(
+                user_id=payload.user_id,
+                series=payload.series_keys(),
+                group_by=payload.group_by,
+                lookback_days=payload.lookback_days,
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
     if name == "health_delete_record":
         deleted = service.delete_metric(arguments["user_id"], arguments["record_id"])
         return {"success": deleted, "message": None if deleted else "record not found"}
     if name == "health_list_metric_types":
         return {"types": service.list_metric_types()}
+    if name == "health_export_metrics":
+        fmt = arguments.get("format", "ndjson")
+        if fmt not in EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported export format: {fmt}")
+        return {
+            "format": fmt,
+            "media_type": EXPORT_FORMATS[fmt],
+            "url": export_url({**arguments, "format": fmt}),
+        }
     raise HTTPException(status_code=404, detail=f"Unsupported tool: {name}")
 
 
+def _store_kwargs(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "user_id": arguments["user_id"],
+        "type_code": arguments["type"],
+        "value": arguments.get("value"),
+        "unit": arguments.get("unit"),
+        "recorded_at": arguments.get("recorded_at"),
+        "source": arguments.get("source", "unknown"),
+        "metadata": arguments.get("metadata"),
+        "tags": arguments.get("tags"),
+    }
+
+
 def _safe_store_metric(arguments: Dict[str, Any], service: MetricService):
     try:
-        return service.store_metric(
-            user_id=arguments["user_id"],
-            type_code=arguments["type"],
-            value=arguments.get("value"),
-            unit=arguments.get("unit"),
-            recorded_at=arguments.get("recorded_at"),
-            source=arguments.get("source", "unknown"),
-            metadata=arguments.get("metadata"),
-            tags=arguments.get("tags"),
-        )
+        return service.store_metric(**_store_kwargs(arguments))
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc))
@@ -0,0 +1,108 @@
+"""Versioned schema migrations.
+
+``create_all`` only creates missing tables, so changes to existing tables are
+shipped as numbered revisions. Each revision module defines ``revision``,
+``down_revision``, ``upgrade(connection)`` and ``downgrade(connection)``;
+applied revisions are recorded in ``schema_migrations``. Revisions inspect
+the live schema before changing it, so a database already created from the
+current models is simply stamped.
+
+Opt-in data migrations with their own entry points (``compact_ids``) are not
+part of the revision chain.
+"""
+
+from __future__ import annotations
+
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, select
+from sqlalchemy.engine import Connection, Engine
+
+from . import (
+    r0001_query_indexes,
+    r0002_metric_fields,
+    r0003_metric_tags,
+    r0004_series_blocks,
+    r0005_archive,
+    r0006_rollup_backfill,
+    r0007_type_stat_shards,
+)
+
+logger = logging.getLogger(__name__)
+
+REVISIONS = [
+    r0001_query_indexes,
+    r0002_metric_fields,
+    r0003_metric_tags,
+    r0004_series_blocks,
+    r0005_archive,
+    r0006_rollup_backfill,
+    r0007_type_stat_shards,
+]
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("revision", String(32), primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def applied_revisions(connection: Connection) -> List[str]:
+    schema_migrations.create(connection, checkfirst=True)
+    return list(connection.execute(select(schema_migrations.c.revision)).scalars())
+
+
+def upgrade(engine: Engine, target: Optional[str] = None) -> List[str]:
+    """Apply pending revisions up to ``target`` (default: the latest)."""
+    with engine.begin() as connection:
+        applied = set(applied_revisions(connection))
+    done: List[str] = []
+    for module in _chain():
+        if module.revision not in applied:
+            with engine.begin() as connection:
+                module.upgrade(connection)
+                connection.execute(
+                    schema_migrations.insert().values(
+                        revision=module.revision, applied_at=datetime.utcnow()
+                    )
+                )
+            logger.info("Applied migration %s", module.revision)
+            done.append(module.revision)
+        if module.revision == target:
+            break
+    return done
+
+
+def downgrade(engine: Engine, target: Optional[str]) -> List[str]:
+    """Revert applied revisions newer than ``target`` (``None`` reverts all)."""
+    with engine.begin() as connection:
+        applied = set(applied_revisions(connection))
+    done: List[str] = []
+    for module in reversed(_chain()):
+        if module.revision == target:
+            break
+        if module.revision in applied:
+            with engine.begin() as connection:
+                module.downgrade(connection)
+                connection.execute(
+                    schema_migrations.delete().where(
+                        schema_migrations.c.revision == module.revision
+                    )
+                )
+            logger.info("Reverted migration %s", module.revision)
+            done.append(module.revision)
+    return done
+
+
+def _chain():
+    previous = None
+    for module in REVISIONS:
+        if module.down_revision != previous:
+            raise RuntimeError(
+                f"Migration {module.revision} follows {module.down_revision}, expected {previous}"
+            )
+        previous = module.revision
+    return REVISIONS
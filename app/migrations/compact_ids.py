@@ -0,0 +1,363 @@
+"""Online migration of record ids and dedup hashes to compact binary columns.
+
+``health_metrics`` is copied into a shadow table in primary-key order while
+the application keeps writing to the original. Rows changed during the copy
+are found again through ``updated_at`` (inserts and soft deletes both set it)
+and re-applied in catch-up passes. The side tables keyed by record id
+(``DEPENDENT_TABLES``) are backfilled the same way; their rows are only
+written together with a metric change or carry their own write time, so each
+pass also rewrites the keys those point at. Only the last, short pass runs
+with the tables locked, followed by an atomic rename.
+
+Records are only ever hard-deleted by archival, which writes a segment row
+per run; each pass also drops the shadow rows of records archived since the
+previous one. Application processes pick the id format when they start, so
+on MySQL the cutover waits until every other connection to the database is
+closed: stop the application once the catch-up passes run, and start it
+again after the swap.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import MetaData, Table, and_, delete, inspect, select, text, tuple_
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..models import (
+    HealthFileRecord,
+    HealthMetric,
+    HealthMetricArchiveSegment,
+    HealthMetricArchiveTombstone,
+    HealthMetricField,
+    HealthMetricSeriesBlock,
+    HealthMetricTag,
+    _CompactString,
+    detect_compact_storage,
+)
+from ..repositories import _upsert
+
+logger = logging.getLogger(__name__)
+
+COPY_BATCH_SIZE = 5000
+# Catch-up passes stop once a pass re-applies fewer rows than this; the rest
+# is applied while the tables are locked.
+FINAL_PASS_ROWS = 1000
+MAX_CATCH_UP_PASSES = 20
+# Margin for clock skew between application hosts writing ``updated_at``.
+CLOCK_SKEW = timedelta(seconds=60)
+# How long the cutover waits for the application to disconnect (MySQL).
+DRAIN_TIMEOUT_SECONDS = 900
+DRAIN_POLL_SECONDS = 5
+
+# Tables keyed by record id, copied alongside ``health_metrics``.
+DEPENDENT_TABLES = (
+    HealthFileRecord.__table__,
+    HealthMetricField.__table__,
+    HealthMetricTag.__table__,
+    HealthMetricSeriesBlock.__table__,
+    HealthMetricArchiveTombstone.__table__,
+)
+
+# Columns whose rows a dependent table rewrites together (a file's whole
+# mapping is replaced at once), and the column holding the write time of rows
+# not written together with a metric change.
+SYNC_KEYS = {HealthFileRecord.__tablename__: ("user_id", "file_hash")}
+WRITTEN_AT = {
+    HealthFileRecord.__tablename__: "created_at",
+    HealthMetricArchiveTombstone.__tablename__: "deleted_at",
+}
+
+SHADOW_SUFFIX = "__compact"
+BACKUP_SUFFIX = "__old"
+
+
+def migrate_to_compact_ids(
+    engine: Engine,
+    batch_size: int = COPY_BATCH_SIZE,
+    drain_timeout: float = DRAIN_TIMEOUT_SECONDS,
+) -> Dict[str, int]:
+    """Rewrite the metric tables with binary id and hash columns.
+
+    Requires ``COMPACT_IDS=true`` so the shadow tables get the compact column
+    types. On MySQL the original tables are kept as ``*__old``; on SQLite
+    they are dropped, since index names are global there.
+    """
+    if not get_settings().compact_ids:
+        raise ValueError("Set COMPACT_IDS=true before migrating to compact ids")
+    metrics = HealthMetric.__table__
+    if _is_compact(engine, metrics.name):
+        logger.info("%s already uses compact ids; nothing to do", metrics.name)
+        return {"copied": 0, "caught_up": 0}
+    mysql = engine.dialect.name == "mysql"
+    old = Table(metrics.name, MetaData(), autoload_with=engine)
+    shadow = _shadow(metrics, with_indexes=mysql)
+    dependents = [
+        (Table(table.name, MetaData(), autoload_with=engine), _shadow(table, with_indexes=mysql))
+        for table in DEPENDENT_TABLES
+    ]
+    for table in [shadow] + [copy for _, copy in dependents]:
+        table.drop(engine, checkfirst=True)
+        table.create(engine)
+
+    started = datetime.utcnow()
+    copied = _copy_all(engine, old, shadow, batch_size)
+    for original, copy in dependents:
+        copied += _copy_all(engine, original, copy, batch_size)
+    logger.info("Copied %s rows into the shadow tables", copied)
+    caught_up = 0
+    watermark = started - CLOCK_SKEW
+    for _ in range(MAX_CATCH_UP_PASSES):
+        pass_started = datetime.utcnow()
+        with Session(engine) as session, session.begin():
+            changed = _catch_up(session, old, shadow, dependents, watermark, batch_size)
+        caught_up += changed
+        watermark = pass_started - CLOCK_SKEW
+        if changed < FINAL_PASS_ROWS:
+            break
+
+    if mysql:
+        _wait_for_drain(engine, drain_timeout)
+    with Session(engine) as session, session.begin():
+        connection = session.connection()
+        pairs = [(old, shadow)] + dependents
+        if mysql:
+            connection.exec_driver_sql(
+                "LOCK TABLES "
+                + ", ".join(f"{table.name} WRITE" for pair in pairs for table in pair)
+                + f", {HealthMetricArchiveSegment.__tablename__} READ"
+            )
+        try:
+            caught_up += _catch_up(session, old, shadow, dependents, watermark, batch_size)
+            _swap(connection, mysql, [(original.name, copy.name) for original, copy in pairs])
+        finally:
+            if mysql:
+                connection.exec_driver_sql("UNLOCK TABLES")
+        if not mysql:
+            for table in [metrics] + list(DEPENDENT_TABLES):
+                for index in table.indexes:
+                    index.create(connection)
+    detect_compact_storage(engine)
+    logger.info("Swapped in compact tables (%s rows re-applied during catch-up)", caught_up)
+    return {"copied": copied, "caught_up": caught_up}
+
+
+def _is_compact(engine: Engine, table_name: str) -> bool:
+    for column in inspect(engine).get_columns(table_name):
+        if column["name"] == "id":
+            return column["type"].python_type is bytes
+    return False
+
+
+def _shadow(table: Table, with_indexes: bool) -> Table:
+    shadow = table.to_metadata(MetaData(), name=table.name + SHADOW_SUFFIX)
+    for column in shadow.columns:
+        if isinstance(column.type, _CompactString):
+            column.type = type(column.type)(compact=True)
+    if not with_indexes:
+        shadow.indexes.clear()
+    return shadow
+
+
+def _copy_all(engine: Engine, old: Table, shadow: Table, batch_size: int) -> int:
+    """Keyset-copy ``old`` into ``shadow``, one short transaction per batch."""
+    copied = 0
+    with engine.connect() as connection:
+        for rows in _keyset_batches(connection, old, None, batch_size, autocommit=True):
+            with engine.begin() as writer:
+                writer.execute(shadow.insert(), rows)
+            copied += len(rows)
+    return copied
+
+
+def _catch_up(
+    session: Session,
+    old: Table,
+    shadow: Table,
+    dependents: Sequence[Tuple[Table, Table]],
+    since: datetime,
+    batch_size: int,
+) -> int:
+    """Re-apply rows of ``old`` changed since ``since`` onto ``shadow``.
+
+    Rows archived since then are dropped, and rows of the dependent tables
+    under a changed record, or written since ``since``, are rewritten too.
+    Returns how many rows and keys were applied.
+    """
+    connection = session.connection()
+    record_ids: List[str] = []
+    for rows in _keyset_batches(connection, old, old.c.updated_at >= since, batch_size):
+        _upsert(session, shadow, rows, _replace_merge)
+        record_ids.extend(row["id"] for row in rows)
+    record_ids.extend(_drop_archived(connection, old, shadow, since, batch_size))
+    applied = len(record_ids)
+    for original, copy in dependents:
+        keys = _changed_keys(connection, original, copy, since, record_ids, batch_size)
+        _resync(connection, original, copy, keys, batch_size)
+        applied += len(keys)
+    return applied
+
+
+def _drop_archived(
+    connection: Connection, old: Table, shadow: Table, since: datetime, batch_size: int
+) -> List[str]:
+    """Delete the shadow rows of records archived out of ``old`` since ``since``.
+
+    Only the user and time range of each segment written since then are
+    compared, rather than every id of the table.
+    """
+    segments = HealthMetricArchiveSegment.__table__
+    stmt = select(segments.c.user_id, segments.c.start_at, segments.c.end_at).where(
+        segments.c.created_at >= since
+    )
+    dropped: List[str] = []
+    for user_id, start_at, end_at in connection.execute(stmt).all():
+        in_range = and_(
+            shadow.c.user_id == user_id, shadow.c.recorded_at.between(start_at, end_at)
+        )
+        for rows in _keyset_batches(connection, shadow, in_range, batch_size):
+            ids = [row["id"] for row in rows]
+            kept = set(connection.execute(select(old.c.id).where(old.c.id.in_(ids))).scalars())
+            gone = [record_id for record_id in ids if record_id not in kept]
+            if gone:
+                connection.execute(delete(shadow).where(shadow.c.id.in_(gone)))
+                dropped.extend(gone)
+    return dropped
+
+
+def _wait_for_drain(engine: Engine, timeout: float) -> None:
+    """Wait until this migration is the only client of the database.
+
+    Running application processes bind ids in the format they detected at
+    startup, so they must be stopped before the swap and restarted after it.
+    """
+    engine.dispose()
+    deadline = time.monotonic() + timeout
+    stmt = text(
+        "SELECT COUNT(*) FROM information_schema.PROCESSLIST "
+        "WHERE DB = DATABASE() AND ID <> CONNECTION_ID()"
+    )
+    while True:
+        with engine.connect() as connection:
+            others = connection.execute(stmt).scalar()
+        if not others:
+            return
+        if time.monotonic() >= deadline:
+            raise RuntimeError(
+                f"{others} other connections to the database are still open; "
+                "stop the application before the compact-id cutover"
+            )
+        logger.info(
+            "Waiting for %s other connections to close; stop the application to finish the cutover",
+            others,
+        )
+        time.sleep(DRAIN_POLL_SECONDS)
+
+
+def _keyset_batches(
+    connection: Connection, table: Table, condition, batch_size: int, autocommit: bool = False
+) -> Iterator[List[Dict]]:
+    """Rows of ``table`` matching ``condition`` in primary-key order, ``batch_size`` at a time.
+
+    Each batch is its own bounded query, so nothing is held open between
+    batches and the connection stays free for the writes in between. With
+    ``autocommit`` every batch reads in its own transaction.
+    """
+    primary_key = list(table.primary_key.columns)
+    position = _key(primary_key)
+    last: Optional[Tuple] = None
+    while True:
+        stmt = select(table).order_by(*primary_key).limit(batch_size)
+        if condition is not None:
+            stmt = stmt.where(condition)
+        if last is not None:
+            stmt = stmt.where(position > _key_value(last))
+        if autocommit:
+            with connection.begin():
+                rows = [dict(row) for row in connection.execute(stmt).mappings()]
+        else:
+            rows = [dict(row) for row in connection.execute(stmt).mappings()]
+        if not rows:
+            return
+        yield rows
+        last = tuple(rows[-1][column.name] for column in primary_key)
+
+
+def _changed_keys(
+    connection: Connection,
+    original: Table,
+    copy: Table,
+    since: datetime,
+    record_ids: Sequence[str],
+    batch_size: int,
+) -> Set[Tuple]:
+    """Sync keys of ``original`` to rewrite after the records in ``record_ids`` changed."""
+    names = SYNC_KEYS.get(original.name, ("record_id",))
+    keys: Set[Tuple] = set()
+    written_at = WRITTEN_AT.get(original.name)
+    if written_at is not None:
+        stmt = select(*(original.c[name] for name in names)).where(original.c[written_at] >= since)
+        keys.update(tuple(row) for row in connection.execute(stmt.distinct()))
+    for chunk in _chunks(record_ids, batch_size):
+        # The copy still holds keys whose rows were since removed from the original.
+        for table in (original, copy):
+            stmt = select(*(table.c[name] for name in names)).where(table.c.record_id.in_(chunk))
+            keys.update(tuple(row) for row in connection.execute(stmt.distinct()))
+    return keys
+
+
+def _resync(
+    connection: Connection, original: Table, copy: Table, keys: Iterable[Tuple], batch_size: int
+) -> None:
+    """Replace the rows of ``copy`` under ``keys`` with those of ``original``."""
+    names = SYNC_KEYS.get(original.name, ("record_id",))
+    for chunk in _chunks(sorted(keys), batch_size):
+        values = [_key_value(key) for key in chunk]
+        connection.execute(delete(copy).where(_key([copy.c[name] for name in names]).in_(values)))
+        stmt = select(original).where(_key([original.c[name] for name in names]).in_(values))
+        _copy_rows(connection, stmt, copy)
+
+
+def _copy_rows(connection: Connection, stmt, target: Table) -> None:
+    rows = [dict(row) for row in connection.execute(stmt).mappings()]
+    if rows:
+        connection.execute(target.insert(), rows)
+
+
+def _key(columns):
+    return columns[0] if len(columns) == 1 else tuple_(*columns)
+
+
+def _key_value(key: Tuple):
+    return key[0] if len(key) == 1 else key
+
+
+def _chunks(values: Sequence, size: int) -> Iterator[Sequence]:
+    for offset in range(0, len(values), size):
+        yield values[offset:offset + size]
+
+
+def _swap(connection: Connection, mysql: bool, pairs) -> None:
+    if mysql:
+        renames = []
+        for name, shadow_name in pairs:
+            renames.append(f"{name} TO {name}{BACKUP_SUFFIX}")
+            renames.append(f"{shadow_name} TO {name}")
+        connection.exec_driver_sql("RENAME TABLE " + ", ".join(renames))
+        return
+    for name, shadow_name in pairs:
+        connection.execute(text(f"DROP TABLE {name}"))
+        connection.execute(text(f"ALTER TABLE {shadow_name} RENAME TO {name}"))
+
+
+def _replace_merge(table, incoming, least, greatest) -> Dict:
+    return {
+        column.name: getattr(incoming, column.name)
+        for column in table.columns
+        if not column.primary_key
+    }
@@ -0,0 +1,65 @@
+"""Replace the single-column ``health_metrics`` indexes with composite ones.
+
+Reads always filter on ``user_id`` (when given) and ``deleted`` and page by
+``(recorded_at, id)``; the new indexes match those shapes so range scans stop
+at the page limit instead of filtering and sorting. ``uq_user_dedup`` stays
+and also serves lookups by ``user_id`` alone.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Tuple
+
+from sqlalchemy import Index, MetaData, Table, inspect, text
+from sqlalchemy.engine import Connection
+
+revision = "0001"
+down_revision = None
+
+TABLE = "health_metrics"
+
+ADDED: Dict[str, Tuple[str, ...]] = {
+    "idx_user_live_type_recorded": ("user_id", "deleted", "type_code", "recorded_at", "id"),
+    "idx_user_live_recorded": ("user_id", "deleted", "recorded_at", "id"),
+    "idx_live_recorded": ("deleted", "recorded_at", "id"),
+    "idx_live_created": ("deleted", "created_at"),
+}
+REMOVED: Dict[str, Tuple[str, ...]] = {
+    "ix_health_metrics_user_id": ("user_id",),
+    "ix_health_metrics_type_code": ("type_code",),
+    "ix_health_metrics_recorded_at": ("recorded_at",),
+    "ix_health_metrics_source": ("source",),
+    "ix_health_metrics_dedup_hash": ("dedup_hash",),
+    "idx_user_type_recorded": ("user_id", "type_code", "recorded_at"),
+}
+
+
+def upgrade(connection: Connection) -> None:
+    # Create the replacements first so reads never lose their index.
+    _create_indexes(connection, ADDED)
+    _drop_indexes(connection, REMOVED)
+
+
+def downgrade(connection: Connection) -> None:
+    _create_indexes(connection, REMOVED)
+    _drop_indexes(connection, ADDED)
+
+
+def _create_indexes(connection: Connection, indexes: Dict[str, Tuple[str, ...]]) -> None:
+    existing = _index_names(connection)
+    table = Table(TABLE, MetaData(), autoload_with=connection)
+    for name, columns in indexes.items():
+        if name not in existing:
+            Index(name, *(table.c[column] for column in columns)).create(connection)
+
+
+def _drop_indexes(connection: Connection, indexes: Dict[str, Tuple[str, ...]]) -> None:
+    existing = _index_names(connection)
+    mysql = connection.dialect.name == "mysql"
+    for name in indexes:
+        if name in existing:
+            connection.execute(text(f"DROP INDEX {name} ON {TABLE}" if mysql else f"DROP INDEX {name}"))
+
+
+def _index_names(connection: Connection) -> set:
+    return {index["name"] for index in inspect(connection).get_indexes(TABLE)}
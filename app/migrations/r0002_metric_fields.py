@@ -0,0 +1,66 @@
+"""Create ``health_metric_fields`` and backfill it from existing records."""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from sqlalchemy import and_, func, insert, select
+from sqlalchemy.engine import Connection
+
+from ..catalog import CATALOG
+from ..models import HealthMetric, HealthMetricField
+from ..rollups import field_values
+
+revision = "0002"
+down_revision = "0001"
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def upgrade(connection: Connection) -> None:
+    fields = HealthMetricField.__table__
+    fields.create(connection, checkfirst=True)
+    if connection.execute(select(func.count()).select_from(fields)).scalar():
+        return
+    type_codes = [item.type_code for item in CATALOG if item.value_schema == "object" and item.fields]
+    if not type_codes:
+        return
+    metrics = HealthMetric.__table__
+    last_id: Optional[str] = None
+    while True:
+        stmt = (
+            select(
+                metrics.c.id,
+                metrics.c.user_id,
+                metrics.c.type_code,
+                metrics.c.value_json,
+                metrics.c.recorded_at,
+            )
+            .where(and_(metrics.c.type_code.in_(type_codes), metrics.c.deleted.is_(False)))
+            .order_by(metrics.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        )
+        if last_id is not None:
+            stmt = stmt.where(metrics.c.id > last_id)
+        batch = connection.execute(stmt).all()
+        if not batch:
+            return
+        rows = [
+            {
+                "record_id": row.id,
+                "field": field,
+                "user_id": row.user_id,
+                "type_code": row.type_code,
+                "value": value,
+                "recorded_at": row.recorded_at,
+            }
+            for row in batch
+            for field, value in field_values(row.type_code, row.value_json).items()
+        ]
+        if rows:
+            connection.execute(insert(fields), rows)
+        last_id = batch[-1].id
+
+
+def downgrade(connection: Connection) -> None:
+    HealthMetricField.__table__.drop(connection, checkfirst=True)
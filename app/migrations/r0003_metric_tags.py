@@ -0,0 +1,49 @@
+"""Create the ``health_metric_tags`` inverted index and backfill it."""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from sqlalchemy import and_, func, insert, select
+from sqlalchemy.engine import Connection
+
+from ..models import HealthMetric, HealthMetricTag
+from ..utils import tag_pairs
+
+revision = "0003"
+down_revision = "0002"
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def upgrade(connection: Connection) -> None:
+    tags = HealthMetricTag.__table__
+    tags.create(connection, checkfirst=True)
+    if connection.execute(select(func.count()).select_from(tags)).scalar():
+        return
+    metrics = HealthMetric.__table__
+    last_id: Optional[str] = None
+    while True:
+        stmt = (
+            select(metrics.c.id, metrics.c.user_id, metrics.c.tags_json)
+            .where(and_(metrics.c.tags_json.isnot(None), metrics.c.deleted.is_(False)))
+            .order_by(metrics.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        )
+        if last_id is not None:
+            stmt = stmt.where(metrics.c.id > last_id)
+        batch = connection.execute(stmt).all()
+        if not batch:
+            return
+        rows = [
+            {"user_id": row.user_id, "tag_key": key, "tag_value": value, "record_id": row.id}
+            for row in batch
+            for key, value in tag_pairs(row.tags_json)
+        ]
+        if rows:
+            connection.execute(insert(tags), rows)
+        last_id = batch[-1].id
+
+
+def downgrade(connection: Connection) -> None:
+    HealthMetricTag.__table__.drop(connection, checkfirst=True)
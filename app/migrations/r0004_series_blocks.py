@@ -0,0 +1,19 @@
+"""Create ``health_metric_series_blocks`` for ``value_schema="series"`` records."""
+
+from __future__ import annotations
+
+from sqlalchemy.engine import Connection
+
+from ..models import HealthMetricSeriesBlock
+
+revision = "0004"
+down_revision = "0003"
+
+
+def upgrade(connection: Connection) -> None:
+    # Series types are new, so there is nothing to backfill.
+    HealthMetricSeriesBlock.__table__.create(connection, checkfirst=True)
+
+
+def downgrade(connection: Connection) -> None:
+    HealthMetricSeriesBlock.__table__.drop(connection, checkfirst=True)
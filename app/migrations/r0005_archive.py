@@ -0,0 +1,27 @@
+"""Create the bookkeeping tables of the cold-storage tier."""
+
+from __future__ import annotations
+
+from sqlalchemy import inspect, select
+from sqlalchemy.engine import Connection
+
+from ..models import HealthMetricArchiveSegment, HealthMetricArchiveTombstone
+
+revision = "0005"
+down_revision = "0004"
+
+
+def upgrade(connection: Connection) -> None:
+    # Nothing is archived before the first archival run.
+    HealthMetricArchiveSegment.__table__.create(connection, checkfirst=True)
+    HealthMetricArchiveTombstone.__table__.create(connection, checkfirst=True)
+
+
+def downgrade(connection: Connection) -> None:
+    segments = HealthMetricArchiveSegment.__table__
+    if inspect(connection).has_table(segments.name):
+        if connection.execute(select(segments.c.user_id).limit(1)).first() is not None:
+            # Dropping the table would make every archived record invisible.
+            raise RuntimeError("Archived records exist; refusing to drop the archive tables")
+    HealthMetricArchiveTombstone.__table__.drop(connection, checkfirst=True)
+    HealthMetricArchiveSegment.__table__.drop(connection, checkfirst=True)
@@ -0,0 +1,49 @@
+"""Backfill ``health_metric_rollups`` on databases that predate it.
+
+``create_all`` adds the table empty, and trend summaries read nothing but
+the rollups, so existing records would vanish from every trend until a
+manual ``--rebuild-rollups``.
+"""
+
+from __future__ import annotations
+
+import logging
+
+from sqlalchemy import select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from ..models import HealthMetric, HealthMetricRollup
+from ..repositories import ArchiveRepository, RollupRepository
+
+revision = "0006"
+down_revision = "0005"
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade(connection: Connection) -> None:
+    rollups = HealthMetricRollup.__table__
+    rollups.create(connection, checkfirst=True)
+    if connection.execute(select(rollups.c.user_id).limit(1)).first() is not None:
+        return
+    session = Session(bind=connection)
+    try:
+        user_ids = set(
+            session.execute(
+                select(HealthMetric.user_id).where(HealthMetric.deleted.is_(False)).distinct()
+            ).scalars()
+        )
+        user_ids.update(ArchiveRepository(session).user_ids())
+        repo = RollupRepository(session)
+        for user_id in sorted(user_ids):
+            count = repo.rebuild(user_id)
+            logger.info("Backfilled rollups for user %s from %s records", user_id, count)
+        session.flush()
+    finally:
+        session.close()
+
+
+def downgrade(connection: Connection) -> None:
+    # Rollups are derived data; 0005 and earlier simply ignore them.
+    pass
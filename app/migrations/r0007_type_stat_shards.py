@@ -0,0 +1,68 @@
+"""Spread ``health_metric_type_stats`` over ``shard`` rows per type.
+
+The per-type counts move into shard 0; writers then pick their own shard.
+The table only holds derived counters, so it is rebuilt rather than altered.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, insert, select
+from sqlalchemy.engine import Connection
+
+from ..models import MetricTypeStat
+
+revision = "0007"
+down_revision = "0006"
+
+TABLE = MetricTypeStat.__tablename__
+
+
+def upgrade(connection: Connection) -> None:
+    stats = MetricTypeStat.__table__
+    if not inspect(connection).has_table(TABLE):
+        stats.create(connection)
+        return
+    if "shard" in {column["name"] for column in inspect(connection).get_columns(TABLE)}:
+        return
+    rows = [
+        {"type_code": row.type_code, "shard": 0, "record_count": row.record_count, "updated_at": row.updated_at}
+        for row in connection.execute(select(_unsharded().c))
+    ]
+    _unsharded().drop(connection)
+    stats.create(connection)
+    if rows:
+        connection.execute(insert(stats), rows)
+
+
+def downgrade(connection: Connection) -> None:
+    stats = MetricTypeStat.__table__
+    if not inspect(connection).has_table(TABLE):
+        return
+    rows = [
+        {"type_code": row.type_code, "record_count": int(row.record_count), "updated_at": row.updated_at}
+        for row in connection.execute(
+            select(
+                stats.c.type_code,
+                func.sum(stats.c.record_count).label("record_count"),
+                func.max(stats.c.updated_at).label("updated_at"),
+            ).group_by(stats.c.type_code)
+        )
+    ]
+    stats.drop(connection)
+    unsharded = _unsharded()
+    unsharded.create(connection)
+    if rows:
+        connection.execute(insert(unsharded), rows)
+
+
+def _unsharded() -> Table:
+    """The table as created before this revision."""
+    return Table(
+        TABLE,
+        MetaData(),
+        Column("type_code", String(128), primary_key=True),
+        Column("record_count", Integer, nullable=False, default=0),
+        Column("updated_at", DateTime, nullable=False, default=datetime.utcnow),
+    )
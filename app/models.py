@@ -1,48 +1,176 @@
+import logging
 import uuid
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from sqlalchemy import (
     Boolean,
     Column,
+    Date,
     DateTime,
     Float,
+    Integer,
     String,
     Text,
     UniqueConstraint,
     Index,
+    LargeBinary,
+    inspect,
 )
+from sqlalchemy.dialects.mysql import BINARY
 from sqlalchemy.dialects.mysql import JSON as MySQLJSON
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.types import JSON
+from sqlalchemy.types import JSON, TypeDecorator
+
+from .config import get_settings
+from .utils import TAG_KEY_MAX_LENGTH, TAG_VALUE_MAX_LENGTH, uuid7
 
 Base = declarative_base()
 
+logger = logging.getLogger(__name__)
+
+
+# Whether the id columns of the connected database are compact; set at
+# startup by ``detect_compact_storage``, ``COMPACT_IDS`` decides until then.
+_compact_storage: Optional[bool] = None
+
+
+def compact_storage() -> bool:
+    return get_settings().compact_ids if _compact_storage is None else _compact_storage
+
+
+def detect_compact_storage(engine) -> bool:
+    """Follow the id format of the existing ``health_metrics`` table.
+
+    A new database gets the format of ``COMPACT_IDS``. A process keeps the
+    format it detected, so after ``--migrate-compact-ids`` swaps the tables
+    every application process must be restarted.
+    """
+    global _compact_storage
+    _compact_storage = None
+    inspector = inspect(engine)
+    if inspector.has_table(HealthMetric.__tablename__):
+        for column in inspector.get_columns(HealthMetric.__tablename__):
+            if column["name"] == "id":
+                _compact_storage = column["type"].python_type is bytes
+    if compact_storage() != get_settings().compact_ids:
+        logger.warning(
+            "COMPACT_IDS=%s does not match the id format of %s; following the database",
+            get_settings().compact_ids,
+            HealthMetric.__tablename__,
+        )
+    return compact_storage()
+
+
+class _CompactString(TypeDecorator):
+    """String in Python, optionally stored as fixed-width binary.
+
+    In compact storage the column is ``BINARY(n)`` (a BLOB on SQLite) and
+    values are packed on the way in and unpacked on the way out, so callers
+    always see the usual string form. ``compact=None`` follows the format of
+    the connected database (see ``detect_compact_storage``).
+    """
+
+    impl = String
+    string_length = 0
+    binary_length = 0
+
+    def __init__(self, compact: Optional[bool] = None):
+        super().__init__(self.string_length)
+        self.compact = compact
+
+    @property
+    def stored_compact(self) -> bool:
+        return compact_storage() if self.compact is None else self.compact
+
+    def load_dialect_impl(self, dialect):
+        if not self.stored_compact:
+            return dialect.type_descriptor(String(self.string_length))
+        if dialect.name == "mysql":
+            return dialect.type_descriptor(BINARY(self.binary_length))
+        return dialect.type_descriptor(LargeBinary(self.binary_length))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or not self.stored_compact:
+            return value
+        try:
+            return self.pack(value)
+        except ValueError:
+            # Malformed ids simply match nothing instead of failing the query.
+            return b""
+
+    def process_result_value(self, value, dialect):
+        # Decided by the value, so rows read across a format change still decode.
+        if value is None or isinstance(value, str):
+            return value
+        return self.unpack(bytes(value))
+
+
+class RecordId(_CompactString):
+    """UUID text, or its 16 raw bytes in compact storage."""
+
+    cache_ok = True
+    string_length = 36
+    binary_length = 16
+
+    @staticmethod
+    def pack(value: str) -> bytes:
+        return uuid.UUID(value).bytes
+
+    @staticmethod
+    def unpack(value: bytes) -> str:
+        return str(uuid.UUID(bytes=value))
+
+
+class HexDigest(_CompactString):
+    """SHA-256 hex digest, or its 32 raw bytes in compact storage."""
+
+    cache_ok = True
+    string_length = 64
+    binary_length = 32
+
+    @staticmethod
+    def pack(value: str) -> bytes:
+        return bytes.fromhex(value)
+
+    @staticmethod
+    def unpack(value: bytes) -> str:
+        return value.hex()
+
 
 class HealthMetric(Base):
     __tablename__ = "health_metrics"
 
-    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String(64), nullable=False, index=True)
-    type_code = Column(String(128), nullable=False, index=True)
+    id = Column(RecordId(), primary_key=True, default=uuid7)
+    user_id = Column(String(64), nullable=False)
+    type_code = Column(String(128), nullable=False)
     value_number = Column(Float, nullable=True)
     value_text = Column(Text, nullable=True)
     value_json = Column(MySQLJSON().with_variant(JSON, "sqlite"), nullable=True)
-    recorded_at = Column(DateTime, nullable=False, index=True)
-    source = Column(String(32), nullable=False, index=True)
+    recorded_at = Column(DateTime, nullable=False)
+    source = Column(String(32), nullable=False)
     unit = Column(String(32), nullable=True)
     metadata_json = Column(MySQLJSON().with_variant(JSON, "sqlite"), nullable=True)
     tags_json = Column(MySQLJSON().with_variant(JSON, "sqlite"), nullable=True)
-    dedup_hash = Column(String(64), nullable=False, index=True)
+    dedup_hash = Column(HexDigest(), nullable=False)
     deleted = Column(Boolean, nullable=False, default=False)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Every read filters on ``deleted`` and pages by ``(recorded_at, id)``;
+    # see ``app/query_plans.py`` for the query each index serves.
     __table_args__ = (
         UniqueConstraint("user_id", "dedup_hash", name="uq_user_dedup"),
-        Index("idx_user_type_recorded", "user_id", "type_code", "recorded_at"),
+        Index("idx_user_live_type_recorded", "user_id", "deleted", "type_code", "recorded_at", "id"),
+        Index("idx_user_live_recorded", "user_id", "deleted", "recorded_at", "id"),
+        Index("idx_live_recorded", "deleted", "recorded_at", "id"),
+        Index("idx_live_created", "deleted", "created_at"),
     )
 
+    # Decoded samples of a ``value_schema="series"`` record while it is being
+    # written or deleted; not a column.
+    samples = None
+
     def to_dict(self) -> Dict[str, Any]:
         return {
             "record_id": self.id,
@@ -62,6 +190,184 @@ class HealthMetric(Base):
         }
 
 
+class HealthMetricRollup(Base):
+    """Incrementally maintained per-bucket aggregates backing trend queries."""
+
+    __tablename__ = "health_metric_rollups"
+
+    user_id = Column(String(64), primary_key=True)
+    type_code = Column(String(128), primary_key=True)
+    metric_field = Column(String(64), primary_key=True, default="")
+    granularity = Column(String(8), primary_key=True)
+    bucket_start = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    total = Column(Float, nullable=False, default=0.0)
+    total_sq = Column(Float, nullable=False, default=0.0)
+    min_value = Column(Float, nullable=True)
+    max_value = Column(Float, nullable=True)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class HealthFileRecord(Base):
+    """Records stored from one uploaded file (``metadata.file_hash``), in order."""
+
+    __tablename__ = "health_file_records"
+
+    user_id = Column(String(64), primary_key=True)
+    file_hash = Column(String(128), primary_key=True)
+    position = Column(Integer, primary_key=True, autoincrement=False)
+    record_id = Column(RecordId(), nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class HealthMetricField(Base):
+    """Numeric sub-fields of live object-valued records, one row per field.
+
+    Filled at write time for the fields declared in the catalog and removed
+    when the record is deleted, so trend queries on a field are plain range
+    scans instead of per-row JSON extraction.
+    """
+
+    __tablename__ = "health_metric_fields"
+
+    record_id = Column(RecordId(), primary_key=True)
+    field = Column(String(64), primary_key=True)
+    user_id = Column(String(64), nullable=False)
+    type_code = Column(String(128), nullable=False)
+    value = Column(Float, nullable=False)
+    recorded_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("idx_field_user_type_recorded", "user_id", "type_code", "field", "recorded_at", "value"),
+    )
+
+
+class HealthMetricTag(Base):
+    """Inverted index of live records by ``(user_id, tag key, tag value)``.
+
+    The primary key is the posting list of each tag; ``record_id`` is
+    indexed so a deleted record's postings can be removed.
+    """
+
+    __tablename__ = "health_metric_tags"
+
+    user_id = Column(String(64), primary_key=True)
+    tag_key = Column(String(TAG_KEY_MAX_LENGTH), primary_key=True)
+    tag_value = Column(String(TAG_VALUE_MAX_LENGTH), primary_key=True)
+    record_id = Column(RecordId(), primary_key=True, index=True)
+
+
+class HealthMetricSeriesBlock(Base):
+    """Compressed sample blocks of ``value_schema="series"`` records.
+
+    ``payload`` holds up to ``SERIES_BLOCK_SIZE`` delta-encoded samples (see
+    ``app/series_codec.py``); the time span and aggregates of the block are
+    kept in plain columns so range reads only decode blocks they cut
+    through. Rows are removed when the record is deleted.
+    """
+
+    __tablename__ = "health_metric_series_blocks"
+
+    record_id = Column(RecordId(), primary_key=True)
+    block = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(String(64), nullable=False)
+    type_code = Column(String(128), nullable=False)
+    start_at = Column(DateTime, nullable=False)
+    end_at = Column(DateTime, nullable=False)
+    count = Column(Integer, nullable=False)
+    total = Column(Float, nullable=False)
+    total_sq = Column(Float, nullable=False)
+    min_value = Column(Float, nullable=False)
+    max_value = Column(Float, nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        Index("idx_series_user_type_start", "user_id", "type_code", "start_at"),
+    )
+
+
+class HealthMetricArchiveSegment(Base):
+    """Committed cold-storage segments of a user (see ``app/archive.py``).
+
+    A segment directory becomes visible only once its row is committed,
+    together with the removal of its records from ``health_metrics``.
+    ``start_at``/``end_at`` are rounded outwards to whole seconds.
+    """
+
+    __tablename__ = "health_metric_archive_segments"
+
+    user_id = Column(String(64), primary_key=True)
+    segment = Column(String(36), primary_key=True)
+    start_at = Column(DateTime, nullable=False)
+    end_at = Column(DateTime, nullable=False)
+    record_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class HealthMetricArchiveTombstone(Base):
+    """Archived records deleted after archival; segments themselves are immutable."""
+
+    __tablename__ = "health_metric_archive_tombstones"
+
+    record_id = Column(RecordId(), primary_key=True)
+    user_id = Column(String(64), nullable=False, index=True)
+    segment = Column(String(36), nullable=False)
+    type_code = Column(String(128), nullable=False)
+    deleted_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class MetricTypeStat(Base):
+    """Maintained per-type record counts backing the admin dashboard.
+
+    The count of a type is spread over ``shard`` rows and summed on read, so
+    concurrent writers of one type update different rows instead of queuing
+    on a single row lock.
+    """
+
+    __tablename__ = "health_metric_type_stats"
+
+    type_code = Column(String(128), primary_key=True)
+    shard = Column(Integer, primary_key=True, autoincrement=False, default=0)
+    record_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class MetricUserSketch(Base):
+    """HyperLogLog registers estimating the number of distinct users."""
+
+    __tablename__ = "health_metric_user_sketch"
+
+    slot = Column(Integer, primary_key=True, autoincrement=False)
+    max_rank = Column(Integer, nullable=False, default=0)
+
+
+class MetricImport(Base):
+    """Progress of a chunked bulk import, used to resume after failures."""
+
+    __tablename__ = "metric_imports"
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    format = Column(String(8), nullable=False)
+    status = Column(String(16), nullable=False, default="running")
+    committed_rows = Column(Integer, nullable=False, default=0)
+    inserted_rows = Column(Integer, nullable=False, default=0)
+    deduplicated_rows = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "import_id": self.id,
+            "format": self.format,
+            "status": self.status,
+            "committed_rows": self.committed_rows,
+            "inserted_rows": self.inserted_rows,
+            "deduplicated_rows": self.deduplicated_rows,
+            "error": self.error,
+        }
+
+
 class AdminUser(Base):
     __tablename__ = "admin_users"
 
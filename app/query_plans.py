@@ -0,0 +1,238 @@
+"""EXPLAIN checks that the hot metric queries use their index.
+
+Each shape mirrors a query issued by ``MetricRepository`` or the admin pages
+and names the index it is designed for. ``check_query_plans`` runs EXPLAIN
+(MySQL) or EXPLAIN QUERY PLAN (SQLite) on every shape and reports the index
+the optimizer actually chose and whether it added a sort step, so an index
+or query change that reintroduces a table scan shows up before it ships::
+
+    python -m app.db_init --check-query-plans
+
+``tests/test_query_plans.py`` runs the same checks against a seeded SQLite
+database on every test run.
+
+Indexes are compared by their column lists, which also covers the implicit
+name SQLite gives to ``uq_user_dedup``.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import and_, desc, func, select, text
+from sqlalchemy.orm import Session
+
+from .models import Base, HealthMetric, HealthMetricField, HealthMetricSeriesBlock
+from .repositories import SeriesRepository, TagRepository, keyset_condition
+
+SAMPLE_USER = "plan-check"
+SAMPLE_TYPE = "heart_rate"
+SAMPLE_HASH = "0" * 64
+SAMPLE_ID = "00000000-0000-7000-8000-000000000000"
+SAMPLE_END = datetime(2024, 1, 1)
+SAMPLE_START = SAMPLE_END - timedelta(days=30)
+
+# Expected-index marker for a table's primary key.
+PRIMARY_KEY = "PRIMARY"
+
+_SQLITE_INDEX = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+
+@dataclass
+class QueryShape:
+    name: str
+    index: str
+    build: Callable[[], object]
+    # Whether the index must also deliver the ORDER BY (no filesort/temp b-tree).
+    ordered: bool = True
+    table: str = HealthMetric.__tablename__
+
+
+@dataclass
+class PlanResult:
+    name: str
+    expected: str
+    used: Optional[str]
+    sorted_in_memory: bool
+    ok: bool
+
+
+def _live(*conditions):
+    return and_(HealthMetric.deleted.is_(False), *conditions)
+
+
+def _page_desc(stmt):
+    return stmt.order_by(HealthMetric.recorded_at.desc(), HealthMetric.id.desc()).limit(20)
+
+
+QUERY_SHAPES: List[QueryShape] = [
+    # MetricRepository.create_metric / _find_existing
+    QueryShape(
+        "dedup_lookup",
+        "uq_user_dedup",
+        lambda: select(HealthMetric).where(
+            _live(HealthMetric.user_id == SAMPLE_USER, HealthMetric.dedup_hash == SAMPLE_HASH)
+        ),
+        ordered=False,
+    ),
+    # MetricRepository.query_metrics with a type, next page
+    QueryShape(
+        "query_by_type",
+        "idx_user_live_type_recorded",
+        lambda: _page_desc(
+            select(HealthMetric).where(
+                _live(
+                    HealthMetric.user_id == SAMPLE_USER,
+                    HealthMetric.type_code == SAMPLE_TYPE,
+                    HealthMetric.recorded_at >= SAMPLE_START,
+                    keyset_condition((SAMPLE_END, SAMPLE_ID), "desc"),
+                )
+            )
+        ),
+    ),
+    # MetricRepository.query_metrics / iter_metrics across types
+    QueryShape(
+        "query_all_types",
+        "idx_user_live_recorded",
+        lambda: _page_desc(
+            select(HealthMetric).where(
+                _live(
+                    HealthMetric.user_id == SAMPLE_USER,
+                    HealthMetric.recorded_at >= SAMPLE_START,
+                )
+            )
+        ),
+    ),
+    # MetricRepository.aggregate_trend / RollupRepository._raw_extremes
+    QueryShape(
+        "trend_range",
+        "idx_user_live_type_recorded",
+        lambda: select(func.count(), func.min(HealthMetric.value_number)).where(
+            _live(
+                HealthMetric.user_id == SAMPLE_USER,
+                HealthMetric.type_code == SAMPLE_TYPE,
+                HealthMetric.recorded_at >= SAMPLE_START,
+                HealthMetric.recorded_at < SAMPLE_END,
+            )
+        ),
+        ordered=False,
+    ),
+    # MetricRepository.aggregate_trend on a materialized object field
+    QueryShape(
+        "field_trend_range",
+        "idx_field_user_type_recorded",
+        lambda: select(func.count(), func.min(HealthMetricField.value)).where(
+            and_(
+                HealthMetricField.user_id == SAMPLE_USER,
+                HealthMetricField.type_code == "sport/running_session",
+                HealthMetricField.field == "distance_km",
+                HealthMetricField.recorded_at >= SAMPLE_START,
+                HealthMetricField.recorded_at < SAMPLE_END,
+            )
+        ),
+        ordered=False,
+        table=HealthMetricField.__tablename__,
+    ),
+    # SeriesRepository: blocks of series records overlapping a time range
+    QueryShape(
+        "series_block_range",
+        "idx_series_user_type_start",
+        lambda: select(HealthMetricSeriesBlock.record_id).where(
+            SeriesRepository._range_condition(
+                SAMPLE_USER, "device/heart_rate_series", SAMPLE_START, SAMPLE_END
+            )
+        ),
+        ordered=False,
+        table=HealthMetricSeriesBlock.__tablename__,
+    ),
+    # TagRepository.matching: one primary-key range per tag pair
+    QueryShape(
+        "tag_intersection",
+        PRIMARY_KEY,
+        lambda: TagRepository.matching(
+            SAMPLE_USER, {("event", "race"), ("hospital", "X")}
+        ),
+        ordered=False,
+        table="health_metric_tags",
+    ),
+    # Admin metrics list without filters, next page
+    QueryShape(
+        "admin_list",
+        "idx_live_recorded",
+        lambda: _page_desc(
+            select(HealthMetric).where(_live(keyset_condition((SAMPLE_END, SAMPLE_ID), "desc")))
+        ),
+    ),
+    # Admin dashboard "recent records"
+    QueryShape(
+        "admin_recent",
+        "idx_live_created",
+        lambda: select(HealthMetric)
+        .where(_live())
+        .order_by(desc(HealthMetric.created_at))
+        .limit(10),
+    ),
+]
+
+
+def check_query_plans(session: Session) -> List[PlanResult]:
+    results = []
+    for shape in QUERY_SHAPES:
+        used, sorted_in_memory = _explain(session, shape.build(), shape.table)
+        expected_columns = _model_index_columns(shape.table, shape.index)
+        ok = used is not None and _db_index_columns(session, shape.table, used) == expected_columns
+        if shape.ordered and sorted_in_memory:
+            ok = False
+        results.append(PlanResult(shape.name, shape.index, used, sorted_in_memory, ok))
+    return results
+
+
+def _explain(session: Session, stmt, table: str) -> Tuple[Optional[str], bool]:
+    """Index chosen for ``table`` and whether rows are sorted afterwards."""
+    dialect = session.get_bind().dialect
+    compiled = stmt.compile(dialect=dialect)
+    connection = session.connection()
+    if dialect.name == "mysql":
+        rows = connection.exec_driver_sql(f"EXPLAIN {compiled}", compiled.params).mappings().all()
+        row = next((row for row in rows if row["table"] == table), None)
+        extra = " ".join(str(row.get("Extra") or "") for row in rows)
+        return (row["key"] if row else None), "Using filesort" in extra
+    if dialect.name == "sqlite":
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        details = [
+            row[-1]
+            for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)
+        ]
+        used = None
+        for detail in details:
+            match = _SQLITE_INDEX.search(detail)
+            if match and table in detail:
+                used = match.group(1)
+        return used, any("TEMP B-TREE" in detail for detail in details)
+    raise ValueError(f"Query plan checks are not supported on {dialect.name}")
+
+
+def _model_index_columns(table_name: str, name: str) -> Tuple[str, ...]:
+    table = Base.metadata.tables[table_name]
+    if name == PRIMARY_KEY:
+        return tuple(column.name for column in table.primary_key.columns)
+    for item in list(table.indexes) + list(table.constraints):
+        if item.name == name:
+            return tuple(column.name for column in item.columns)
+    raise ValueError(f"Unknown index: {name}")
+
+
+def _db_index_columns(session: Session, table: str, name: str) -> Tuple[str, ...]:
+    connection = session.connection()
+    if connection.dialect.name == "mysql":
+        rows = connection.execute(
+            text(f"SHOW INDEX FROM {table} WHERE Key_name = :name"), {"name": name}
+        ).mappings()
+        return tuple(
+            row["Column_name"] for row in sorted(rows, key=lambda row: row["Seq_in_index"])
+        )
+    rows = connection.exec_driver_sql(f"PRAGMA index_info('{name}')").all()
+    return tuple(row[2] for row in sorted(rows, key=lambda row: row[0]))
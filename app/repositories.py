@@ -1,20 +1,95 @@
 from __future__ import annotations
 
-from datetime import datetime
-from typing import Dict, List, Optional, Sequence
+import heapq
+import os
+import random
+import shutil
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from itertools import chain, islice, repeat
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 
-from sqlalchemy import and_, func, select, update
+import numpy as np
+from sqlalchemy import (
+    Numeric,
+    String,
+    and_,
+    case,
+    cast,
+    delete,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from .models import HealthMetric
+from .archive import Segment, open_segment, user_directory, write_segment
+from .cache import mark_dirty
+from .catalog import is_series, list_metric_types, materialized_fields
+from .config import get_settings
+from .models import (
+    HealthFileRecord,
+    HealthMetric,
+    HealthMetricArchiveSegment,
+    HealthMetricArchiveTombstone,
+    HealthMetricField,
+    HealthMetricRollup,
+    HealthMetricSeriesBlock,
+    HealthMetricTag,
+    MetricTypeStat,
+    MetricUserSketch,
+)
+from .rollups import (
+    GRANULARITIES,
+    NUMERIC_TEXT_PATTERN,
+    BucketStats,
+    bucket_from_label,
+    bucket_label,
+    bucket_start,
+    field_values,
+    metric_values,
+    next_bucket_start,
+)
+from .series_codec import BLOCK_MAX_SPAN, SampleSeries, decode_block, encode_block
+from .sketches import hll_estimate, hll_register
+from .utils import run_blocking, tag_pairs, uuid7
+
+BULK_CHUNK_SIZE = 500
+STREAM_BATCH_SIZE = 1000
+# Series blocks decoded per hand-off when streaming samples.
+SERIES_DECODE_BLOCKS = 32
+ROLLUP_REBUILD_BATCH_SIZE = 1000
+UPSERT_CHUNK_SIZE = 500
+STATS_RECONCILE_BATCH_SIZE = 10000
+TYPE_STAT_SHARDS = 16
+ORPHAN_SEGMENT_SECONDS = 3600
+
+RollupKey = Tuple[str, str, str, str, date]
+# ``(type_code, metric_field)`` of one trend series.
+SeriesKey = Tuple[str, Optional[str]]
 
 
 class MetricRepository:
     def __init__(self, session: Session):
         self.session = session
+        self.rollups = RollupRepository(session)
+        self.stats = StatsRepository(session)
+        self.files = FileRecordRepository(session)
+        self.fields = FieldRepository(session)
+        self.tags = TagRepository(session)
+        self.series = SeriesRepository(session)
+        self.archive = ArchiveRepository(session)
 
     def create_metric(self, metric: HealthMetric) -> HealthMetric:
+        archived = self.archive.duplicates(metric.user_id, [metric])
+        if archived:
+            return archived[metric.dedup_hash]
         self.session.add(metric)
         try:
             self.session.flush()
@@ -32,13 +107,83 @@ class MetricRepository:
             if existing is not None:
                 return existing
             raise
+        self.rollups.apply([metric])
+        self.stats.apply([metric])
+        self.fields.apply([metric])
+        self.tags.apply([metric])
+        self.series.apply([metric])
+        mark_dirty(self.session, metric.user_id, metric.type_code)
         return metric
 
-    def bulk_create(self, metrics: Sequence[HealthMetric]) -> List[HealthMetric]:
-        created: List[HealthMetric] = []
+    def bulk_create(self, metrics: Sequence[HealthMetric]) -> List[Tuple[HealthMetric, bool]]:
+        """Insert metrics set-wise, returning ``(metric, deduplicated)`` per input.
+
+        Existing ``(user_id, dedup_hash)`` pairs are resolved with one lookup per
+        chunk and only the new rows are written with a single multi-row INSERT.
+        Duplicates inside the batch resolve to the first occurrence.
+        """
+        results: List[Tuple[HealthMetric, bool]] = []
+        for start in range(0, len(metrics), BULK_CHUNK_SIZE):
+            results.extend(self._bulk_create_chunk(metrics[start:start + BULK_CHUNK_SIZE]))
+        return results
+
+    def _bulk_create_chunk(
+        self, metrics: Sequence[HealthMetric], retry: bool = True
+    ) -> List[Tuple[HealthMetric, bool]]:
+        existing = self._find_existing(metrics)
+        pending: Dict[Tuple[str, str], HealthMetric] = {}
+        results: List[Tuple[HealthMetric, bool]] = []
         for metric in metrics:
-            created.append(self.create_metric(metric))
-        return created
+            key = (metric.user_id, metric.dedup_hash)
+            if key in existing:
+                results.append((existing[key], True))
+            elif key in pending:
+                results.append((pending[key], True))
+            else:
+                _prepare_for_insert(metric)
+                pending[key] = metric
+                results.append((metric, False))
+        if not pending:
+            return results
+        rows = [_insert_values(metric) for metric in pending.values()]
+        try:
+            with self.session.begin_nested():
+                self.session.execute(insert(HealthMetric.__table__).values(rows))
+                self.rollups.apply(pending.values())
+                self.stats.apply(pending.values())
+                self.fields.apply(pending.values())
+                self.tags.apply(pending.values())
+                self.series.apply(pending.values())
+        except IntegrityError:
+            # A concurrent writer stored one of the rows between lookup and insert.
+            if not retry:
+                raise
+            return self._bulk_create_chunk(metrics, retry=False)
+        for user_id, type_code in {(m.user_id, m.type_code) for m in pending.values()}:
+            mark_dirty(self.session, user_id, type_code)
+        return results
+
+    def _find_existing(
+        self, metrics: Sequence[HealthMetric]
+    ) -> Dict[Tuple[str, str], HealthMetric]:
+        by_user: Dict[str, List[HealthMetric]] = {}
+        for metric in metrics:
+            by_user.setdefault(metric.user_id, []).append(metric)
+        existing: Dict[Tuple[str, str], HealthMetric] = {}
+        for user_id, user_metrics in by_user.items():
+            stmt = select(HealthMetric).where(
+                and_(
+                    HealthMetric.user_id == user_id,
+                    HealthMetric.dedup_hash.in_({metric.dedup_hash for metric in user_metrics}),
+                    HealthMetric.deleted.is_(False),
+                )
+            )
+            for metric in self.session.execute(stmt).scalars():
+                existing[(metric.user_id, metric.dedup_hash)] = metric
+            missing = [m for m in user_metrics if (user_id, m.dedup_hash) not in existing]
+            for dedup_hash, metric in self.archive.duplicates(user_id, missing).items():
+                existing[(user_id, dedup_hash)] = metric
+        return existing
 
     def query_metrics(
         self,
@@ -49,7 +194,15 @@ class MetricRepository:
         start_time: Optional[datetime] = None,
         end_time: Optional[datetime] = None,
         source: Optional[str] = None,
+        after: Optional[Tuple[datetime, str]] = None,
+        tags: Optional[Set[Tuple[str, str]]] = None,
     ) -> List[HealthMetric]:
+        """Return one page ordered by ``(recorded_at, id)``.
+
+        ``after`` is the keyset position of the last row of the previous page;
+        ``tags`` are ``(key, value)`` pairs that must all be present. Archived
+        records are merged into the page.
+        """
         stmt = select(HealthMetric).where(
             and_(HealthMetric.user_id == user_id, HealthMetric.deleted.is_(False))
         )
@@ -61,27 +214,176 @@ class MetricRepository:
             stmt = stmt.where(HealthMetric.recorded_at <= end_time)
         if source:
             stmt = stmt.where(HealthMetric.source == source)
-        stmt = stmt.order_by(
-            HealthMetric.recorded_at.asc() if order == "asc" else HealthMetric.recorded_at.desc()
-        )
+        if tags:
+            stmt = stmt.where(HealthMetric.id.in_(self.tags.matching(user_id, tags)))
+        if after:
+            stmt = stmt.where(keyset_condition(after, order))
+        if order == "asc":
+            stmt = stmt.order_by(HealthMetric.recorded_at.asc(), HealthMetric.id.asc())
+        else:
+            stmt = stmt.order_by(HealthMetric.recorded_at.desc(), HealthMetric.id.desc())
         if limit:
             stmt = stmt.limit(limit)
-        return list(self.session.execute(stmt).scalars().all())
+        metrics = list(self.session.execute(stmt).scalars().all())
+        return self.archive.page(
+            metrics,
+            user_id,
+            type_code=type_code,
+            limit=limit,
+            order=order,
+            start_time=start_time,
+            end_time=end_time,
+            source=source,
+            after=after,
+            tags=tags,
+        )
 
-    def delete_metric(self, user_id: str, record_id: str) -> bool:
-        stmt = (
-            update(HealthMetric)
-            .where(
-                and_(
-                    HealthMetric.id == record_id,
-                    HealthMetric.user_id == user_id,
-                    HealthMetric.deleted.is_(False),
-                )
+    def iter_metrics(
+        self,
+        user_id: str,
+        type_code: Optional[str] = None,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        source: Optional[str] = None,
+    ) -> Iterator[HealthMetric]:
+        """Stream matching rows in ``(recorded_at, id)`` order, ``STREAM_BATCH_SIZE`` at a time.
+
+        Archived records are merged into the stream. Live rows are read in
+        keyset pages, so the session can run other queries in between.
+        """
+        archived = self.archive.metrics(user_id, type_code, start_time, end_time, source)
+        yield from heapq.merge(
+            self._iter_live(user_id, type_code, start_time, end_time, source),
+            archived,
+            key=_metric_order,
+        )
+
+    def _iter_live(
+        self,
+        user_id: str,
+        type_code: Optional[str],
+        start_time: Optional[datetime],
+        end_time: Optional[datetime],
+        source: Optional[str],
+    ) -> Iterator[HealthMetric]:
+        stmt = select(HealthMetric).where(
+            and_(HealthMetric.user_id == user_id, HealthMetric.deleted.is_(False))
+        )
+        if type_code:
+            stmt = stmt.where(HealthMetric.type_code == type_code)
+        if start_time:
+            stmt = stmt.where(HealthMetric.recorded_at >= start_time)
+        if end_time:
+            stmt = stmt.where(HealthMetric.recorded_at <= end_time)
+        if source:
+            stmt = stmt.where(HealthMetric.source == source)
+        for page in keyset_pages(self.session, stmt, STREAM_BATCH_SIZE):
+            for metric in page:
+                yield metric
+                self.session.expunge(metric)
+
+    def series_samples(
+        self,
+        user_id: str,
+        type_code: str,
+        metric_field: Optional[str] = None,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        source: Optional[str] = None,
+        tags: Optional[Set[Tuple[str, str]]] = None,
+    ) -> Tuple[int, Iterator[Tuple[datetime, str, float]]]:
+        """Count numeric samples of one series and stream them in time order.
+
+        Returns the sample count and a lazy iterator of ``(recorded_at,
+        record_id, value)`` read through a server-side cursor, so callers
+        can size downsampling buckets before consuming the stream. Only the
+        three columns are fetched; records without a numeric value are
+        skipped in the database.
+        """
+        if is_series(type_code):
+            return self.series.samples(user_id, type_code, start_time, end_time, source, tags)
+        if source is None and FieldRepository.is_materialized(type_code, metric_field):
+            table = HealthMetricField.__table__
+            ts, record_id, value = table.c.recorded_at, table.c.record_id, table.c.value
+            condition = and_(
+                table.c.user_id == user_id,
+                table.c.type_code == type_code,
+                table.c.field == metric_field,
             )
-            .values(deleted=True, updated_at=func.now())
+        else:
+            ts, record_id = HealthMetric.recorded_at, HealthMetric.id
+            value = _value_expression(metric_field)
+            condition = and_(
+                HealthMetric.user_id == user_id,
+                HealthMetric.type_code == type_code,
+                HealthMetric.deleted.is_(False),
+            )
+            if source:
+                condition = and_(condition, HealthMetric.source == source)
+        condition = and_(condition, value.isnot(None))
+        if start_time:
+            condition = and_(condition, ts >= start_time)
+        if end_time:
+            condition = and_(condition, ts <= end_time)
+        if tags:
+            condition = and_(condition, record_id.in_(self.tags.matching(user_id, tags)))
+        archived = self.archive.samples(
+            user_id,
+            type_code,
+            metric_field,
+            source is None and FieldRepository.is_materialized(type_code, metric_field),
+            start_time,
+            end_time,
+            source,
+            tags,
+        )
+        total = self.session.execute(select(func.count()).where(condition)).scalar_one()
+        stmt = (
+            select(ts, record_id, value)
+            .where(condition)
+            .order_by(ts.asc(), record_id.asc())
+            .execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE)
         )
-        result = self.session.execute(stmt)
-        return result.rowcount > 0
+
+        def rows() -> Iterator[Tuple[datetime, str, float]]:
+            for recorded_at, sample_id, sample in self.session.execute(stmt):
+                yield recorded_at, sample_id, float(sample)
+
+        if not archived:
+            return total, rows()
+        return total + len(archived), heapq.merge(rows(), archived, key=lambda row: row[:2])
+
+    def delete_metric(self, user_id: str, record_id: str) -> bool:
+        condition = and_(
+            HealthMetric.id == record_id,
+            HealthMetric.user_id == user_id,
+            HealthMetric.deleted.is_(False),
+        )
+        metric = self.session.execute(select(HealthMetric).where(condition)).scalar_one_or_none()
+        if metric is None:
+            metric = self.archive.delete(user_id, record_id)
+            if metric is None:
+                return False
+        else:
+            stmt = (
+                update(HealthMetric)
+                .where(condition)
+                .values(deleted=True, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            result = self.session.execute(stmt)
+            if result.rowcount == 0:
+                return False
+        # Before the rollups, whose min/max recomputation reads the field and
+        # series tables; the series blocks are decoded onto ``metric`` first.
+        self.fields.retract(metric)
+        self.series.retract(metric)
+        self.rollups.retract(metric)
+        self.stats.retract(metric)
+        self.files.forget(metric)
+        self.tags.retract(metric)
+        mark_dirty(self.session, metric.user_id, metric.type_code)
+        return True
 
     def list_for_trend(
         self,
@@ -100,44 +402,1516 @@ class MetricRepository:
         if start_time:
             stmt = stmt.where(HealthMetric.recorded_at >= start_time)
         stmt = stmt.order_by(HealthMetric.recorded_at.asc())
-        return list(self.session.execute(stmt).scalars().all())
+        metrics = list(self.session.execute(stmt).scalars().all())
+        archived = self.archive.metrics(user_id, type_code, start_time)
+        return list(heapq.merge(metrics, archived, key=lambda metric: metric.recorded_at))
 
+    def trend_buckets(
+        self,
+        user_id: str,
+        type_code: str,
+        metric_field: Optional[str],
+        group_by: str,
+        start_time: Optional[datetime],
+    ) -> List[Tuple[date, BucketStats]]:
+        series = (type_code, metric_field)
+        return self.trend_series(user_id, [series], group_by, start_time)[series]
 
-def group_by_timepoints(
-    metrics: Sequence[HealthMetric],
-    group_by: str,
-    metric_field: Optional[str] = None,
-) -> Dict[str, Dict[str, float]]:
-    buckets: Dict[str, Dict[str, float]] = {}
-    for metric in metrics:
-        ts = metric.recorded_at
-        if group_by == "day":
-            key = ts.strftime("%Y-%m-%d")
-        elif group_by == "week":
-            key = f"{ts.strftime('%Y')}-W{ts.isocalendar().week:02d}"
-        elif group_by == "month":
-            key = ts.strftime("%Y-%m")
+    def trend_series(
+        self,
+        user_id: str,
+        series: Sequence[SeriesKey],
+        group_by: str,
+        start_time: Optional[datetime],
+    ) -> Dict[SeriesKey, List[Tuple[date, BucketStats]]]:
+        """Return ``(bucket start, statistics)`` of each ``(type_code, metric_field)``.
+
+        Whole buckets of every series come from ``health_metric_rollups`` in
+        one query; when ``start_time`` falls inside a bucket, that partial head
+        bucket is aggregated from the raw rows so the result matches a scan of
+        ``recorded_at >= start_time``.
+        """
+        first_whole: Optional[date] = None
+        heads: Dict[SeriesKey, List[Tuple[date, BucketStats]]] = {key: [] for key in series}
+        if start_time:
+            first_whole = bucket_start(start_time, group_by)
+            if start_time != datetime.combine(first_whole, time.min):
+                first_whole = next_bucket_start(first_whole, group_by)
+                for type_code, metric_field in heads:
+                    partial = self.aggregate_trend(
+                        user_id,
+                        type_code,
+                        metric_field,
+                        group_by,
+                        start_time,
+                        datetime.combine(first_whole, time.min),
+                    )
+                    heads[(type_code, metric_field)] = [
+                        (bucket_from_label(label, group_by), stats) for label, stats in partial
+                    ]
+        tails = self.rollups.fetch(user_id, list(heads), group_by, first_whole)
+        return {key: head + tails[key] for key, head in heads.items()}
+
+    def aggregate_trend(
+        self,
+        user_id: str,
+        type_code: str,
+        metric_field: Optional[str],
+        group_by: str,
+        start_time: Optional[datetime],
+        end_time: Optional[datetime] = None,
+    ) -> List[Tuple[str, BucketStats]]:
+        """Aggregate raw rows per bucket in the database, ``end_time`` exclusive.
+
+        Materialized object fields are read from ``health_metric_fields`` and
+        series samples from their blocks; anything else is extracted from the
+        record columns. Archived records are added per bucket.
+        """
+        if is_series(type_code):
+            return [
+                (bucket_label(start, group_by), stats)
+                for start, stats in self.series.aggregate(
+                    user_id, type_code, group_by, start_time, end_time
+                )
+            ]
+        fields_only = FieldRepository.is_materialized(type_code, metric_field)
+        if fields_only:
+            table = HealthMetricField.__table__
+            ts, value = table.c.recorded_at, table.c.value
+            condition = and_(
+                table.c.user_id == user_id,
+                table.c.type_code == type_code,
+                table.c.field == metric_field,
+            )
+        else:
+            ts, value = HealthMetric.recorded_at, _value_expression(metric_field)
+            condition = and_(
+                HealthMetric.user_id == user_id,
+                HealthMetric.type_code == type_code,
+                HealthMetric.deleted.is_(False),
+            )
+        bucket = _bucket_expression(self.session.get_bind().dialect.name, group_by, ts)
+        stmt = select(
+            bucket.label("bucket"),
+            func.count(value).label("count"),
+            func.sum(value).label("total"),
+            func.sum(value * value).label("total_sq"),
+            func.min(value).label("min_value"),
+            func.max(value).label("max_value"),
+        ).where(condition)
+        if start_time:
+            stmt = stmt.where(ts >= start_time)
+        if end_time:
+            stmt = stmt.where(ts < end_time)
+        stmt = stmt.group_by("bucket").order_by("bucket")
+        buckets = {
+            row.bucket: BucketStats(
+                count=int(row.count),
+                total=float(row.total),
+                total_sq=float(row.total_sq),
+                min_value=float(row.min_value),
+                max_value=float(row.max_value),
+            )
+            for row in self.session.execute(stmt)
+            if row.count
+        }
+        archived = self.archive.samples(
+            user_id,
+            type_code,
+            metric_field,
+            fields_only,
+            start_time,
+            end_time,
+            inclusive_end=False,
+        )
+        for recorded_at, _, sample in archived:
+            label = bucket_label(bucket_start(recorded_at, group_by), group_by)
+            buckets.setdefault(label, BucketStats()).add(sample)
+        # Labels of every granularity sort chronologically.
+        return sorted(buckets.items())
+
+
+class RollupRepository:
+    """Maintain ``health_metric_rollups`` alongside metric writes."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def apply(self, metrics: Iterable[HealthMetric]) -> None:
+        deltas: Dict[RollupKey, BucketStats] = defaultdict(BucketStats)
+        for metric in metrics:
+            for field, granularity, start, stats in self._contributions(metric):
+                deltas[(metric.user_id, metric.type_code, field, granularity, start)].merge(stats)
+        self._upsert(deltas)
+
+    def retract(self, metric: HealthMetric) -> None:
+        table = HealthMetricRollup.__table__
+        for field, granularity, start, removed in self._contributions(metric):
+            key = and_(
+                table.c.user_id == metric.user_id,
+                table.c.type_code == metric.type_code,
+                table.c.metric_field == field,
+                table.c.granularity == granularity,
+                table.c.bucket_start == start,
+            )
+            self.session.execute(
+                update(table)
+                .where(key)
+                .values(
+                    count=table.c.count - removed.count,
+                    total=table.c.total - removed.total,
+                    total_sq=table.c.total_sq - removed.total_sq,
+                )
+            )
+            row = self.session.execute(
+                select(table.c.count, table.c.min_value, table.c.max_value).where(key)
+            ).one_or_none()
+            if row is None:
+                continue
+            if row.count <= 0:
+                self.session.execute(delete(table).where(key))
+            elif removed.min_value <= row.min_value or removed.max_value >= row.max_value:
+                # A removed value may have been the extreme; recompute from the bucket.
+                low, high = self._raw_extremes(metric, field, start, granularity)
+                self.session.execute(
+                    update(table).where(key).values(min_value=low, max_value=high)
+                )
+
+    def _contributions(
+        self, metric: HealthMetric
+    ) -> Iterator[Tuple[str, str, date, BucketStats]]:
+        """``(metric_field, granularity, bucket start, stats)`` a record adds to the rollups.
+
+        Series samples are spread over the buckets of their own timestamps.
+        """
+        if is_series(metric.type_code):
+            samples = metric.samples
+            if samples is None:
+                samples = SeriesRepository(self.session).load(metric)
+            for granularity in GRANULARITIES:
+                for start, stats in samples.bucket_stats(metric.recorded_at, granularity):
+                    yield "", granularity, start, stats
+            return
+        for field, value in metric_values(metric).items():
+            stats = BucketStats()
+            stats.add(value)
+            for granularity in GRANULARITIES:
+                yield field, granularity, bucket_start(metric.recorded_at, granularity), stats
+
+    def fetch(
+        self,
+        user_id: str,
+        series: Sequence[SeriesKey],
+        granularity: str,
+        start: Optional[date],
+    ) -> Dict[SeriesKey, List[Tuple[date, BucketStats]]]:
+        """Bucket statistics of every ``(type_code, metric_field)`` in one query.
+
+        A field series also includes the scalar rows of its type, matching
+        how trends treat records whose value is a plain number.
+        """
+        table = HealthMetricRollup.__table__
+        wanted: Dict[Tuple[str, str], List[SeriesKey]] = defaultdict(list)
+        for type_code, metric_field in series:
+            for stored in {"", metric_field} if metric_field else {""}:
+                wanted[(type_code, stored)].append((type_code, metric_field))
+        stmt = select(table).where(
+            and_(
+                table.c.user_id == user_id,
+                or_(
+                    *(
+                        and_(table.c.type_code == type_code, table.c.metric_field == stored)
+                        for type_code, stored in wanted
+                    )
+                ),
+                table.c.granularity == granularity,
+                table.c.count > 0,
+            )
+        )
+        if start:
+            stmt = stmt.where(table.c.bucket_start >= start)
+        stmt = stmt.order_by(table.c.bucket_start.asc())
+        buckets: Dict[SeriesKey, Dict[date, BucketStats]] = {key: {} for key in series}
+        for row in self.session.execute(stmt):
+            for key in wanted[(row.type_code, row.metric_field)]:
+                stats = buckets[key].setdefault(row.bucket_start, BucketStats())
+                stats.merge(
+                    BucketStats(row.count, row.total, row.total_sq, row.min_value, row.max_value)
+                )
+        return {key: list(found.items()) for key, found in buckets.items()}
+
+    def rebuild(self, user_id: str) -> int:
+        """Recompute every rollup row of ``user_id`` from the raw records."""
+        self.session.execute(
+            delete(HealthMetricRollup.__table__).where(
+                HealthMetricRollup.__table__.c.user_id == user_id
+            )
+        )
+        stmt = select(HealthMetric).where(
+            and_(HealthMetric.user_id == user_id, HealthMetric.deleted.is_(False))
+        )
+        # ``apply`` queries between batches, so read bounded pages rather
+        # than through a cursor that would have to stay open meanwhile.
+        live = chain.from_iterable(keyset_pages(self.session, stmt, ROLLUP_REBUILD_BATCH_SIZE))
+        archived = ArchiveRepository(self.session).metrics(user_id)
+        batch: List[HealthMetric] = []
+        processed = 0
+        for metric in chain(live, archived):
+            batch.append(metric)
+            if len(batch) >= ROLLUP_REBUILD_BATCH_SIZE:
+                self.apply(batch)
+                processed += len(batch)
+                batch = []
+        self.apply(batch)
+        return processed + len(batch)
+
+    def _upsert(self, deltas: Dict[RollupKey, BucketStats]) -> None:
+        if not deltas:
+            return
+        table = HealthMetricRollup.__table__
+        now = datetime.utcnow()
+        rows = [
+            {
+                "user_id": user_id,
+                "type_code": type_code,
+                "metric_field": field,
+                "granularity": granularity,
+                "bucket_start": start,
+                "count": stats.count,
+                "total": stats.total,
+                "total_sq": stats.total_sq,
+                "min_value": stats.min_value,
+                "max_value": stats.max_value,
+                "updated_at": now,
+            }
+            for (user_id, type_code, field, granularity, start), stats in deltas.items()
+        ]
+        _upsert(self.session, table, rows, _rollup_merge)
+
+    def _raw_extremes(
+        self, metric: HealthMetric, field: str, start: date, granularity: str
+    ) -> Tuple[Optional[float], Optional[float]]:
+        if is_series(metric.type_code):
+            return SeriesRepository(self.session).extremes(
+                metric.user_id,
+                metric.type_code,
+                datetime.combine(start, time.min),
+                datetime.combine(next_bucket_start(start, granularity), time.min),
+            )
+        if FieldRepository.is_materialized(metric.type_code, field):
+            table = HealthMetricField.__table__
+            ts, value = table.c.recorded_at, table.c.value
+            condition = and_(
+                table.c.user_id == metric.user_id,
+                table.c.type_code == metric.type_code,
+                table.c.field == field,
+            )
         else:
-            raise ValueError(f"Unsupported group_by: {group_by}")
-
-        value = _extract_value(metric, metric_field)
-        bucket = buckets.setdefault(key, {"total": 0.0, "count": 0})
-        bucket["total"] += value
-        bucket["count"] += 1
-    return buckets
-
-
-def _extract_value(metric: HealthMetric, metric_field: Optional[str]) -> float:
-    if metric.value_number is not None:
-        return float(metric.value_number)
-    if metric_field and metric.value_json:
-        field_value = metric.value_json.get(metric_field)
-        if field_value is None:
-            raise ValueError(f"Metric field '{metric_field}' not present in record {metric.id}")
-        return float(field_value)
-    if metric.value_text:
+            ts, value = HealthMetric.recorded_at, _field_expression(field)
+            condition = and_(
+                HealthMetric.user_id == metric.user_id,
+                HealthMetric.type_code == metric.type_code,
+                HealthMetric.deleted.is_(False),
+            )
+        low_at = datetime.combine(start, time.min)
+        high_at = datetime.combine(next_bucket_start(start, granularity), time.min)
+        low, high = self.session.execute(
+            select(func.min(value), func.max(value)).where(
+                and_(condition, ts >= low_at, ts < high_at)
+            )
+        ).one()
+        # Same values as ``metric_values``: the scalar for "", else the object field.
+        archived = ArchiveRepository(self.session).samples(
+            metric.user_id,
+            metric.type_code,
+            field or None,
+            bool(field),
+            low_at,
+            high_at,
+            inclusive_end=False,
+        )
+        for _, _, sample in archived:
+            low = sample if low is None else min(low, sample)
+            high = sample if high is None else max(high, sample)
+        return low, high
+
+
+class FileRecordRepository:
+    """Map an uploaded file to the records it produced, for report-level dedup."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def lookup(self, user_id: str, file_hash: str) -> List[HealthMetric]:
+        """Live records of a previously ingested file, in upload order."""
+        stmt = (
+            select(HealthMetric)
+            .join(HealthFileRecord, HealthFileRecord.record_id == HealthMetric.id)
+            .where(
+                and_(
+                    HealthFileRecord.user_id == user_id,
+                    HealthFileRecord.file_hash == file_hash,
+                    HealthMetric.deleted.is_(False),
+                )
+            )
+            .order_by(HealthFileRecord.position.asc())
+        )
+        return list(self.session.execute(stmt).scalars())
+
+    def record(self, user_id: str, file_hash: str, record_ids: Sequence[str]) -> None:
+        """Replace the mapping of ``file_hash`` with ``record_ids``."""
+        table = HealthFileRecord.__table__
+        now = datetime.utcnow()
         try:
-            return float(metric.value_text)
-        except ValueError:
+            with self.session.begin_nested():
+                self.session.execute(
+                    delete(table).where(
+                        and_(table.c.user_id == user_id, table.c.file_hash == file_hash)
+                    )
+                )
+                self.session.execute(
+                    insert(table),
+                    [
+                        {
+                            "user_id": user_id,
+                            "file_hash": file_hash,
+                            "position": position,
+                            "record_id": record_id,
+                            "created_at": now,
+                        }
+                        for position, record_id in enumerate(record_ids)
+                    ],
+                )
+        except IntegrityError:
+            # A concurrent upload of the same file recorded it first.
             pass
-    raise ValueError(f"Cannot extract numeric value for record {metric.id}")
+
+    def forget(self, metric: HealthMetric) -> None:
+        """Drop the mappings of every file that produced ``metric``."""
+        table = HealthFileRecord.__table__
+        file_hashes = list(
+            self.session.execute(
+                select(table.c.file_hash).where(
+                    and_(table.c.user_id == metric.user_id, table.c.record_id == metric.id)
+                )
+            ).scalars()
+        )
+        if file_hashes:
+            self.session.execute(
+                delete(table).where(
+                    and_(table.c.user_id == metric.user_id, table.c.file_hash.in_(file_hashes))
+                )
+            )
+
+
+class FieldRepository:
+    """Maintain ``health_metric_fields`` alongside metric writes."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    @staticmethod
+    def is_materialized(type_code: str, metric_field: Optional[str]) -> bool:
+        return bool(metric_field) and metric_field in materialized_fields(type_code)
+
+    def apply(self, metrics: Iterable[HealthMetric]) -> None:
+        rows = [
+            {
+                "record_id": metric.id,
+                "field": field,
+                "user_id": metric.user_id,
+                "type_code": metric.type_code,
+                "value": value,
+                "recorded_at": metric.recorded_at,
+            }
+            for metric in metrics
+            for field, value in field_values(metric.type_code, metric.value_json).items()
+        ]
+        if rows:
+            self.session.execute(insert(HealthMetricField.__table__), rows)
+
+    def retract(self, metric: HealthMetric) -> None:
+        if materialized_fields(metric.type_code):
+            table = HealthMetricField.__table__
+            self.session.execute(delete(table).where(table.c.record_id == metric.id))
+
+
+class SeriesRepository:
+    """Maintain ``health_metric_series_blocks`` for ``value_schema="series"`` records.
+
+    Range reads only decode blocks that cut through a range (or a bucket)
+    boundary; blocks lying entirely inside contribute their stored
+    aggregates.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def apply(self, metrics: Iterable[HealthMetric]) -> None:
+        rows = []
+        for metric in metrics:
+            if metric.samples is None:
+                continue
+            for number, block in enumerate(metric.samples.blocks(metric.recorded_at)):
+                first, last = block.offsets_ms[0], block.offsets_ms[-1]
+                rows.append(
+                    {
+                        "record_id": metric.id,
+                        "block": number,
+                        "user_id": metric.user_id,
+                        "type_code": metric.type_code,
+                        # Whole seconds, rounded outwards: DATETIME may drop fractions.
+                        "start_at": _floor_second(metric.recorded_at + timedelta(milliseconds=int(first))),
+                        "end_at": _ceil_second(metric.recorded_at + timedelta(milliseconds=int(last))),
+                        "count": len(block),
+                        "total": float(block.values.sum()),
+                        "total_sq": float(np.dot(block.values, block.values)),
+                        "min_value": float(block.values.min()),
+                        "max_value": float(block.values.max()),
+                        "payload": encode_block(block),
+                    }
+                )
+        if rows:
+            self.session.execute(insert(HealthMetricSeriesBlock.__table__), rows)
+
+    def retract(self, metric: HealthMetric) -> None:
+        """Drop the blocks of ``metric``, keeping its samples on it for the rollups."""
+        if not is_series(metric.type_code):
+            return
+        if metric.samples is None:
+            metric.samples = self.load(metric)
+        table = HealthMetricSeriesBlock.__table__
+        self.session.execute(delete(table).where(table.c.record_id == metric.id))
+
+    def load(self, metric: HealthMetric) -> SampleSeries:
+        table = HealthMetricSeriesBlock.__table__
+        payloads = self.session.execute(
+            select(table.c.payload).where(table.c.record_id == metric.id).order_by(table.c.block)
+        ).scalars()
+        return SampleSeries.concat([decode_block(payload) for payload in payloads])
+
+    def load_many(self, metrics: Iterable[HealthMetric]) -> Dict[str, SampleSeries]:
+        """Samples of several series records by id, read in one query."""
+        ids = [metric.id for metric in metrics]
+        if not ids:
+            return {}
+        table = HealthMetricSeriesBlock.__table__
+        blocks: Dict[str, List[SampleSeries]] = defaultdict(list)
+        for record_id, payload in self.session.execute(
+            select(table.c.record_id, table.c.payload)
+            .where(table.c.record_id.in_(ids))
+            .order_by(table.c.record_id, table.c.block)
+        ):
+            blocks[record_id].append(decode_block(payload))
+        return {record_id: SampleSeries.concat(blocks[record_id]) for record_id in ids}
+
+    def record_samples(
+        self,
+        user_id: str,
+        record_id: str,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+    ) -> Optional[Tuple[HealthMetric, SampleSeries]]:
+        """Samples of one live series record in ``[start_time, end_time]``.
+
+        Only the blocks overlapping the range are read and decoded.
+        """
+        metric = self.session.execute(
+            select(HealthMetric).where(
+                and_(
+                    HealthMetric.id == record_id,
+                    HealthMetric.user_id == user_id,
+                    HealthMetric.deleted.is_(False),
+                )
+            )
+        ).scalar_one_or_none()
+        if metric is None or not is_series(metric.type_code):
+            return None
+        table = HealthMetricSeriesBlock.__table__
+        stmt = select(table.c.payload).where(
+            and_(
+                table.c.record_id == metric.id,
+                self._range_condition(user_id, metric.type_code, start_time, end_time),
+            )
+        )
+        payloads = self.session.execute(stmt.order_by(table.c.block)).scalars()
+        blocks = [decode_block(payload) for payload in payloads]
+        return metric, SampleSeries.concat(blocks).between(metric.recorded_at, start_time, end_time)
+
+    def aggregate(
+        self,
+        user_id: str,
+        type_code: str,
+        group_by: str,
+        start_time: Optional[datetime],
+        end_time: Optional[datetime],
+    ) -> List[Tuple[date, BucketStats]]:
+        """Bucket statistics of the samples in ``[start_time, end_time)``."""
+        buckets: Dict[date, BucketStats] = defaultdict(BucketStats)
+
+        def whole(row) -> bool:
+            return bucket_start(row.start_at, group_by) == bucket_start(row.end_at, group_by)
+
+        for row, recorded_at, samples in self._parts(user_id, type_code, start_time, end_time, whole):
+            if samples is None:
+                buckets[bucket_start(row.start_at, group_by)].merge(_block_stats(row))
+            elif len(samples):
+                for start, stats in samples.bucket_stats(recorded_at, group_by):
+                    buckets[start].merge(stats)
+        return sorted(buckets.items())
+
+    def extremes(
+        self, user_id: str, type_code: str, start_time: datetime, end_time: datetime
+    ) -> Tuple[Optional[float], Optional[float]]:
+        """Lowest and highest sample in ``[start_time, end_time)``."""
+        stats = BucketStats()
+        for row, _, samples in self._parts(user_id, type_code, start_time, end_time):
+            if samples is None:
+                stats.merge(_block_stats(row))
+            elif len(samples):
+                stats.merge(
+                    BucketStats(len(samples), 0.0, 0.0, samples.values.min(), samples.values.max())
+                )
+        return stats.min_value, stats.max_value
+
+    def samples(
+        self,
+        user_id: str,
+        type_code: str,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        source: Optional[str] = None,
+        tags: Optional[Set[Tuple[str, str]]] = None,
+    ) -> Tuple[int, Iterator[Tuple[datetime, str, float]]]:
+        """``MetricRepository.series_samples`` over decoded blocks, ``end_time`` inclusive.
+
+        Samples are streamed block by block in block start order; the count
+        only decodes the blocks cut by the range.
+        """
+        condition = self._range_condition(user_id, type_code, start_time, end_time)
+        table = HealthMetricSeriesBlock.__table__
+        if source:
+            condition = and_(condition, HealthMetric.source == source)
+        if tags:
+            condition = and_(condition, table.c.record_id.in_(TagRepository.matching(user_id, tags)))
+        inside = self._inside(start_time, end_time, inclusive_end=True)
+        stmt = (
+            select(table, HealthMetric.recorded_at)
+            .join(HealthMetric, HealthMetric.id == table.c.record_id)
+            .where(condition)
+        )
+        total = 0
+        for row in self.session.execute(
+            stmt.with_only_columns(
+                table.c.count, table.c.start_at, table.c.end_at, table.c.payload, HealthMetric.recorded_at
+            )
+        ):
+            if inside(row):
+                total += row.count
+            else:
+                total += len(
+                    decode_block(row.payload).between(row.recorded_at, start_time, end_time)
+                )
+        stmt = stmt.order_by(table.c.start_at, table.c.record_id, table.c.block).execution_options(
+            stream_results=True, yield_per=STREAM_BATCH_SIZE
+        )
+
+        def rows() -> Iterator[Tuple[datetime, str, float]]:
+            for batch in self.session.execute(stmt).partitions(SERIES_DECODE_BLOCKS):
+                yield from run_blocking(_block_samples, batch, inside, start_time, end_time)
+
+        return total, rows()
+
+    def _parts(
+        self,
+        user_id: str,
+        type_code: str,
+        start_time: Optional[datetime],
+        end_time: Optional[datetime],
+        whole: Callable[[Any], bool] = lambda row: True,
+    ) -> Iterator[Tuple[Any, datetime, Optional[SampleSeries]]]:
+        """Blocks overlapping ``[start_time, end_time)``.
+
+        Yields ``(row, recorded_at, samples)``; ``samples`` is None when the
+        block lies inside the range and ``whole(row)`` holds, so its stored
+        aggregates can be used without decoding the payload.
+        """
+        table = HealthMetricSeriesBlock.__table__
+        inside = self._inside(start_time, end_time, inclusive_end=False)
+        summary = select(
+            table.c.record_id,
+            table.c.block,
+            table.c.start_at,
+            table.c.end_at,
+            table.c.count,
+            table.c.total,
+            table.c.total_sq,
+            table.c.min_value,
+            table.c.max_value,
+            HealthMetric.recorded_at,
+        ).join(HealthMetric, HealthMetric.id == table.c.record_id)
+        summary = summary.where(self._range_condition(user_id, type_code, start_time, end_time))
+        cut = []
+        for row in self.session.execute(summary):
+            if inside(row) and whole(row):
+                yield row, row.recorded_at, None
+            else:
+                cut.append(row)
+        for row in cut:
+            payload = self.session.execute(
+                select(table.c.payload).where(
+                    and_(table.c.record_id == row.record_id, table.c.block == row.block)
+                )
+            ).scalar_one()
+            samples = decode_block(payload).between(
+                row.recorded_at, start_time, end_time, inclusive_end=False
+            )
+            yield row, row.recorded_at, samples
+
+    @staticmethod
+    def _range_condition(
+        user_id: str, type_code: str, start_time: Optional[datetime], end_time: Optional[datetime]
+    ):
+        table = HealthMetricSeriesBlock.__table__
+        condition = and_(table.c.user_id == user_id, table.c.type_code == type_code)
+        if start_time:
+            # Blocks stay within one day, which bounds the start_at index range.
+            earliest = _floor_second(start_time) - BLOCK_MAX_SPAN - timedelta(seconds=1)
+            condition = and_(
+                condition,
+                table.c.start_at >= earliest,
+                table.c.end_at >= _floor_second(start_time),
+            )
+        if end_time:
+            condition = and_(condition, table.c.start_at <= end_time)
+        return condition
+
+    @staticmethod
+    def _inside(
+        start_time: Optional[datetime], end_time: Optional[datetime], inclusive_end: bool
+    ) -> Callable[[Any], bool]:
+        def inside(row) -> bool:
+            if start_time and row.start_at < start_time:
+                return False
+            if end_time and (row.end_at > end_time or (row.end_at == end_time and not inclusive_end)):
+                return False
+            return True
+
+        return inside
+
+
+class TagRepository:
+    """Maintain the ``health_metric_tags`` inverted index alongside metric writes."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def apply(self, metrics: Iterable[HealthMetric]) -> None:
+        rows = [
+            {"user_id": metric.user_id, "tag_key": key, "tag_value": value, "record_id": metric.id}
+            for metric in metrics
+            for key, value in tag_pairs(metric.tags_json)
+        ]
+        if rows:
+            self.session.execute(insert(HealthMetricTag.__table__), rows)
+
+    def retract(self, metric: HealthMetric) -> None:
+        if metric.tags_json:
+            table = HealthMetricTag.__table__
+            self.session.execute(delete(table).where(table.c.record_id == metric.id))
+
+    @staticmethod
+    def matching(user_id: str, pairs: Set[Tuple[str, str]]):
+        """Subquery of record ids carrying every ``(key, value)`` in ``pairs``.
+
+        Each pair is a range of the primary key; grouping the union of those
+        posting lists and keeping ids seen once per pair intersects them.
+        """
+        table = HealthMetricTag.__table__
+        return (
+            select(table.c.record_id)
+            .where(
+                and_(
+                    table.c.user_id == user_id,
+                    or_(
+                        *(
+                            and_(table.c.tag_key == key, table.c.tag_value == value)
+                            for key, value in sorted(pairs)
+                        )
+                    ),
+                )
+            )
+            .group_by(table.c.record_id)
+            .having(func.count() == len(pairs))
+        )
+
+
+class ArchiveRepository:
+    """Cold-storage tier: old records moved into per-user segment files.
+
+    Disabled unless ``ARCHIVE_DIR`` is set. ``health_metric_archive_segments``
+    lists the committed segments of each user and
+    ``health_metric_archive_tombstones`` the archived records deleted since.
+    Segment directories without a committed row (an interrupted run) are
+    never read and are pruned by the next run for that user. Rollups and
+    dashboard counters are untouched by archiving: the records still exist.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+        self.root = get_settings().archive_dir
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def candidates(self, before: datetime) -> List[str]:
+        """Users with live records older than ``before``."""
+        stmt = (
+            select(HealthMetric.user_id)
+            .where(and_(HealthMetric.deleted.is_(False), HealthMetric.recorded_at < before))
+            .distinct()
+        )
+        return list(self.session.execute(stmt).scalars())
+
+    def archive(self, user_id: str, before: datetime, max_records: int) -> int:
+        """Move up to ``max_records`` of the oldest live records before ``before`` into a new segment.
+
+        The segment is written first and becomes visible when the caller
+        commits, in the same transaction that deletes the rows (with their
+        field and tag index rows) from the hot tables. Series records stay
+        hot: their samples already live in compressed blocks.
+        """
+        if not self.enabled:
+            raise RuntimeError("Archiving requires ARCHIVE_DIR")
+        self._prune(user_id)
+        series_types = [item.type_code for item in list_metric_types() if item.value_schema == "series"]
+        stmt = (
+            select(HealthMetric)
+            .where(
+                and_(
+                    HealthMetric.user_id == user_id,
+                    HealthMetric.deleted.is_(False),
+                    HealthMetric.recorded_at < before,
+                    HealthMetric.type_code.notin_(series_types),
+                )
+            )
+            .order_by(HealthMetric.recorded_at.asc(), HealthMetric.id.asc())
+            .limit(max_records)
+        )
+        metrics = list(self.session.execute(stmt).scalars())
+        if not metrics:
+            return 0
+        for metric in metrics:
+            self.session.expunge(metric)
+        name = uuid7()
+        directory = user_directory(self.root, user_id)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        manifest = write_segment(path, user_id, metrics)
+        try:
+            self.session.execute(
+                insert(HealthMetricArchiveSegment.__table__).values(
+                    user_id=user_id,
+                    segment=name,
+                    start_at=_floor_second(datetime.fromisoformat(manifest["start"])),
+                    end_at=_ceil_second(datetime.fromisoformat(manifest["end"])),
+                    record_count=manifest["count"],
+                    created_at=datetime.utcnow(),
+                )
+            )
+            ids = [metric.id for metric in metrics]
+            for offset in range(0, len(ids), BULK_CHUNK_SIZE):
+                chunk = ids[offset:offset + BULK_CHUNK_SIZE]
+                result = self.session.execute(
+                    delete(HealthMetric.__table__).where(
+                        and_(HealthMetric.id.in_(chunk), HealthMetric.deleted.is_(False))
+                    )
+                )
+                if result.rowcount != len(chunk):
+                    raise RuntimeError("Records were deleted during archival; run it again")
+                for table in (HealthMetricField.__table__, HealthMetricTag.__table__):
+                    self.session.execute(delete(table).where(table.c.record_id.in_(chunk)))
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        return len(metrics)
+
+    def page(
+        self,
+        live: List[HealthMetric],
+        user_id: str,
+        *,
+        type_code: Optional[str],
+        limit: int,
+        order: str,
+        start_time: Optional[datetime],
+        end_time: Optional[datetime],
+        source: Optional[str],
+        after: Optional[Tuple[datetime, str]],
+        tags: Optional[Set[Tuple[str, str]]],
+    ) -> List[HealthMetric]:
+        """Merge archived records into one page of ``live`` rows.
+
+        Segments lying entirely past a full page of live rows are skipped,
+        so the usual newest-first page never touches the archive.
+        """
+        segments = self._segments(user_id, start_time, end_time)
+        if limit and len(live) >= limit:
+            edge = live[-1].recorded_at
+            if order == "asc":
+                segments = [(row, segment) for row, segment in segments if row.start_at <= edge]
+            else:
+                segments = [(row, segment) for row, segment in segments if row.end_at >= edge]
+        if not segments:
+            return live
+        excluded = self._tombstones(user_id)
+        found = run_blocking(
+            _archived_page,
+            [segment for _, segment in segments],
+            (type_code, start_time, end_time, source, after, order),
+            excluded,
+            limit,
+            tags,
+        )
+        if not found:
+            return live
+        merged = sorted(live + found, key=_metric_order, reverse=order != "asc")
+        return merged[:limit] if limit else merged
+
+    def metrics(
+        self,
+        user_id: str,
+        type_code: Optional[str] = None,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        source: Optional[str] = None,
+        inclusive_end: bool = True,
+        tags: Optional[Set[Tuple[str, str]]] = None,
+    ) -> Iterator[HealthMetric]:
+        """Archived records in ``(recorded_at, id)`` order.
+
+        The database is queried right away; the returned iterator only
+        reads segment files, ``STREAM_BATCH_SIZE`` records at a time, so it
+        can be merged with an open cursor.
+        """
+        segments = self._segments(user_id, start_time, end_time)
+        if not segments:
+            return iter(())
+        excluded = self._tombstones(user_id)
+        streams = [
+            segment.metrics(
+                segment.select(
+                    type_code,
+                    start_time,
+                    end_time,
+                    source,
+                    inclusive_end=inclusive_end,
+                    excluded=excluded,
+                )
+            )
+            for _, segment in segments
+        ]
+        merged = _tagged(heapq.merge(*streams, key=_metric_order), tags)
+        return _read_ahead(merged, STREAM_BATCH_SIZE)
+
+    def samples(
+        self,
+        user_id: str,
+        type_code: str,
+        metric_field: Optional[str] = None,
+        fields_only: bool = False,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        source: Optional[str] = None,
+        tags: Optional[Set[Tuple[str, str]]] = None,
+        inclusive_end: bool = True,
+    ) -> List[Tuple[datetime, str, float]]:
+        """``(recorded_at, record_id, value)`` of archived records with a numeric value.
+
+        Values are read from the mapped columns (see ``Segment.values``)
+        without building record objects.
+        """
+        segments = self._segments(user_id, start_time, end_time)
+        if not segments:
+            return []
+        excluded = self._tombstones(user_id)
+        return run_blocking(
+            _archived_samples,
+            [segment for _, segment in segments],
+            (type_code, start_time, end_time, source),
+            excluded,
+            inclusive_end,
+            tags,
+            metric_field,
+            fields_only,
+        )
+
+    def duplicates(
+        self, user_id: str, metrics: Sequence[HealthMetric]
+    ) -> Dict[str, HealthMetric]:
+        """Archived records of ``user_id`` sharing a ``dedup_hash`` with ``metrics``.
+
+        Only segments overlapping the timestamps of ``metrics`` are read:
+        the hash covers ``recorded_at``, so nothing else can match.
+        """
+        if not metrics or not self.enabled:
+            return {}
+        segments = self._segments(
+            user_id,
+            min(metric.recorded_at for metric in metrics),
+            max(metric.recorded_at for metric in metrics),
+        )
+        if not segments:
+            return {}
+        excluded = self._tombstones(user_id)
+        hashes = {metric.dedup_hash for metric in metrics}
+        return run_blocking(_archived_duplicates, [segment for _, segment in segments], excluded, hashes)
+
+    def delete(self, user_id: str, record_id: str) -> Optional[HealthMetric]:
+        """Tombstone an archived record, returning it (None if not archived or already deleted)."""
+        segments = self._segments(user_id)
+        if not segments:
+            return None
+        table = HealthMetricArchiveTombstone.__table__
+        deleted = self.session.execute(
+            select(table.c.record_id).where(table.c.record_id == record_id)
+        ).first()
+        if deleted is not None:
+            return None
+        located = run_blocking(_locate_archived, segments, record_id)
+        if located is None:
+            return None
+        row, metric = located
+        self.session.execute(
+            insert(table).values(
+                record_id=record_id,
+                user_id=user_id,
+                segment=row.segment,
+                type_code=metric.type_code,
+                deleted_at=datetime.utcnow(),
+            )
+        )
+        metric.deleted = True
+        return metric
+
+    def type_counts(self) -> Dict[str, int]:
+        """Live archived records per type, from the segment manifests and tombstones."""
+        if not self.enabled:
+            return {}
+        table = HealthMetricArchiveSegment.__table__
+        counts: Dict[str, int] = defaultdict(int)
+        for user_id, name in self.session.execute(select(table.c.user_id, table.c.segment)):
+            segment = open_segment(os.path.join(user_directory(self.root, user_id), name))
+            for type_code, count in segment.manifest["type_counts"].items():
+                counts[type_code] += count
+        tombstones = HealthMetricArchiveTombstone.__table__
+        stmt = select(tombstones.c.type_code, func.count()).group_by(tombstones.c.type_code)
+        for type_code, count in self.session.execute(stmt):
+            counts[type_code] -= count
+        return dict(counts)
+
+    def user_ids(self) -> List[str]:
+        if not self.enabled:
+            return []
+        table = HealthMetricArchiveSegment.__table__
+        return list(self.session.execute(select(table.c.user_id).distinct()).scalars())
+
+    def _segments(
+        self,
+        user_id: str,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+    ) -> List[Tuple[Any, Segment]]:
+        if not self.enabled:
+            return []
+        table = HealthMetricArchiveSegment.__table__
+        stmt = select(table.c.segment, table.c.start_at, table.c.end_at).where(
+            table.c.user_id == user_id
+        )
+        if start_time:
+            stmt = stmt.where(table.c.end_at >= start_time)
+        if end_time:
+            stmt = stmt.where(table.c.start_at <= end_time)
+        rows = self.session.execute(stmt.order_by(table.c.start_at)).all()
+        if not rows:
+            return []
+        return run_blocking(_open_segments, user_directory(self.root, user_id), rows)
+
+    def _tombstones(self, user_id: str) -> np.ndarray:
+        table = HealthMetricArchiveTombstone.__table__
+        ids = self.session.execute(
+            select(table.c.record_id).where(table.c.user_id == user_id)
+        ).scalars()
+        return np.array([record_id.encode("ascii") for record_id in ids], dtype="S36")
+
+    def _prune(self, user_id: str) -> None:
+        """Remove segment directories an interrupted run left behind."""
+        directory = user_directory(self.root, user_id)
+        if not os.path.isdir(directory):
+            return
+        table = HealthMetricArchiveSegment.__table__
+        committed = set(
+            self.session.execute(select(table.c.segment).where(table.c.user_id == user_id)).scalars()
+        )
+        # Leave recent ones alone: they may belong to a run still in progress.
+        threshold = datetime.now().timestamp() - ORPHAN_SEGMENT_SECONDS
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name not in committed and os.path.getmtime(path) < threshold:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+class StatsRepository:
+    """Maintain dashboard counters alongside metric writes.
+
+    Per-type record counts are exact deltas, written to one of
+    ``TYPE_STAT_SHARDS`` rows per type chosen once per session, so parallel
+    imports of the same type rarely wait on each other's row locks. Distinct
+    users are tracked with a HyperLogLog sketch, which cannot forget a user
+    whose records were all deleted; ``reconcile`` recomputes both from the
+    raw table.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    @property
+    def shard(self) -> int:
+        return self.session.info.setdefault("type_stat_shard", random.randrange(TYPE_STAT_SHARDS))
+
+    def apply(self, metrics: Iterable[HealthMetric]) -> None:
+        counts: Dict[str, int] = defaultdict(int)
+        registers: Dict[int, int] = {}
+        for metric in metrics:
+            counts[metric.type_code] += 1
+            slot, rank = hll_register(metric.user_id)
+            registers[slot] = max(rank, registers.get(slot, 0))
+        self._add_counts(counts)
+        _upsert(
+            self.session,
+            MetricUserSketch.__table__,
+            [{"slot": slot, "max_rank": rank} for slot, rank in registers.items()],
+            _sketch_merge,
+        )
+
+    def retract(self, metric: HealthMetric) -> None:
+        self._add_counts({metric.type_code: -1})
+
+    def type_counts(self) -> List[Tuple[str, int]]:
+        table = MetricTypeStat.__table__
+        total = func.sum(table.c.record_count)
+        stmt = (
+            select(table.c.type_code, total)
+            .group_by(table.c.type_code)
+            .having(total > 0)
+            .order_by(total.desc())
+        )
+        return [(type_code, int(count)) for type_code, count in self.session.execute(stmt)]
+
+    def _add_counts(self, counts: Dict[str, int], shard: Optional[int] = None) -> None:
+        now = datetime.utcnow()
+        shard = self.shard if shard is None else shard
+        _upsert(
+            self.session,
+            MetricTypeStat.__table__,
+            [
+                {"type_code": type_code, "shard": shard, "record_count": count, "updated_at": now}
+                for type_code, count in counts.items()
+                if count
+            ],
+            _type_stat_merge,
+        )
+
+    def distinct_users(self) -> int:
+        table = MetricUserSketch.__table__
+        registers = dict(self.session.execute(select(table.c.slot, table.c.max_rank)).all())
+        return hll_estimate(registers)
+
+    def is_empty(self) -> bool:
+        table = MetricTypeStat.__table__
+        return self.session.execute(select(table.c.type_code).limit(1)).first() is None
+
+    def reconcile(self) -> Dict[str, int]:
+        """Correct the maintained statistics to the values computed from raw rows.
+
+        Expects a transaction with one consistent snapshot (REPEATABLE READ),
+        so the current counters and the raw rows they are compared with are
+        read at the same point. Corrections are applied as deltas and
+        compare-and-set updates against the latest committed values, so
+        concurrent writes made meanwhile are kept.
+        """
+        stats, sketch = MetricTypeStat.__table__, MetricUserSketch.__table__
+        seen_counts = {
+            type_code: int(count)
+            for type_code, count in self.session.execute(
+                select(stats.c.type_code, func.sum(stats.c.record_count)).group_by(stats.c.type_code)
+            )
+        }
+        seen_ranks = dict(self.session.execute(select(sketch.c.slot, sketch.c.max_rank)).all())
+        active = HealthMetric.deleted.is_(False)
+        counts = self.session.execute(
+            select(HealthMetric.type_code, func.count()).where(active).group_by(HealthMetric.type_code)
+        ).all()
+        archive = ArchiveRepository(self.session)
+        totals: Dict[str, int] = defaultdict(int, archive.type_counts())
+        for type_code, count in counts:
+            totals[type_code] += count
+        registers: Dict[int, int] = {}
+        for user_id in archive.user_ids():
+            slot, rank = hll_register(user_id)
+            registers[slot] = max(rank, registers.get(slot, 0))
+        users = (
+            select(HealthMetric.user_id)
+            .where(active)
+            .distinct()
+            .execution_options(yield_per=STATS_RECONCILE_BATCH_SIZE)
+        )
+        for user_id in self.session.execute(users).scalars():
+            slot, rank = hll_register(user_id)
+            registers[slot] = max(rank, registers.get(slot, 0))
+
+        deltas = {
+            type_code: max(totals.get(type_code, 0), 0) - seen_counts.get(type_code, 0)
+            for type_code in set(totals) | set(seen_counts)
+        }
+        self._add_counts(deltas, shard=0)
+        # Raising a register is always safe; lowering one only if no write
+        # raised it since the snapshot, otherwise the next round retries.
+        _upsert(
+            self.session,
+            sketch,
+            [
+                {"slot": slot, "max_rank": rank}
+                for slot, rank in registers.items()
+                if rank > seen_ranks.get(slot, 0)
+            ],
+            _sketch_merge,
+        )
+        for slot, seen in seen_ranks.items():
+            rank = registers.get(slot, 0)
+            if rank < seen:
+                self.session.execute(
+                    update(sketch)
+                    .where(and_(sketch.c.slot == slot, sketch.c.max_rank == seen))
+                    .values(max_rank=rank)
+                )
+        live = {type_code: count for type_code, count in totals.items() if count > 0}
+        return {
+            "records": sum(live.values()),
+            "types": len(live),
+            "users": hll_estimate(registers),
+            "corrected": sum(1 for delta in deltas.values() if delta),
+        }
+
+
+def estimate_row_count(session: Session, stmt) -> Optional[int]:
+    """Optimizer estimate of the rows ``stmt`` matches, without executing it.
+
+    Uses MySQL's ``EXPLAIN`` (index statistics); other dialects return None.
+    """
+    dialect = session.get_bind().dialect
+    if dialect.name != "mysql":
+        return None
+    compiled = stmt.compile(dialect=dialect)
+    result = session.connection().exec_driver_sql(f"EXPLAIN {compiled}", compiled.params)
+    row = result.mappings().first()
+    if row is None or row.get("rows") is None:
+        return None
+    filtered = row.get("filtered") or 100
+    return int(row["rows"] * filtered / 100)
+
+
+def keyset_condition(after: Tuple[datetime, str], order: str):
+    """Rows strictly past ``after`` when ordered by ``(recorded_at, id)``."""
+    recorded_at, record_id = after
+    if order == "asc":
+        return or_(
+            HealthMetric.recorded_at > recorded_at,
+            and_(HealthMetric.recorded_at == recorded_at, HealthMetric.id > record_id),
+        )
+    return or_(
+        HealthMetric.recorded_at < recorded_at,
+        and_(HealthMetric.recorded_at == recorded_at, HealthMetric.id < record_id),
+    )
+
+
+def keyset_pages(session: Session, stmt, batch_size: int) -> Iterator[List[HealthMetric]]:
+    """Rows of ``select(HealthMetric)`` ``stmt`` in ``(recorded_at, id)`` order, a page at a time.
+
+    Each page is its own bounded, fully fetched query, so no result stays
+    open between pages and the session is free for other statements while
+    the caller works through them.
+    """
+    after: Optional[Tuple[datetime, str]] = None
+    while True:
+        page_stmt = stmt if after is None else stmt.where(keyset_condition(after, "asc"))
+        page = list(
+            session.execute(
+                page_stmt.order_by(HealthMetric.recorded_at.asc(), HealthMetric.id.asc()).limit(batch_size)
+            ).scalars()
+        )
+        if page:
+            yield page
+        if len(page) < batch_size:
+            return
+        after = (page[-1].recorded_at, page[-1].id)
+
+
+def _prepare_for_insert(metric: HealthMetric) -> None:
+    now = datetime.utcnow()
+    if metric.id is None:
+        metric.id = uuid7()
+    if metric.deleted is None:
+        metric.deleted = False
+    if metric.created_at is None:
+        metric.created_at = now
+    if metric.updated_at is None:
+        metric.updated_at = now
+
+
+def _insert_values(metric: HealthMetric) -> Dict:
+    return {
+        column.key: getattr(metric, column.key)
+        for column in HealthMetric.__table__.columns
+    }
+
+
+def _bucket_expression(dialect_name: str, group_by: str, ts):
+    if dialect_name == "sqlite":
+        if group_by == "day":
+            return func.strftime("%Y-%m-%d", ts)
+        if group_by == "week":
+            # ISO week: the Thursday of the week determines both year and week number.
+            thursday = func.date(ts, "-3 days", "weekday 4")
+            week = (func.strftime("%j", thursday) - 1) / 7 + 1
+            return (
+                func.strftime("%Y", thursday, type_=String)
+                + literal("-W")
+                + func.printf("%02d", week, type_=String)
+            )
+        if group_by == "month":
+            return func.strftime("%Y-%m", ts)
+    else:
+        if group_by == "day":
+            return func.date_format(ts, "%Y-%m-%d")
+        if group_by == "week":
+            return func.date_format(ts, "%x-W%v")
+        if group_by == "month":
+            return func.date_format(ts, "%Y-%m")
+    raise ValueError(f"Unsupported group_by: {group_by}")
+
+
+def _upsert(session: Session, table, rows: List[Dict], merge) -> None:
+    """Insert ``rows`` into ``table``, merging into rows that already exist.
+
+    ``merge(table, incoming, least, greatest)`` returns the update clause,
+    given the dialect's proposed-row alias and its LEAST/GREATEST functions.
+    """
+    if not rows:
+        return
+    # A fixed key order keeps concurrent upserts of overlapping rows from
+    # deadlocking on each other's row locks.
+    key = [column.name for column in table.primary_key]
+    rows = sorted(rows, key=lambda row: tuple(row[name] for name in key))
+    sqlite = session.get_bind().dialect.name == "sqlite"
+    for offset in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        chunk = rows[offset:offset + UPSERT_CHUNK_SIZE]
+        if sqlite:
+            stmt = sqlite_insert(table).values(chunk)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(table.primary_key),
+                set_=merge(table, stmt.excluded, func.min, func.max),
+            )
+        else:
+            stmt = mysql_insert(table).values(chunk)
+            stmt = stmt.on_duplicate_key_update(
+                **merge(table, stmt.inserted, func.least, func.greatest)
+            )
+        session.execute(stmt)
+
+
+def _type_stat_merge(table, incoming, least, greatest) -> Dict:
+    return {
+        "record_count": table.c.record_count + incoming.record_count,
+        "updated_at": incoming.updated_at,
+    }
+
+
+def _sketch_merge(table, incoming, least, greatest) -> Dict:
+    return {"max_rank": greatest(table.c.max_rank, incoming.max_rank)}
+
+
+def _rollup_merge(table, incoming, least, greatest) -> Dict:
+    return {
+        "count": table.c.count + incoming.count,
+        "total": table.c.total + incoming.total,
+        "total_sq": table.c.total_sq + incoming.total_sq,
+        "min_value": func.coalesce(least(table.c.min_value, incoming.min_value), incoming.min_value),
+        "max_value": func.coalesce(greatest(table.c.max_value, incoming.max_value), incoming.max_value),
+        "updated_at": incoming.updated_at,
+    }
+
+
+def _block_samples(
+    rows: Sequence[Any],
+    inside: Callable[[Any], bool],
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+) -> List[Tuple[datetime, str, float]]:
+    """Decode the samples of series block ``rows`` falling in the range."""
+    samples: List[Tuple[datetime, str, float]] = []
+    for row in rows:
+        block = decode_block(row.payload)
+        if not inside(row):
+            block = block.between(row.recorded_at, start_time, end_time)
+        samples.extend(
+            zip(
+                block.timestamps(row.recorded_at).tolist(),
+                repeat(row.record_id),
+                block.values.tolist(),
+            )
+        )
+    return samples
+
+
+def _open_segments(directory: str, rows: Sequence[Any]) -> List[Tuple[Any, Segment]]:
+    return [(row, open_segment(os.path.join(directory, row.segment))) for row in rows]
+
+
+def _archived_page(
+    segments: Sequence[Segment],
+    filters: Tuple[Any, ...],
+    excluded: np.ndarray,
+    limit: int,
+    tags: Optional[Set[Tuple[str, str]]],
+) -> List[HealthMetric]:
+    """Up to ``limit`` matching records of each segment, in page order.
+
+    ``filters`` are the ``Segment.select`` arguments up to ``order``.
+    """
+    order = filters[-1]
+    found: List[HealthMetric] = []
+    for segment in segments:
+        indexes = segment.select(*filters, excluded=excluded)
+        if order != "asc":
+            indexes = indexes[::-1]
+        matching = _tagged(segment.metrics(indexes), tags)
+        found.extend(islice(matching, limit) if limit else matching)
+    return found
+
+
+def _archived_samples(
+    segments: Sequence[Segment],
+    filters: Tuple[Any, ...],
+    excluded: np.ndarray,
+    inclusive_end: bool,
+    tags: Optional[Set[Tuple[str, str]]],
+    metric_field: Optional[str],
+    fields_only: bool,
+) -> List[Tuple[datetime, str, float]]:
+    rows: List[Tuple[datetime, str, float]] = []
+    for segment in segments:
+        indexes = segment.select(*filters, inclusive_end=inclusive_end, excluded=excluded)
+        if tags and len(indexes):
+            tagged = [tags <= tag_pairs(value) for value in segment.side("tags_json", indexes)]
+            indexes = indexes[np.array(tagged, dtype=bool)]
+        values = segment.values(indexes, metric_field, fields_only)
+        present = ~np.isnan(values)
+        indexes, values = indexes[present], values[present]
+        rows.extend(
+            zip(
+                segment.recorded_at[indexes].tolist(),
+                [record_id.decode("ascii") for record_id in segment.ids[indexes].tolist()],
+                values.tolist(),
+            )
+        )
+    if len(segments) > 1:
+        rows.sort(key=lambda row: row[:2])
+    return rows
+
+
+def _archived_duplicates(
+    segments: Sequence[Segment], excluded: np.ndarray, hashes: Set[str]
+) -> Dict[str, HealthMetric]:
+    found: Dict[str, HealthMetric] = {}
+    for segment in segments:
+        indexes = segment.find("dedup_hash", hashes)
+        if len(excluded):
+            indexes = indexes[~np.isin(segment.ids[indexes], excluded)]
+        for metric in segment.metrics(indexes):
+            found[metric.dedup_hash] = metric
+    return found
+
+
+def _locate_archived(
+    segments: Sequence[Tuple[Any, Segment]], record_id: str
+) -> Optional[Tuple[Any, HealthMetric]]:
+    for row, segment in segments:
+        indexes = segment.find("id", [record_id])
+        if len(indexes):
+            return row, next(segment.metrics(indexes))
+    return None
+
+
+def _read_ahead(iterator: Iterator[Any], size: int) -> Iterator[Any]:
+    """Pull ``iterator`` through ``run_blocking``, ``size`` items at a time."""
+    while True:
+        batch = run_blocking(lambda: list(islice(iterator, size)))
+        if not batch:
+            return
+        yield from batch
+
+
+def _metric_order(metric: HealthMetric) -> Tuple[datetime, str]:
+    return metric.recorded_at, metric.id
+
+
+def _tagged(
+    metrics: Iterable[HealthMetric], pairs: Optional[Set[Tuple[str, str]]]
+) -> Iterator[HealthMetric]:
+    if not pairs:
+        return iter(metrics)
+    return (metric for metric in metrics if pairs <= tag_pairs(metric.tags_json))
+
+
+def _block_stats(row) -> BucketStats:
+    return BucketStats(row.count, row.total, row.total_sq, row.min_value, row.max_value)
+
+
+def _floor_second(moment: datetime) -> datetime:
+    return moment.replace(microsecond=0)
+
+
+def _ceil_second(moment: datetime) -> datetime:
+    floor = moment.replace(microsecond=0)
+    return floor if floor == moment else floor + timedelta(seconds=1)
+
+
+def _field_expression(metric_field: str):
+    if metric_field:
+        return HealthMetric.value_json[metric_field].as_float()
+    return func.coalesce(HealthMetric.value_number, _text_number())
+
+
+def _value_expression(metric_field: Optional[str]):
+    candidates = [HealthMetric.value_number]
+    if metric_field:
+        candidates.append(HealthMetric.value_json[metric_field].as_float())
+    candidates.append(_text_number())
+    return func.coalesce(*candidates)
+
+
+def _text_number():
+    """``value_text`` as a number, NULL unless it is numeric text.
+
+    A bare CAST turns text such as "good" into 0; the pattern keeps raw-row
+    aggregates in line with ``metric_values`` used by the rollups.
+    """
+    return case(
+        (
+            HealthMetric.value_text.regexp_match(NUMERIC_TEXT_PATTERN),
+            cast(HealthMetric.value_text, Numeric(20, 6, asdecimal=False)),
+        ),
+        else_=None,
+    )
@@ -0,0 +1,125 @@
+"""Bucket arithmetic shared by trend rollups and trend queries."""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional
+
+from .catalog import materialized_fields
+from .models import HealthMetric
+
+GRANULARITIES = ("day", "week", "month")
+# Text that counts as a number, written so MySQL's REGEXP and the Python
+# function SQLAlchemy registers for SQLite's REGEXP accept the same strings.
+NUMERIC_TEXT_PATTERN = r"^ *[-+]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][-+]?[0-9]+)? *$"
+_NUMERIC_TEXT = re.compile(NUMERIC_TEXT_PATTERN)
+
+
+@dataclass
+class BucketStats:
+    count: int = 0
+    total: float = 0.0
+    total_sq: float = 0.0
+    min_value: Optional[float] = None
+    max_value: Optional[float] = None
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+        self.min_value = value if self.min_value is None else min(self.min_value, value)
+        self.max_value = value if self.max_value is None else max(self.max_value, value)
+
+    def merge(self, other: "BucketStats") -> None:
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        for attr, pick in (("min_value", min), ("max_value", max)):
+            mine, theirs = getattr(self, attr), getattr(other, attr)
+            if theirs is not None:
+                setattr(self, attr, theirs if mine is None else pick(mine, theirs))
+
+
+def bucket_start(ts: datetime, granularity: str) -> date:
+    day = ts.date()
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unsupported group_by: {granularity}")
+
+
+def next_bucket_start(start: date, granularity: str) -> date:
+    if granularity == "day":
+        return start + timedelta(days=1)
+    if granularity == "week":
+        return start + timedelta(days=7)
+    if granularity == "month":
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    raise ValueError(f"Unsupported group_by: {granularity}")
+
+
+def bucket_label(start: date, granularity: str) -> str:
+    if granularity == "day":
+        return start.isoformat()
+    if granularity == "week":
+        iso = start.isocalendar()
+        return f"{iso.year}-W{iso.week:02d}"
+    if granularity == "month":
+        return start.strftime("%Y-%m")
+    raise ValueError(f"Unsupported group_by: {granularity}")
+
+
+def bucket_from_label(label: str, granularity: str) -> date:
+    """Inverse of ``bucket_label``: the first day of the labelled bucket."""
+    if granularity == "day":
+        return date.fromisoformat(label)
+    if granularity == "week":
+        year, week = label.split("-W")
+        return date.fromisocalendar(int(year), int(week), 1)
+    if granularity == "month":
+        year, month = label.split("-")
+        return date(int(year), int(month), 1)
+    raise ValueError(f"Unsupported group_by: {granularity}")
+
+
+def metric_values(metric: HealthMetric) -> Dict[str, float]:
+    """Numeric values a record contributes to rollups, keyed by metric field.
+
+    Scalar values use the empty field name; object values contribute each
+    numeric top-level field.
+    """
+    if metric.value_number is not None:
+        return {"": float(metric.value_number)}
+    if isinstance(metric.value_json, dict):
+        return {
+            field: float(value)
+            for field, value in metric.value_json.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+        }
+    number = numeric_text(metric.value_text)
+    return {} if number is None else {"": number}
+
+
+def numeric_text(value: Optional[str]) -> Optional[float]:
+    """``value`` as a float if it matches ``NUMERIC_TEXT_PATTERN``, else None."""
+    if value and _NUMERIC_TEXT.search(value):
+        return float(value)
+    return None
+
+
+def field_values(type_code: str, value_json: Any) -> Dict[str, float]:
+    """Catalog-declared numeric sub-fields of an object value, keyed by field."""
+    fields = materialized_fields(type_code)
+    if not fields or not isinstance(value_json, dict):
+        return {}
+    values = {}
+    for field in fields:
+        value = value_json.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[field] = float(value)
+    return values
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from pydantic import BaseModel, Field, root_validator, validator
 
@@ -51,6 +51,10 @@ class QueryFilters(BaseModel):
     start_time: Optional[datetime]
     end_time: Optional[datetime]
     source: Optional[str]
+    cursor: Optional[str] = None
+    max_points: Optional[int] = None
+    downsample: str = "lttb"
+    metric_field: Optional[str] = None
 
     @validator("order")
     def validate_order(cls, value: str) -> str:
@@ -59,8 +63,26 @@ class QueryFilters(BaseModel):
         return value
 
 
+class ExportFilters(BaseModel):
+    user_id: str
+    type: Optional[str] = None
+    start_time: Optional[datetime]
+    end_time: Optional[datetime]
+    source: Optional[str]
+    format: str = "ndjson"
+
+    @validator("format")
+    def validate_format(cls, value: str) -> str:
+        if value not in {"ndjson", "csv"}:
+            raise ValueError("format must be 'ndjson' or 'csv'")
+        return value
+
+
 class HealthQueryMetricsOutput(BaseModel):
     records: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+    points: Optional[List[Dict[str, Any]]] = None
+    downsampling: Optional[Dict[str, Any]] = None
 
 
 class TrendSummaryInput(BaseModel):
@@ -69,6 +91,8 @@ class TrendSummaryInput(BaseModel):
     metric_field: Optional[str]
     group_by: str = "week"
     lookback_days: Optional[int] = None
+    max_points: Optional[int] = None
+    downsample: str = "lttb"
 
     @validator("group_by")
     def validate_group_by(cls, value: str) -> str:
@@ -80,6 +104,42 @@ class TrendSummaryInput(BaseModel):
 class TrendSummaryOutput(BaseModel):
     points: List[Dict[str, Any]]
     stats: Dict[str, Any]
+    downsampling: Optional[Dict[str, Any]] = None
+
+
+class TrendSeriesInput(BaseModel):
+    type: str
+    metric_field: Optional[str]
+
+
+class MultiTrendSummaryInput(BaseModel):
+    user_id: str
+    series: List[TrendSeriesInput]
+    group_by: str = "week"
+    lookback_days: Optional[int] = None
+
+    @validator("group_by")
+    def validate_group_by(cls, value: str) -> str:
+        if value not in {"day", "week", "month"}:
+            raise ValueError("group_by must be day/week/month")
+        return value
+
+    def series_keys(self) -> List[Tuple[str, Optional[str]]]:
+        return [(item.type, item.metric_field) for item in self.series]
+
+
+class MultiTrendSummaryOutput(BaseModel):
+    group_by: str
+    buckets: List[str]
+    series: List[Dict[str, Any]]
+
+
+class SeriesSamplesOutput(BaseModel):
+    record_id: str
+    type: str
+    recorded_at: str
+    unit: Optional[str]
+    samples: List[List[float]]
 
 
 class HealthDeleteRecordInput(BaseModel):
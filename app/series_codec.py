@@ -0,0 +1,215 @@
+"""Compact storage of high-frequency samples for ``value_schema="series"``.
+
+A series record holds ``(offset, value)`` samples relative to its
+``recorded_at``. Samples are cut into blocks of up to ``SERIES_BLOCK_SIZE``
+within one UTC day; each block is delta-encoded with the narrowest integer width that fits and then
+zlib-compressed. Values that are exact decimals (most device readings) are
+scaled to integers first so their deltas stay small; anything else is kept
+as raw float64.
+
+Payload layout: a 1-byte format version, the byte widths of the offset and
+value deltas (0 for raw float64 values), the decimal scale and the sample
+count, followed by the compressed offset deltas and value deltas.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import struct
+import zlib
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .rollups import BucketStats
+
+SERIES_BLOCK_SIZE = 1024
+MAX_SERIES_SAMPLES = 172_800
+MAX_VALUE_SCALE = 6
+BLOCK_MAX_SPAN = timedelta(days=1)
+
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<BBBBI")
+_UNSIGNED = {1: np.uint8, 2: np.uint16, 4: np.uint32, 8: np.uint64}
+_SIGNED = {1: np.int8, 2: np.int16, 4: np.int32, 8: np.int64}
+_EXACT_INTEGER = 2 ** 53
+_MILLISECOND = timedelta(milliseconds=1)
+
+
+@dataclass
+class SampleSeries:
+    """Samples of one record: millisecond offsets (non-decreasing) and values."""
+
+    offsets_ms: np.ndarray
+    values: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.offsets_ms)
+
+    @classmethod
+    def from_value(cls, value: Any) -> "SampleSeries":
+        """Parse ``{"samples": [[offset_seconds, value], ...]}``."""
+        samples = value.get("samples") if isinstance(value, dict) else None
+        if not isinstance(samples, list) or not samples:
+            raise ValueError('Series values must be {"samples": [[offset_seconds, value], ...]}')
+        if len(samples) > MAX_SERIES_SAMPLES:
+            raise ValueError(f"A series holds at most {MAX_SERIES_SAMPLES} samples")
+        try:
+            table = np.array(samples, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError("Series samples must be [offset_seconds, value] number pairs")
+        if table.ndim != 2 or table.shape[1] != 2 or not np.isfinite(table).all():
+            raise ValueError("Series samples must be [offset_seconds, value] number pairs")
+        offsets_ms = np.rint(table[:, 0] * 1000).astype(np.int64)
+        if offsets_ms[0] < 0 or (np.diff(offsets_ms) < 0).any():
+            raise ValueError("Series offsets must be non-negative and non-decreasing")
+        return cls(offsets_ms, table[:, 1].copy())
+
+    def to_value(self) -> dict:
+        """Inverse of ``from_value`` (offsets at millisecond resolution)."""
+        return {"samples": np.column_stack((self.offsets_ms / 1000, self.values)).tolist()}
+
+    def digest(self) -> str:
+        """Content hash of the normalized samples, used for deduplication."""
+        hasher = hashlib.sha256(self.offsets_ms.astype("<i8").tobytes())
+        hasher.update(self.values.astype("<f8").tobytes())
+        return hasher.hexdigest()
+
+    def summary(self) -> dict:
+        """Small JSON description kept on the record row itself."""
+        return {
+            "samples": len(self),
+            "duration_seconds": float(self.offsets_ms[-1] - self.offsets_ms[0]) / 1000,
+            "min": float(self.values.min()),
+            "max": float(self.values.max()),
+            "mean": float(self.values.mean()),
+        }
+
+    def blocks(self, recorded_at: datetime) -> Iterator["SampleSeries"]:
+        """Consecutive blocks of at most ``SERIES_BLOCK_SIZE`` samples.
+
+        Blocks never span a UTC day boundary, so a block lies inside one
+        day/week/month bucket and its span is bounded by ``BLOCK_MAX_SPAN``.
+        """
+        days = self.timestamps(recorded_at).astype("datetime64[D]").astype(np.int64)
+        day_starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]).tolist()
+        for begin, end in zip(day_starts, day_starts[1:] + [len(self)]):
+            for start in range(begin, end, SERIES_BLOCK_SIZE):
+                stop = min(start + SERIES_BLOCK_SIZE, end)
+                yield SampleSeries(self.offsets_ms[start:stop], self.values[start:stop])
+
+    def timestamps(self, recorded_at: datetime) -> np.ndarray:
+        return np.datetime64(recorded_at, "ms") + self.offsets_ms.astype("timedelta64[ms]")
+
+    def bucket_stats(self, recorded_at: datetime, granularity: str) -> List[Tuple[date, BucketStats]]:
+        """Per-bucket statistics of the samples, placed by their own timestamps."""
+        days = self.timestamps(recorded_at).astype("datetime64[D]")
+        if granularity == "day":
+            starts = days
+        elif granularity == "week":
+            # 1970-01-01 was a Thursday; shift every day back to its Monday.
+            starts = days - (days.astype(np.int64) + 3) % 7
+        elif granularity == "month":
+            starts = days.astype("datetime64[M]").astype("datetime64[D]")
+        else:
+            raise ValueError(f"Unsupported group_by: {granularity}")
+        ordinals = starts.astype(np.int64)
+        # Offsets are sorted, so each bucket is one contiguous run.
+        heads = np.flatnonzero(np.r_[True, ordinals[1:] != ordinals[:-1]])
+        counts = np.diff(np.r_[heads, len(ordinals)])
+        values = self.values
+        columns = zip(
+            starts[heads].tolist(),
+            counts.tolist(),
+            np.add.reduceat(values, heads).tolist(),
+            np.add.reduceat(values * values, heads).tolist(),
+            np.minimum.reduceat(values, heads).tolist(),
+            np.maximum.reduceat(values, heads).tolist(),
+        )
+        return [
+            (start, BucketStats(count, total, total_sq, low, high))
+            for start, count, total, total_sq, low, high in columns
+        ]
+
+    def between(
+        self,
+        recorded_at: datetime,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        inclusive_end: bool = True,
+    ) -> "SampleSeries":
+        """Samples whose timestamp lies in ``[start, end]`` (or ``[start, end)``)."""
+        lo, hi = 0, len(self)
+        if start is not None:
+            lo = int(np.searchsorted(self.offsets_ms, _ceil_ms(start - recorded_at), "left"))
+        if end is not None:
+            if inclusive_end:
+                last = (end - recorded_at) // _MILLISECOND
+            else:
+                last = _ceil_ms(end - recorded_at) - 1
+            hi = int(np.searchsorted(self.offsets_ms, last, "right"))
+        return SampleSeries(self.offsets_ms[lo:hi], self.values[lo:hi])
+
+    @classmethod
+    def concat(cls, parts: List["SampleSeries"]) -> "SampleSeries":
+        if not parts:
+            return cls(np.empty(0, np.int64), np.empty(0))
+        return cls(
+            np.concatenate([part.offsets_ms for part in parts]),
+            np.concatenate([part.values for part in parts]),
+        )
+
+
+def encode_block(block: SampleSeries) -> bytes:
+    offset_deltas = np.diff(block.offsets_ms, prepend=np.int64(0))
+    offset_width = _width(int(offset_deltas.max()), signed=False)
+    scale = _decimal_scale(block.values)
+    if scale is None:
+        value_width, scale, value_bytes = 0, 0, block.values.astype("<f8").tobytes()
+    else:
+        scaled = np.rint(block.values * 10.0 ** scale).astype(np.int64)
+        value_deltas = np.diff(scaled, prepend=np.int64(0))
+        value_width = _width(int(np.abs(value_deltas).max()), signed=True)
+        value_bytes = value_deltas.astype(np.dtype(_SIGNED[value_width]).newbyteorder("<")).tobytes()
+    header = _HEADER.pack(_FORMAT_VERSION, offset_width, value_width, scale, len(block))
+    body = offset_deltas.astype(np.dtype(_UNSIGNED[offset_width]).newbyteorder("<")).tobytes()
+    return header + zlib.compress(body + value_bytes)
+
+
+def decode_block(payload: bytes) -> SampleSeries:
+    version, offset_width, value_width, scale, count = _HEADER.unpack_from(payload)
+    if version != _FORMAT_VERSION:
+        raise ValueError(f"Unsupported series block format: {version}")
+    body = zlib.decompress(payload[_HEADER.size:])
+    split = offset_width * count
+    offsets = np.frombuffer(body[:split], np.dtype(_UNSIGNED[offset_width]).newbyteorder("<"))
+    offsets_ms = np.cumsum(offsets, dtype=np.int64)
+    if value_width == 0:
+        values = np.frombuffer(body[split:], "<f8").astype(np.float64)
+    else:
+        deltas = np.frombuffer(body[split:], np.dtype(_SIGNED[value_width]).newbyteorder("<"))
+        values = np.cumsum(deltas, dtype=np.int64) / 10.0 ** scale
+    return SampleSeries(offsets_ms, values)
+
+
+def _decimal_scale(values: np.ndarray):
+    """Smallest number of decimals that represents every value exactly."""
+    for scale in range(MAX_VALUE_SCALE + 1):
+        factor = 10.0 ** scale
+        scaled = np.rint(values * factor)
+        if np.abs(scaled).max() >= _EXACT_INTEGER:
+            return None
+        if np.array_equal(scaled / factor, values):
+            return scale
+    return None
+
+
+def _width(magnitude: int, signed: bool) -> int:
+    bits = magnitude.bit_length() + (1 if signed else 0)
+    return next(width for width in (1, 2, 4, 8) if bits <= width * 8)
+
+
+def _ceil_ms(delta: timedelta) -> int:
+    return -(-delta // _MILLISECOND)
@@ -1,20 +1,42 @@
 from __future__ import annotations
 
 from dataclasses import asdict
-from datetime import datetime, timedelta
-from typing import Dict, Iterable, List, Optional
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from .cache import MetricCache, metric_cache
 from .catalog import get_metric_type, list_metric_types
+from .config import get_settings
+from .downsampling import DOWNSAMPLE_METHODS, MIN_POINTS, Sample, downsample
 from .models import HealthMetric
-from .repositories import MetricRepository, group_by_timepoints
-from .utils import compute_dedup_hash, ensure_datetime
+from .repositories import MetricRepository
+from .rollups import BucketStats, bucket_label
+from .series_codec import SampleSeries
+from .trend_stats import SeriesArrays, bucket_labels, summarize
+from .utils import (
+    compute_dedup_hash,
+    decode_cursor,
+    encode_cursor,
+    ensure_datetime,
+    loop_greenlet,
+    optional_datetime,
+    run_blocking,
+    run_blocking_stream,
+    tag_filter_pairs,
+)
+
+
+MAX_TREND_SERIES = 10
+EPOCH = datetime(1970, 1, 1)
 
 
 class MetricService:
-    def __init__(self, session: Session):
+    def __init__(self, session: Session, cache: Optional[MetricCache] = None):
         self.repo = MetricRepository(session)
+        self.cache = cache or metric_cache
 
     def store_metric(
         self,
@@ -28,13 +50,81 @@ class MetricService:
         metadata: Optional[Dict],
         tags: Optional[Dict],
     ) -> tuple[HealthMetric, bool]:
+        metric = run_blocking(
+            lambda: self._build_metric(
+                user_id=user_id,
+                type_code=type_code,
+                value=value,
+                unit=unit,
+                recorded_at=recorded_at,
+                source=source,
+                metadata=metadata,
+                tags=tags,
+            )
+        )
+        created = self.repo.create_metric(metric)
+        deduplicated = created is not metric
+        return created, deduplicated
+
+    def batch_store_metrics(
+        self, metrics: Iterable[Dict]
+    ) -> List[tuple[HealthMetric, bool]]:
+        """Store a batch, short-circuiting files that were already ingested.
+
+        Records sharing a ``metadata.file_hash`` form one file per user. When
+        that file was stored before with the same number of records, its
+        records resolve to the existing ones with a single lookup, without
+        hashing or inserting any row.
+        """
+        payloads = list(metrics)
+        results: List[Optional[tuple[HealthMetric, bool]]] = [None] * len(payloads)
+        files: Dict[tuple[str, str], List[int]] = {}
+        for index, payload in enumerate(payloads):
+            file_hash = (payload.get("metadata") or {}).get("file_hash")
+            if file_hash:
+                files.setdefault((payload["user_id"], str(file_hash)), []).append(index)
+        for (user_id, file_hash), indexes in files.items():
+            known = self.repo.files.lookup(user_id, file_hash)
+            if len(known) == len(indexes):
+                for index, metric in zip(indexes, known):
+                    results[index] = (metric, True)
+
+        pending = [index for index, result in enumerate(results) if result is None]
+        built = run_blocking(lambda: [self._build_metric(**payloads[index]) for index in pending])
+        stored = self.repo.bulk_create(built)
+        for index, result in zip(pending, stored):
+            results[index] = result
+        written = set(pending)
+        for (user_id, file_hash), indexes in files.items():
+            if indexes[0] in written:
+                self.repo.files.record(user_id, file_hash, [results[i][0].id for i in indexes])
+        return results
+
+    def _build_metric(
+        self,
+        *,
+        user_id: str,
+        type_code: str,
+        value,
+        unit: Optional[str],
+        recorded_at: Optional[datetime],
+        source: str,
+        metadata: Optional[Dict],
+        tags: Optional[Dict],
+    ) -> HealthMetric:
         metric_type = get_metric_type(type_code)
         recorded_at = ensure_datetime(recorded_at)
-        dedup_hash = compute_dedup_hash(user_id, type_code, recorded_at, value, metadata)
         value_number = None
         value_json = None
         value_text = None
-        if isinstance(value, (int, float)):
+        samples = None
+        hashed_value = value
+        if metric_type and metric_type.value_schema == "series":
+            samples = SampleSeries.from_value(value)
+            value_json = samples.summary()
+            # Hash the normalized samples so an exported series re-imports as a duplicate.
+            hashed_value = {"series_sha256": samples.digest()}
+        elif isinstance(value, (int, float)):
             value_number = float(value)
         elif isinstance(value, dict):
             value_json = value
@@ -42,6 +132,7 @@ class MetricService:
             value_text = value
         elif value is not None:
             raise ValueError("Unsupported value type")
+        dedup_hash = compute_dedup_hash(user_id, type_code, recorded_at, hashed_value, metadata)
 
         metric = HealthMetric(
             user_id=user_id,
@@ -56,18 +147,8 @@ class MetricService:
             tags_json=tags,
             dedup_hash=dedup_hash,
         )
-        created = self.repo.create_metric(metric)
-        deduplicated = created is not metric
-        return created, deduplicated
-
-    def batch_store_metrics(
-        self, metrics: Iterable[Dict]
-    ) -> List[tuple[HealthMetric, bool]]:
-        created: List[tuple[HealthMetric, bool]] = []
-        for payload in metrics:
-            created_metric, dedup = self.store_metric(**payload)
-            created.append((created_metric, dedup))
-        return created
+        metric.samples = samples
+        return metric
 
     def query_metrics(
         self,
@@ -79,20 +160,154 @@ class MetricService:
         start_time: Optional[datetime],
         end_time: Optional[datetime],
         source: Optional[str],
-    ) -> List[HealthMetric]:
-        return self.repo.query_metrics(
-            user_id=user_id,
-            type_code=type_code,
-            limit=limit,
-            order=order,
-            start_time=start_time,
-            end_time=end_time,
-            source=source,
-        )
+        cursor: Optional[str] = None,
+        tags: Optional[Dict[str, Any]] = None,
+        max_points: Optional[int] = None,
+        downsample_method: str = "lttb",
+        metric_field: Optional[str] = None,
+    ) -> Dict:
+        """Return ``{"records": [...], "next_cursor": ...}`` for one page.
+
+        ``limit`` is capped at ``settings.query_max_limit``; ``0`` requests a
+        full page of that size rather than the entire history. ``tags`` keeps
+        only records carrying every given tag value.
+
+        With ``max_points`` the whole matching range of one type is instead
+        streamed and downsampled on the server: ``records`` stays empty and
+        ``points`` holds at most ``max_points`` ``(recorded_at, value,
+        record_id)`` samples of the numeric value (or ``metric_field`` of
+        object values).
+        """
+        tag_filter = tag_filter_pairs(tags) if tags else None
+        if max_points:
+            if cursor:
+                raise ValueError("cursor cannot be combined with max_points")
+            return self._downsampled_query(
+                user_id=user_id,
+                type_code=type_code,
+                metric_field=metric_field,
+                order=order,
+                start_time=start_time,
+                end_time=end_time,
+                source=source,
+                tag_filter=tag_filter,
+                max_points=max_points,
+                method=downsample_method,
+            )
+        max_limit = get_settings().query_max_limit
+        limit = min(limit, max_limit) if limit and limit > 0 else max_limit
+        after = decode_cursor(cursor, order) if cursor else None
+        filters = {
+            "limit": limit,
+            "order": order,
+            "start_time": optional_datetime(start_time),
+            "end_time": optional_datetime(end_time),
+            "source": source,
+        }
+
+        def load() -> Dict:
+            metrics = self.repo.query_metrics(
+                user_id=user_id,
+                type_code=type_code,
+                after=after,
+                tags=tag_filter,
+                **{**filters, "limit": limit + 1},
+            )
+            next_cursor = None
+            if len(metrics) > limit:
+                metrics = metrics[:limit]
+                last = metrics[-1]
+                next_cursor = encode_cursor(last.recorded_at, last.id, order)
+            return {
+                "records": run_blocking(lambda: [metric.to_dict() for metric in metrics]),
+                "next_cursor": next_cursor,
+            }
+
+        cache_filters = {**filters, "cursor": cursor, "tags": sorted(tag_filter or ())}
+        return self.cache.get_or_load("query", user_id, type_code, cache_filters, load)
+
+    def _downsampled_query(
+        self,
+        *,
+        user_id: str,
+        type_code: Optional[str],
+        metric_field: Optional[str],
+        order: str,
+        start_time: Optional[datetime],
+        end_time: Optional[datetime],
+        source: Optional[str],
+        tag_filter: Optional[Set[Tuple[str, str]]],
+        max_points: int,
+        method: str,
+    ) -> Dict:
+        if not type_code:
+            raise ValueError("max_points requires type")
+        max_points = _check_downsampling(max_points, method)
+        filters = {
+            "max_points": max_points,
+            "method": method,
+            "metric_field": metric_field,
+            "order": order,
+            "start_time": optional_datetime(start_time),
+            "end_time": optional_datetime(end_time),
+            "source": source,
+            "tags": sorted(tag_filter or ()),
+        }
+
+        def load() -> Dict:
+            total, rows = self.repo.series_samples(
+                user_id,
+                type_code,
+                metric_field,
+                start_time=filters["start_time"],
+                end_time=filters["end_time"],
+                source=source,
+                tags=tag_filter,
+            )
+            points = run_blocking_stream(
+                lambda stream: _downsampled_points(stream, total, max_points, method), rows
+            )
+            if order == "desc":
+                points.reverse()
+            return {
+                "records": [],
+                "next_cursor": None,
+                "points": points,
+                "downsampling": {"method": method, "max_points": max_points, "source_points": total},
+            }
+
+        return self.cache.get_or_load("query", user_id, type_code, filters, load)
 
     def delete_metric(self, user_id: str, record_id: str) -> bool:
         return self.repo.delete_metric(user_id, record_id)
 
+    def record_samples(
+        self,
+        *,
+        user_id: str,
+        record_id: str,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+    ) -> Optional[Dict]:
+        """Decoded samples of a series record, optionally sliced to a time range.
+
+        Offsets in ``samples`` stay relative to the record's ``recorded_at``.
+        Returns None when the record does not exist or is not a series.
+        """
+        found = self.repo.series.record_samples(
+            user_id, record_id, optional_datetime(start_time), optional_datetime(end_time)
+        )
+        if found is None:
+            return None
+        metric, samples = found
+        return {
+            "record_id": metric.id,
+            "type": metric.type_code,
+            "recorded_at": metric.recorded_at.isoformat(),
+            "unit": metric.unit,
+            **samples.to_value(),
+        }
+
     def trend_summary(
         self,
         *,
@@ -101,44 +316,247 @@ class MetricService:
         metric_field: Optional[str],
         group_by: str,
         lookback_days: Optional[int] = None,
+        max_points: Optional[int] = None,
+        downsample_method: str = "lttb",
     ) -> Dict:
-        start_time = None
-        if lookback_days:
-            start_time = datetime.utcnow() - timedelta(days=lookback_days)
-        metrics = self.repo.list_for_trend(user_id, type_code, metric_field, start_time)
-        if not metrics:
-            return {"points": [], "stats": {"slope": 0, "count": 0}}
-        buckets = group_by_timepoints(metrics, group_by, metric_field)
-        points = []
-        for key in sorted(buckets.keys()):
-            bucket = buckets[key]
-            points.append({
-                "time_bucket": key,
-                "average": bucket["total"] / bucket["count"],
-                "count": bucket["count"],
-            })
-        slope = _compute_slope(points)
-        return {
-            "points": points,
-            "stats": {"slope": slope, "count": len(metrics)},
+        """Bucketed trend of one series.
+
+        ``max_points`` thins the returned points with ``downsample_method``;
+        ``stats`` are always computed over every bucket.
+        """
+        if max_points:
+            max_points = _check_downsampling(max_points, downsample_method)
+        filters = {
+            "metric_field": metric_field,
+            "group_by": group_by,
+            "lookback_days": lookback_days,
+        }
+        if max_points:
+            filters.update(max_points=max_points, method=downsample_method)
+        return self.cache.get_or_load(
+            "trend",
+            user_id,
+            type_code,
+            filters,
+            lambda: self._trend_summary(
+                user_id,
+                type_code,
+                metric_field,
+                group_by,
+                lookback_days,
+                max_points,
+                downsample_method,
+            ),
+        )
+
+    def _trend_summary(
+        self,
+        user_id: str,
+        type_code: str,
+        metric_field: Optional[str],
+        group_by: str,
+        lookback_days: Optional[int],
+        max_points: Optional[int] = None,
+        method: str = "lttb",
+    ) -> Dict:
+        buckets = self.repo.trend_buckets(
+            user_id, type_code, metric_field, group_by, _lookback_start(lookback_days)
+        )
+        return run_blocking(_trend_points, buckets, group_by, max_points, method)
+
+    def multi_trend_summary(
+        self,
+        *,
+        user_id: str,
+        series: List[tuple[str, Optional[str]]],
+        group_by: str,
+        lookback_days: Optional[int] = None,
+    ) -> Dict:
+        """Trend several ``(type, metric_field)`` series on one shared bucket axis.
+
+        All series are read with a single rollup query. ``buckets`` lists
+        every bucket any series has data in; each series carries one point
+        per bucket, with ``average`` null and ``count`` 0 where it has none.
+        """
+        keys = list(dict.fromkeys(series))
+        if not keys:
+            raise ValueError("series must contain at least one (type, metric_field) pair")
+        if len(keys) > MAX_TREND_SERIES:
+            raise ValueError(f"At most {MAX_TREND_SERIES} series per call")
+        filters = {
+            "series": [list(key) for key in keys],
+            "group_by": group_by,
+            "lookback_days": lookback_days,
         }
+        return self.cache.get_or_load(
+            "multi_trend",
+            user_id,
+            None,
+            filters,
+            lambda: self._multi_trend_summary(user_id, keys, group_by, lookback_days),
+        )
+
+    def _multi_trend_summary(
+        self,
+        user_id: str,
+        keys: List[tuple[str, Optional[str]]],
+        group_by: str,
+        lookback_days: Optional[int],
+    ) -> Dict:
+        found = self.repo.trend_series(user_id, keys, group_by, _lookback_start(lookback_days))
+        return run_blocking(_merged_series, found, keys, group_by)
 
     def list_metric_types(self) -> List[Dict]:
         return [asdict(item) for item in list_metric_types()]
 
 
-def _compute_slope(points: List[Dict[str, float]]) -> float:
-    if len(points) < 2:
-        return 0.0
-    xs = list(range(len(points)))
-    ys = [point["average"] for point in points]
-    n = len(points)
-    sum_x = sum(xs)
-    sum_y = sum(ys)
-    sum_xy = sum(x * y for x, y in zip(xs, ys))
-    sum_x2 = sum(x * x for x in xs)
-    denominator = n * sum_x2 - sum_x ** 2
-    if denominator == 0:
-        return 0.0
-    slope = (n * sum_xy - sum_x * sum_y) / denominator
-    return slope
+T = TypeVar("T")
+
+
+class AsyncMetricService:
+    """``MetricService`` bound to an ``AsyncSession``.
+
+    The repository code runs unchanged through ``AsyncSession.run_sync``:
+    it executes on the event loop in a greenlet and every database round
+    trip awaits the async driver. Keeping one repository means dedup,
+    rollup, field, tag, series, archive and counter maintenance cannot drift
+    between the two paths. The CPU-bound parts (building and hashing records,
+    serializing results, cache round trips, NumPy and downsampling work,
+    archive file reads) go through ``run_blocking`` and are awaited in the
+    threadpool.
+    """
+
+    def __init__(self, session: AsyncSession, cache: Optional[MetricCache] = None):
+        self.session = session
+        self.cache = cache
+
+    async def run(self, func: Callable[[MetricService], T]) -> T:
+        """Call ``func`` with a synchronous service bound to this session."""
+        return await self.session.run_sync(
+            loop_greenlet(lambda sync_session: func(MetricService(sync_session, self.cache)))
+        )
+
+    async def store_metric(self, **kwargs: Any) -> tuple[HealthMetric, bool]:
+        return await self.run(lambda service: service.store_metric(**kwargs))
+
+    async def batch_store_metrics(
+        self, metrics: Iterable[Dict]
+    ) -> List[tuple[HealthMetric, bool]]:
+        return await self.run(lambda service: service.batch_store_metrics(metrics))
+
+    async def query_metrics(self, **kwargs: Any) -> Dict:
+        return await self.run(lambda service: service.query_metrics(**kwargs))
+
+    async def delete_metric(self, user_id: str, record_id: str) -> bool:
+        return await self.run(lambda service: service.delete_metric(user_id, record_id))
+
+    async def trend_summary(self, **kwargs: Any) -> Dict:
+        return await self.run(lambda service: service.trend_summary(**kwargs))
+
+    async def multi_trend_summary(self, **kwargs: Any) -> Dict:
+        return await self.run(lambda service: service.multi_trend_summary(**kwargs))
+
+
+def _check_downsampling(max_points: int, method: str) -> int:
+    """Validate downsampling options; ``max_points`` is capped by the settings."""
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"downsample must be one of {', '.join(DOWNSAMPLE_METHODS)}")
+    if max_points < MIN_POINTS:
+        raise ValueError(f"max_points must be at least {MIN_POINTS}")
+    return min(max_points, get_settings().downsample_max_points)
+
+
+def _lookback_start(lookback_days: Optional[int]) -> Optional[datetime]:
+    if not lookback_days:
+        return None
+    return datetime.utcnow() - timedelta(days=lookback_days)
+
+
+def _downsampled_points(
+    rows: Iterable[Tuple[datetime, str, float]], total: int, max_points: int, method: str
+) -> List[Dict]:
+    samples = (
+        Sample((recorded_at - EPOCH).total_seconds(), value, (recorded_at, record_id))
+        for recorded_at, record_id, value in rows
+    )
+    return [
+        {
+            "recorded_at": sample.item[0].isoformat(),
+            "value": sample.y,
+            "record_id": sample.item[1],
+        }
+        for sample in downsample(samples, total, max_points, method)
+    ]
+
+
+def _trend_points(
+    buckets: List[Tuple[date, BucketStats]],
+    group_by: str,
+    max_points: Optional[int],
+    method: str,
+) -> Dict:
+    summary = _series_summary(buckets, group_by)
+    if max_points:
+        points = summary["points"]
+        samples = (
+            Sample(float(start.toordinal()), point["average"], point)
+            for (start, _), point in zip(buckets, points)
+        )
+        summary["points"] = [
+            sample.item for sample in downsample(samples, len(points), max_points, method)
+        ]
+        summary["downsampling"] = {
+            "method": method,
+            "max_points": max_points,
+            "source_points": len(points),
+        }
+    return summary
+
+
+def _merged_series(
+    found: Dict[Tuple[str, Optional[str]], List[Tuple[date, BucketStats]]],
+    keys: List[tuple[str, Optional[str]]],
+    group_by: str,
+) -> Dict:
+    starts = sorted({start for buckets in found.values() for start, _ in buckets})
+    labels = [bucket_label(start, group_by) for start in starts]
+    series = []
+    for type_code, metric_field in keys:
+        summary = _series_summary(found[(type_code, metric_field)], group_by)
+        by_label = {point["time_bucket"]: point for point in summary["points"]}
+        series.append(
+            {
+                "type": type_code,
+                "metric_field": metric_field,
+                "points": [
+                    by_label.get(label, {"time_bucket": label, "average": None, "count": 0})
+                    for label in labels
+                ],
+                "stats": summary["stats"],
+            }
+        )
+    return {"group_by": group_by, "buckets": labels, "series": series}
+
+
+def _series_summary(buckets: List[Tuple[date, BucketStats]], group_by: str) -> Dict:
+    if not buckets:
+        return {"points": [], "stats": {"slope": 0, "count": 0}}
+    arrays = SeriesArrays.from_buckets(buckets)
+    summary = summarize(arrays)
+    points = [
+        {
+            "time_bucket": label,
+            "average": average,
+            "count": count,
+            "moving_average": moving,
+            "smoothed": smoothed,
+        }
+        for label, average, count, moving, smoothed in zip(
+            bucket_labels(arrays.days, group_by),
+            summary["averages"].tolist(),
+            arrays.count.astype(int).tolist(),
+            summary["moving_average"].tolist(),
+            summary["smoothed"].tolist(),
+        )
+    ]
+    return {"points": points, "stats": summary["stats"]}
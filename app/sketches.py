@@ -0,0 +1,41 @@
+"""HyperLogLog helpers for approximate distinct counts."""
+
+from __future__ import annotations
+
+import hashlib
+import math
+from typing import Mapping, Tuple
+
+HLL_PRECISION = 10
+HLL_REGISTERS = 1 << HLL_PRECISION
+_HASH_BITS = 64
+
+
+def hll_register(value: str) -> Tuple[int, int]:
+    """Return ``(slot, rank)`` contributed by ``value`` to a sketch.
+
+    The top ``HLL_PRECISION`` bits of a 64-bit hash pick the register; the
+    rank is the position of the first set bit in the remaining bits.
+    """
+    digest = hashlib.sha1(value.encode("utf-8")).digest()
+    hashed = int.from_bytes(digest[:8], "big")
+    remaining_bits = _HASH_BITS - HLL_PRECISION
+    slot = hashed >> remaining_bits
+    rest = hashed & ((1 << remaining_bits) - 1)
+    return slot, remaining_bits - rest.bit_length() + 1
+
+
+def hll_estimate(registers: Mapping[int, int]) -> int:
+    """Estimate the cardinality from ``{slot: max_rank}`` (missing slots are 0).
+
+    With 1024 registers the standard error is about 3%; small cardinalities
+    use linear counting, which is close to exact.
+    """
+    m = HLL_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    harmonic = sum(2.0 ** -registers.get(slot, 0) for slot in range(m))
+    estimate = alpha * m * m / harmonic
+    zeros = sum(1 for slot in range(m) if not registers.get(slot))
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
@@ -0,0 +1,172 @@
+"""Vectorized statistics over trend bucket series.
+
+Every statistic is computed with NumPy over contiguous arrays of bucket
+start times and per-bucket aggregates (count, sum, sum of squares, min,
+max) as stored in the rollups, so the cost is a handful of array passes
+regardless of how many buckets a series has.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .rollups import bucket_label
+
+MOVING_AVERAGE_WINDOW = 3
+SMOOTHING_ALPHA = 0.3
+PERCENTILES = (10, 50, 90)
+# Block length of the blocked exponential smoothing; keeps (1 - alpha)**-k
+# small enough that the closed form stays accurate to ~1e-10.
+_SMOOTHING_BLOCK = 32
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_ROW_DTYPE = np.dtype(
+    [(name, np.float64) for name in ("days", "count", "total", "total_sq", "min_value", "max_value")]
+)
+
+
+@dataclass
+class SeriesArrays:
+    """Column arrays of one bucket series, ordered by ``days``."""
+
+    days: np.ndarray  # bucket start as a proleptic Gregorian ordinal
+    count: np.ndarray
+    total: np.ndarray
+    total_sq: np.ndarray
+    min_value: np.ndarray
+    max_value: np.ndarray
+
+    @classmethod
+    def from_buckets(cls, buckets: Sequence[Tuple[date, Any]]) -> "SeriesArrays":
+        """Build from ``(bucket start, BucketStats)`` pairs in one pass."""
+        table = np.fromiter(
+            (
+                (
+                    start.toordinal(),
+                    stats.count,
+                    stats.total,
+                    stats.total_sq,
+                    stats.min_value,
+                    stats.max_value,
+                )
+                for start, stats in buckets
+            ),
+            dtype=_ROW_DTYPE,
+            count=len(buckets),
+        )
+        return cls(*(table[name] for name in _ROW_DTYPE.names))
+
+
+def bucket_labels(days: np.ndarray, granularity: str) -> List[str]:
+    """``rollups.bucket_label`` for every ordinal in ``days``.
+
+    Day and month labels are rendered by NumPy's ISO date formatting; ISO
+    week labels have no NumPy equivalent and fall back to per-bucket calls.
+    """
+    if granularity in ("day", "month"):
+        epoch_days = days.astype(np.int64) - _EPOCH_ORDINAL
+        unit = "D" if granularity == "day" else "M"
+        return epoch_days.astype("datetime64[D]").astype(f"datetime64[{unit}]").astype(str).tolist()
+    return [bucket_label(date.fromordinal(day), granularity) for day in days.astype(int).tolist()]
+
+
+def summarize(
+    series: SeriesArrays,
+    window: int = MOVING_AVERAGE_WINDOW,
+    alpha: float = SMOOTHING_ALPHA,
+) -> Dict[str, Any]:
+    """Per-bucket averages and derived series plus whole-series statistics.
+
+    ``slope`` is the least-squares slope of bucket averages per bucket step
+    (unchanged from earlier releases); ``slope_per_day`` regresses against
+    elapsed days, weighting each bucket by its sample count, so uneven gaps
+    between buckets no longer distort it. ``stddev`` is the exact population
+    standard deviation of all samples, recovered from the stored sums;
+    percentiles are taken over the bucket averages.
+    """
+    count = series.count
+    samples = float(count.sum())
+    if not len(count) or samples == 0:
+        return {
+            "averages": np.empty(0),
+            "moving_average": np.empty(0),
+            "smoothed": np.empty(0),
+            "stats": {"slope": 0, "count": 0},
+        }
+    averages = series.total / count
+    mean = float(series.total.sum()) / samples
+    variance = max(float(series.total_sq.sum()) / samples - mean * mean, 0.0)
+    stats: Dict[str, Any] = {
+        "slope": _slope(np.arange(len(averages), dtype=np.float64), averages),
+        "slope_per_day": _slope(series.days - series.days[0], averages, count),
+        "count": int(samples),
+        "mean": mean,
+        "stddev": float(np.sqrt(variance)),
+        "min": float(series.min_value.min()),
+        "max": float(series.max_value.max()),
+        "percentiles": {
+            f"p{q}": float(value)
+            for q, value in zip(PERCENTILES, np.percentile(averages, PERCENTILES))
+        },
+    }
+    return {
+        "averages": averages,
+        "moving_average": moving_average(averages, window),
+        "smoothed": exponential_smoothing(averages, alpha),
+        "stats": stats,
+    }
+
+
+def moving_average(values: np.ndarray, window: int) -> np.ndarray:
+    """Trailing mean over up to ``window`` points (shorter at the start)."""
+    sums = np.cumsum(values)
+    result = sums.copy()
+    result[window:] = sums[window:] - sums[:-window]
+    return result / np.minimum(np.arange(1, len(values) + 1), window)
+
+
+def exponential_smoothing(values: np.ndarray, alpha: float) -> np.ndarray:
+    """``s[0] = x[0]``, ``s[t] = s[t-1] + alpha * (x[t] - s[t-1])``.
+
+    The recurrence is solved in closed form inside fixed-size blocks for all
+    blocks at once; only the carry between blocks is propagated serially.
+    """
+    n = len(values)
+    if n == 0:
+        return values.astype(np.float64)
+    decay = 1.0 - alpha
+    block = _SMOOTHING_BLOCK
+    blocks = -(-n // block)
+    padded = np.zeros(blocks * block)
+    padded[:n] = values
+    x = padded.reshape(blocks, block)
+    k = np.arange(block)
+    # Smoothed values of each block as if the preceding value were 0.
+    local = alpha * decay ** k * np.cumsum(x * decay ** -k, axis=1)
+    carry_weight = decay ** (k + 1)
+    # Value carried into each block: starts from x[0] so that s[0] == x[0].
+    carries = np.empty(blocks)
+    carry = float(values[0])
+    last_weight = carry_weight[-1]
+    last_local = local[:, -1]
+    for index in range(blocks):
+        carries[index] = carry
+        carry = last_weight * carry + last_local[index]
+    return (local + carries[:, None] * carry_weight).ravel()[:n]
+
+
+def _slope(x: np.ndarray, y: np.ndarray, weights: np.ndarray = None) -> float:
+    if len(x) < 2:
+        return 0.0
+    w = np.ones_like(x) if weights is None else weights
+    total = w.sum()
+    x_mean = float((w * x).sum() / total)
+    y_mean = float((w * y).sum() / total)
+    dx = x - x_mean
+    denominator = float((w * dx * dx).sum())
+    if denominator == 0:
+        return 0.0
+    return float((w * dx * (y - y_mean)).sum() / denominator)
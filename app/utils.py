@@ -1,7 +1,35 @@
+import asyncio
+import base64
 import hashlib
 import json
+import os
+import queue
+import time
+import uuid
+import weakref
 from datetime import datetime
-from typing import Any, Dict, Optional, Union
+from functools import wraps
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar, Union
+
+from starlette.concurrency import run_in_threadpool
+
+try:  # pragma: no cover - greenlet backs SQLAlchemy's asyncio support
+    from sqlalchemy.util import await_only
+    from greenlet import getcurrent
+except ImportError:  # pragma: no cover
+    getcurrent = None
+
+TAG_KEY_MAX_LENGTH = 64
+TAG_VALUE_MAX_LENGTH = 128
+
+T = TypeVar("T")
+# Batches handed from the event loop to a worker consuming a stream.
+HANDOFF_BATCH_SIZE = 1000
+HANDOFF_QUEUE_BATCHES = 2
+
+# Greenlets currently running a ``loop_greenlet`` function on the event loop.
+_loop_greenlets: "weakref.WeakSet[Any]" = weakref.WeakSet()
 
 
 def compute_dedup_hash(
@@ -22,9 +50,186 @@ def compute_dedup_hash(
     return hashlib.sha256(encoded).hexdigest()
 
 
+def uuid7() -> str:
+    """Time-ordered UUID (RFC 9562 version 7) in canonical string form.
+
+    A 48-bit Unix millisecond timestamp leads, so new ids sort after older
+    ones and inserts append to the end of a clustered primary key.
+    """
+    millis = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (
+        (millis & ((1 << 48) - 1)) << 80
+        | 0x7 << 76
+        | (rand >> 62 & 0xFFF) << 64
+        | 0b10 << 62
+        | rand & ((1 << 62) - 1)
+    )
+    return str(uuid.UUID(int=value))
+
+
+def loop_greenlet(func: Callable[..., T]) -> Callable[..., T]:
+    """Mark ``func`` as run by ``AsyncSession.run_sync``, i.e. on the event loop.
+
+    While it runs, ``run_blocking`` calls made from it are awaited in the
+    threadpool (through SQLAlchemy's public ``await_only``).
+    """
+
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        current = getcurrent()
+        added = current not in _loop_greenlets
+        _loop_greenlets.add(current)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if added:
+                _loop_greenlets.discard(current)
+
+    return wrapper
+
+
+def run_blocking(func: Callable[..., T], *args: Any) -> T:
+    """Call ``func``, in a worker thread when running on the event loop.
+
+    ``AsyncSession.run_sync`` runs the repository code on the event loop in a
+    greenlet (see ``loop_greenlet``); there cache round trips, segment file
+    reads, record building and NumPy work are awaited in the threadpool
+    instead of blocking every other request. ``func`` must not use the
+    session. Anywhere else this is a plain call.
+    """
+    if not _on_event_loop():
+        return func(*args)
+    return await_only(run_in_threadpool(func, *args))
+
+
+def run_blocking_stream(func: Callable[[Iterator[Any]], T], items: Iterable[Any]) -> T:
+    """Call ``func`` on an iterator over ``items``, like ``run_blocking``.
+
+    ``items`` may read a database cursor, so on the event loop it is pulled
+    there and handed to ``func`` in a worker thread a batch at a time; the
+    loop waits while the worker is a few batches behind.
+    """
+    if not _on_event_loop():
+        return func(iter(items))
+    handoff: "queue.Queue[Optional[List[Any]]]" = queue.Queue(HANDOFF_QUEUE_BATCHES)
+
+    def stream() -> Iterator[Any]:
+        while True:
+            batch = handoff.get()
+            if batch is None:
+                return
+            yield from batch
+
+    result = asyncio.get_running_loop().run_in_executor(None, lambda: func(stream()))
+
+    def put(batch: Optional[List[Any]]) -> None:
+        # Stop handing over once ``func`` returned or failed without reading everything.
+        while not result.done():
+            try:
+                handoff.put(batch, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    try:
+        iterator = iter(items)
+        while not result.done():
+            batch = list(islice(iterator, HANDOFF_BATCH_SIZE))
+            if not batch:
+                break
+            run_blocking(put, batch)
+    finally:
+        run_blocking(put, None)
+    return await_only(result)
+
+
+def _on_event_loop() -> bool:
+    return getcurrent is not None and getcurrent() in _loop_greenlets
+
+
 def ensure_datetime(value: Optional[Union[str, datetime]]) -> datetime:
     if isinstance(value, datetime):
         return value
     if isinstance(value, str):
         return datetime.fromisoformat(value)
     return datetime.utcnow()
+
+
+def optional_datetime(value: Optional[Union[str, datetime]]) -> Optional[datetime]:
+    if value is None or value == "":
+        return None
+    return ensure_datetime(value)
+
+
+def encode_cursor(recorded_at: datetime, record_id: str, order: str) -> str:
+    payload = json.dumps([recorded_at.isoformat(), record_id, order], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, order: str) -> Tuple[datetime, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        recorded_at, record_id, cursor_order = json.loads(base64.urlsafe_b64decode(padded))
+        position = (datetime.fromisoformat(recorded_at), str(record_id))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if cursor_order != order:
+        raise ValueError("Cursor was issued for a different sort order")
+    return position
+
+
+def tag_pairs(tags: Optional[Dict[str, Any]]) -> Set[Tuple[str, str]]:
+    """``(key, value)`` postings of a tags object for the tag index.
+
+    Scalars are indexed by their text form (booleans as ``true``/``false``)
+    and lists contribute each scalar element. Nested objects and keys or
+    values over the column lengths are left out of the index.
+    """
+    pairs: Set[Tuple[str, str]] = set()
+    for key, value in (tags or {}).items():
+        for item in value if isinstance(value, list) else [value]:
+            text = _tag_text(item)
+            if text is not None and len(key) <= TAG_KEY_MAX_LENGTH and len(text) <= TAG_VALUE_MAX_LENGTH:
+                pairs.add((key, text))
+    return pairs
+
+
+def tag_filter_pairs(tags: Any) -> Set[Tuple[str, str]]:
+    """Validate a tag filter object; every pair must be matched (AND)."""
+    if not isinstance(tags, dict):
+        raise ValueError("tags filter must be an object of tag values")
+    for key, value in tags.items():
+        for item in value if isinstance(value, list) else [value]:
+            text = _tag_text(item)
+            if text is None or len(key) > TAG_KEY_MAX_LENGTH or len(text) > TAG_VALUE_MAX_LENGTH:
+                raise ValueError(
+                    f"Tag filter {key!r} must be a scalar of at most "
+                    f"{TAG_VALUE_MAX_LENGTH} characters"
+                )
+    return tag_pairs(tags)
+
+
+def parse_tag_params(params: Iterable[str]) -> Dict[str, Any]:
+    """Turn repeated ``key=value`` query parameters into a tag filter object."""
+    tags: Dict[str, Any] = {}
+    for param in params:
+        key, sep, value = param.partition("=")
+        if not sep or not key:
+            raise ValueError(f"Invalid tag filter {param!r}; expected key=value")
+        existing = tags.get(key)
+        if existing is None:
+            tags[key] = value
+        else:
+            tags[key] = (existing if isinstance(existing, list) else [existing]) + [value]
+    return tags
+
+
+def _tag_text(value: Any) -> Optional[str]:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return json.dumps(value)
+    if isinstance(value, str):
+        return value
+    return None
@@ -0,0 +1,168 @@
+"""Compare trend statistics before and after the NumPy engine.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_trend_stats [--sizes 1000 100000 1000000]
+
+Two timings per series length:
+
+* ``stats``: the statistics alone. The legacy pure-Python least-squares slope
+  over point dicts is compared with ``trend_stats.summarize`` over arrays,
+  which also yields stddev, min/max, percentiles, moving average and
+  smoothing.
+* ``full``: a pure-Python implementation of every statistic ``summarize``
+  returns, so both sides do the same work.
+* ``summary``: the full ``trend_summary`` response construction from the
+  ``(bucket start, stats)`` pairs the repository returns, legacy points and
+  slope against the current ``_series_summary``. The current response also
+  carries the moving average and smoothed value of every point.
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict, List
+
+from app.rollups import BucketStats, bucket_label
+from app.services import _series_summary
+from app.trend_stats import SeriesArrays, summarize
+
+
+def legacy_slope(points: List[Dict[str, float]]) -> float:
+    """``services._compute_slope`` as it was before the NumPy engine."""
+    if len(points) < 2:
+        return 0.0
+    xs = list(range(len(points)))
+    ys = [point["average"] for point in points]
+    n = len(points)
+    sum_x = sum(xs)
+    sum_y = sum(ys)
+    sum_xy = sum(x * y for x, y in zip(xs, ys))
+    sum_x2 = sum(x * x for x in xs)
+    denominator = n * sum_x2 - sum_x ** 2
+    if denominator == 0:
+        return 0.0
+    return (n * sum_xy - sum_x * sum_y) / denominator
+
+
+def legacy_summary(buckets) -> Dict:
+    # Labels used to be rendered by the repository, so they are counted here.
+    points = [
+        {
+            "time_bucket": bucket_label(start, "day"),
+            "average": stats.total / stats.count,
+            "count": stats.count,
+        }
+        for start, stats in buckets
+    ]
+    return {
+        "points": points,
+        "stats": {
+            "slope": legacy_slope(points),
+            "count": sum(point["count"] for point in points),
+        },
+    }
+
+
+def python_summarize(buckets, window: int = 3, alpha: float = 0.3) -> Dict:
+    """The outputs of ``trend_stats.summarize`` without NumPy."""
+    first = buckets[0][0].toordinal()
+    days = [start.toordinal() - first for start, _ in buckets]
+    counts = [stats.count for _, stats in buckets]
+    averages = [stats.total / stats.count for _, stats in buckets]
+    samples = sum(counts)
+    mean = sum(stats.total for _, stats in buckets) / samples
+    variance = sum(stats.total_sq for _, stats in buckets) / samples - mean * mean
+    moving, running = [], 0.0
+    for index, value in enumerate(averages):
+        running += value
+        if index >= window:
+            running -= averages[index - window]
+        moving.append(running / min(index + 1, window))
+    smoothed, level = [], averages[0]
+    for value in averages:
+        level += alpha * (value - level)
+        smoothed.append(level)
+    ranked = sorted(averages)
+    percentiles = {}
+    for q in (10, 50, 90):
+        position = (len(ranked) - 1) * q / 100
+        low = int(position)
+        high = min(low + 1, len(ranked) - 1)
+        percentiles[f"p{q}"] = ranked[low] + (ranked[high] - ranked[low]) * (position - low)
+    total = sum(counts)
+    x_mean = sum(c * x for c, x in zip(counts, days)) / total
+    y_mean = sum(c * y for c, y in zip(counts, averages)) / total
+    numerator = sum(c * (x - x_mean) * (y - y_mean) for c, x, y in zip(counts, days, averages))
+    denominator = sum(c * (x - x_mean) ** 2 for c, x in zip(counts, days))
+    return {
+        "moving_average": moving,
+        "smoothed": smoothed,
+        "stats": {
+            "slope": legacy_slope([{"average": value} for value in averages]),
+            "slope_per_day": numerator / denominator if denominator else 0.0,
+            "count": samples,
+            "mean": mean,
+            "stddev": max(variance, 0.0) ** 0.5,
+            "min": min(stats.min_value for _, stats in buckets),
+            "max": max(stats.max_value for _, stats in buckets),
+            "percentiles": percentiles,
+        },
+    }
+
+
+def make_buckets(size: int):
+    rng = random.Random(size)
+    first = date(2000, 1, 1)
+    buckets = []
+    for offset in range(size):
+        count = rng.randint(1, 20)
+        mean = 70 + offset * 1e-4 + rng.gauss(0, 2)
+        buckets.append(
+            (
+                first + timedelta(days=offset),
+                BucketStats(count, mean * count, mean * mean * count + count, mean - 3, mean + 3),
+            )
+        )
+    return buckets
+
+
+def best_of(func: Callable[[], object], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'points':>10} {'part':>8} {'legacy ms':>11} {'numpy ms':>10} {'speedup':>8}")
+    for size in args.sizes:
+        buckets = make_buckets(size)
+        points = legacy_summary(buckets)["points"]
+        arrays = SeriesArrays.from_buckets(buckets)
+        rows = [
+            ("stats", lambda: legacy_slope(points), lambda: summarize(arrays)),
+            ("full", lambda: python_summarize(buckets), lambda: summarize(arrays)),
+            ("summary", lambda: legacy_summary(buckets), lambda: _series_summary(buckets, "day")),
+        ]
+        for part, legacy, current in rows:
+            before = best_of(legacy, args.repeat)
+            after = best_of(current, args.repeat)
+            print(
+                f"{size:>10} {part:>8} {before * 1000:>11.2f} {after * 1000:>10.2f} "
+                f"{before / after:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Shared fixtures: the app against a throwaway SQLite database.
+
+The settings and the engine are read once at import time, so the
+environment is prepared before anything from ``app`` is imported.
+"""
+
+import os
+import tempfile
+
+_DATA_DIR = tempfile.mkdtemp(prefix="health_mcp_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DATA_DIR, 'test.db')}"
+os.environ.setdefault("ADMIN_USERNAME", "admin")
+os.environ.setdefault("ADMIN_PASSWORD", "admin-password")
+os.environ.setdefault("CACHE_ENABLED", "false")
+os.environ.pop("API_KEY", None)
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import app  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def rpc(client):
+    def call(name, arguments, request_id=1):
+        response = client.post(
+            "/mcp/tools",
+            json={
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "method": "tools.call",
+                "params": {"name": name, "arguments": arguments},
+            },
+        )
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    return call
@@ -0,0 +1,33 @@
+"""Admin metric listing totals: exact where cheap, approximate otherwise."""
+
+import pytest
+
+from app.config import get_settings
+
+USER = "admin-list-user"
+
+
+@pytest.fixture
+def admin(client):
+    login = client.post(
+        "/admin/login",
+        data={"username": get_settings().admin_username, "password": get_settings().admin_password},
+        follow_redirects=False,
+    )
+    assert login.status_code == 303
+    return client
+
+
+def test_per_user_total_is_exact_and_counters_are_approximate(admin, rpc):
+    for day in range(1, 4):
+        rpc("health_store_metric", {"user_id": USER, "type": "body/weight", "value": 70 + day, "recorded_at": f"2024-06-{day:02d}T07:00:00"})
+
+    page = admin.get("/admin/metrics", params={"user_id": USER})
+    assert page.status_code == 200
+    assert "共 3 条记录" in page.text
+
+    # The per-type counters also cover archived records and drift between
+    # reconciliations, so the unfiltered total is only labelled an estimate.
+    page = admin.get("/admin/metrics")
+    assert page.status_code == 200
+    assert "约 " in page.text and "共 " not in page.text
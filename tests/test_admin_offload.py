@@ -0,0 +1,57 @@
+"""A busy admin dashboard must not hold up MCP tool calls."""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.admin_service import AdminUserService
+from app.config import get_settings
+
+USER = "admin-load-user"
+SLOW_DASHBOARD_SECONDS = 0.5
+DASHBOARD_REQUESTS = 12
+MCP_LATENCY_BOUND_SECONDS = 0.3
+
+
+def test_mcp_latency_while_dashboard_is_loaded(client, rpc, monkeypatch):
+    login = client.post(
+        "/admin/login",
+        data={"username": get_settings().admin_username, "password": get_settings().admin_password},
+        follow_redirects=False,
+    )
+    assert login.status_code == 303
+    rpc("health_store_metric", {"user_id": USER, "type": "body/weight", "value": 70, "recorded_at": "2024-05-01T07:00:00"})
+
+    lock = threading.Lock()
+    running = {"now": 0, "peak": 0}
+    original = AdminUserService.dashboard_stats
+
+    def slow_dashboard_stats(self):
+        # Stands in for an expensive aggregate: blocks its thread, not the loop.
+        with lock:
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+        try:
+            time.sleep(SLOW_DASHBOARD_SECONDS)
+            return original(self)
+        finally:
+            with lock:
+                running["now"] -= 1
+
+    monkeypatch.setattr(AdminUserService, "dashboard_stats", slow_dashboard_stats)
+
+    with ThreadPoolExecutor(max_workers=DASHBOARD_REQUESTS) as pool:
+        dashboards = [pool.submit(client.get, "/admin/dashboard") for _ in range(DASHBOARD_REQUESTS)]
+        while not running["now"]:
+            time.sleep(0.01)
+        latencies = []
+        while any(not future.done() for future in dashboards):
+            started = time.perf_counter()
+            response = rpc("health_query_metrics", {"user_id": USER, "limit": 5})
+            latencies.append(time.perf_counter() - started)
+            assert response["error"] is None
+        assert all(future.result().status_code == 200 for future in dashboards)
+
+    assert len(latencies) >= 5
+    assert max(latencies) < MCP_LATENCY_BOUND_SECONDS, latencies
+    assert running["peak"] == get_settings().admin_worker_threads
@@ -0,0 +1,98 @@
+"""Metric cache behaviour while Redis is unreachable."""
+
+import pytest
+
+from app import cache
+from app.config import get_settings
+
+
+class FakeRedis:
+    """Just the commands the cache uses; ``down`` makes every call fail."""
+
+    def __init__(self):
+        self.down = False
+        self.values = {}
+
+    def _check(self):
+        if self.down:
+            raise ConnectionError("redis is down")
+
+    def ping(self):
+        self._check()
+        return True
+
+    def get(self, key):
+        self._check()
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self._check()
+        self.values[key] = value
+
+    def mget(self, keys):
+        self._check()
+        return [self.values.get(key) for key in keys]
+
+    def incr(self, key):
+        self._check()
+        self.values[key] = int(self.values.get(key, 0)) + 1
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    server = FakeRedis()
+    monkeypatch.setattr(cache, "_redis_client", lambda: server)
+    return server
+
+
+def _load(metric_cache, calls):
+    def loader():
+        calls.append(1)
+        return {"value": len(calls)}
+
+    return metric_cache.get_or_load("query", "cache-user", "body/weight", {"limit": 20}, loader)
+
+
+def test_bypasses_cache_with_several_workers_and_retries_redis(redis_server, monkeypatch):
+    monkeypatch.setattr(get_settings(), "web_concurrency", 4)
+    redis_server.down = True
+    metric_cache = cache.MetricCache(enabled=True, retry_seconds=3600)
+    calls = []
+
+    _load(metric_cache, calls)
+    _load(metric_cache, calls)
+    assert len(calls) == 2
+    assert metric_cache.stats()["backend"] == "bypass"
+
+    redis_server.down = False
+    monkeypatch.setattr(metric_cache, "_retry_at", 0.0)
+    _load(metric_cache, calls)
+    assert _load(metric_cache, calls) == {"value": 3}
+    assert metric_cache.stats()["backend"] == "redis"
+    # Invalidations lost during the outage are covered by a new epoch.
+    assert redis_server.values[cache._EPOCH_KEY] == 1
+
+
+def test_single_worker_falls_back_to_local_lru(redis_server, monkeypatch):
+    monkeypatch.setattr(get_settings(), "web_concurrency", 1)
+    redis_server.down = True
+    metric_cache = cache.MetricCache(enabled=True, retry_seconds=3600)
+    calls = []
+
+    _load(metric_cache, calls)
+    _load(metric_cache, calls)
+    assert len(calls) == 1
+    assert metric_cache.stats()["backend"] == "local"
+
+
+def test_redis_failure_while_connected_starts_retrying(redis_server, monkeypatch):
+    monkeypatch.setattr(get_settings(), "web_concurrency", 4)
+    metric_cache = cache.MetricCache(enabled=True, retry_seconds=3600)
+    calls = []
+    _load(metric_cache, calls)
+    assert metric_cache.stats()["backend"] == "redis"
+
+    redis_server.down = True
+    _load(metric_cache, calls)
+    assert metric_cache.errors == 1
+    assert metric_cache.stats()["backend"] == "bypass"
@@ -0,0 +1,38 @@
+"""Exports stream every record, including the samples of series records."""
+
+import json
+
+from app import export, repositories
+
+USER = "export-user"
+SERIES_TYPE = "device/heart_rate_series"
+
+
+def test_export_with_series_spans_pages(client, rpc, monkeypatch):
+    records = []
+    for day in range(1, 21):
+        records.append(
+            {"user_id": USER, "type": "body/weight", "value": 70 + day / 10, "recorded_at": f"2024-03-{day:02d}T07:00:00"}
+        )
+        records.append(
+            {
+                "user_id": USER,
+                "type": SERIES_TYPE,
+                "value": {"samples": [[second, 55 + (second + day) % 7] for second in range(0, 600, 10)]},
+                "recorded_at": f"2024-03-{day:02d}T23:00:00",
+            }
+        )
+    assert rpc("health_batch_store_metrics", {"records": records})["error"] is None
+
+    monkeypatch.setattr(repositories, "STREAM_BATCH_SIZE", 3)
+    monkeypatch.setattr(export, "STREAM_BATCH_SIZE", 3)
+    response = client.get("/api/metrics/export", params={"user_id": USER, "format": "ndjson"})
+
+    assert response.status_code == 200
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert len(exported) == len(records)
+    assert [row["recorded_at"] for row in exported] == sorted(row["recorded_at"] for row in exported)
+    series = [row for row in exported if row["type"] == SERIES_TYPE]
+    assert len(series) == 20
+    assert all(len(row["value"]["samples"]) == 60 for row in series)
+    assert series[0]["value"]["samples"][:2] == [[0, 56], [10, 59]]
@@ -0,0 +1,58 @@
+"""Resuming chunked imports: invalid records and concurrent resumes."""
+
+import asyncio
+import json
+
+import pytest
+
+from app import importer
+from app.config import get_settings
+
+USER = "import-user"
+
+
+def _body(values, missing_source=None):
+    lines = []
+    for day, value in enumerate(values, start=1):
+        record = {"user_id": USER, "type": "body/weight", "value": value, "recorded_at": f"2024-07-{day:02d}T07:00:00"}
+        if day != missing_source:
+            record["source"] = "scale"
+        lines.append(json.dumps(record) + "\n")
+    return "".join(lines)
+
+
+def test_invalid_record_blocks_resume_until_corrected(client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "import_chunk_size", 2)
+    failed = client.post("/api/metrics/import?format=ndjson", content=_body([70, 71, 72, 73, 74], missing_source=4))
+    assert failed.status_code == 400
+    job = failed.json()
+    assert job["status"] == "failed"
+    assert job["committed_rows"] == 3
+    assert job["blocking_record"] == 4
+    assert "#4" in job["error"] and "correct this record" in job["error"]
+
+    # The unchanged body stops at the same record again.
+    url = f"/api/metrics/import?format=ndjson&import_id={job['import_id']}"
+    again = client.post(url, content=_body([70, 71, 72, 73, 74], missing_source=4))
+    assert again.json()["blocking_record"] == 4
+
+    resumed = client.post(url, content=_body([70, 71, 72, 73, 74]))
+    assert resumed.status_code == 200
+    assert resumed.json()["status"] == "completed"
+    assert resumed.json()["committed_rows"] == 5
+
+
+def test_concurrent_resume_leaves_the_job_running(client):
+    job = importer.start_import("ndjson")
+    # Another request resumed the job and committed a chunk meanwhile.
+    importer.ingest_chunk(job["import_id"], 0, [importer._store_kwargs(json.loads(_body([80]).strip()))])
+
+    async def body():
+        yield _body([80, 81]).encode()
+
+    with pytest.raises(importer.ImportConflict):
+        asyncio.run(importer.run_import(job, body(), chunk_size=10))
+    current = importer.get_import(job["import_id"])
+    assert current["status"] == "running"
+    assert current["error"] is None
+    assert current["committed_rows"] == 1
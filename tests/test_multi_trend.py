@@ -0,0 +1,60 @@
+"""Multi-series trend summaries share one bucket axis with the single-series tool."""
+
+USER = "multi-trend-user"
+SERIES = [
+    {"type": "body/weight"},
+    {"type": "body/body_fat_rate"},
+    {"type": "sport/running_session", "metric_field": "distance_km"},
+    {"type": "medical/uric_acid"},
+]
+
+
+def _seed(rpc):
+    records = []
+    for day in range(1, 29):
+        recorded_at = f"2024-01-{day:02d}T07:00:00"
+        if day % 2:
+            records.append({"user_id": USER, "type": "body/weight", "value": 70 - day * 0.1, "recorded_at": recorded_at})
+        if day % 3 == 0:
+            records.append({"user_id": USER, "type": "body/body_fat_rate", "value": 20 - day * 0.05, "recorded_at": recorded_at})
+        if day % 7 == 0:
+            records.append(
+                {
+                    "user_id": USER,
+                    "type": "sport/running_session",
+                    "value": {"distance_km": day / 5, "avg_heart_rate": 150},
+                    "recorded_at": recorded_at,
+                }
+            )
+    response = rpc("health_batch_store_metrics", {"records": records})
+    assert response["error"] is None, response
+
+
+def test_multi_trend_matches_single_series(rpc):
+    _seed(rpc)
+    result = rpc("health_multi_trend_summary", {"user_id": USER, "series": SERIES, "group_by": "week"})["result"]
+
+    assert result["buckets"] == ["2024-W01", "2024-W02", "2024-W03", "2024-W04"]
+    for series in result["series"]:
+        assert [point["time_bucket"] for point in series["points"]] == result["buckets"]
+        single = rpc(
+            "health_trend_summary",
+            {"user_id": USER, "type": series["type"], "metric_field": series["metric_field"], "group_by": "week"},
+        )["result"]
+        assert [point for point in series["points"] if point["count"]] == single["points"]
+        assert series["stats"] == single["stats"]
+    weight = result["series"][0]
+    assert all(point["count"] and point["average"] is not None for point in weight["points"])
+
+
+def test_multi_trend_rest_route(client, rpc):
+    _seed(rpc)
+    response = client.post(
+        "/api/metrics/trend/multi",
+        json={"user_id": USER, "series": SERIES[:2], "group_by": "month"},
+    )
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["buckets"] == ["2024-01"]
+    assert [series["points"][0]["count"] for series in body["series"]] == [14, 9]
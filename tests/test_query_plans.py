@@ -0,0 +1,48 @@
+"""Every hot query keeps using the index it was designed for."""
+
+import pytest
+from sqlalchemy import text
+
+from app import query_plans
+from app.db import session_scope
+
+SHAPES = [shape.name for shape in query_plans.QUERY_SHAPES]
+
+
+@pytest.fixture(scope="module")
+def plans(rpc):
+    # Many users with a few records each, as in production: statistics of a
+    # table holding only a handful of users would make user_id look unselective.
+    users = [(query_plans.SAMPLE_USER, 28)] + [(f"plan-user-{number}", 2) for number in range(60)]
+    records = []
+    for user, days in users:
+        for day in range(1, days + 1):
+            recorded_at = f"2023-12-{day:02d}T07:00:00"
+            records += [
+                {"user_id": user, "type": "body/weight", "value": 70 + day / 10, "recorded_at": recorded_at},
+                {"user_id": user, "type": query_plans.SAMPLE_TYPE, "value": 60 + day % 9, "recorded_at": recorded_at},
+                {
+                    "user_id": user,
+                    "type": "sport/running_session",
+                    "value": {"distance_km": day % 12, "avg_heart_rate": 150},
+                    "recorded_at": recorded_at,
+                    "tags": {"event": "race" if day % 4 else "training", "hospital": "X"},
+                },
+                {
+                    "user_id": user,
+                    "type": "device/heart_rate_series",
+                    "value": {"samples": [[second, 58 + second % 5] for second in range(0, 300, 30)]},
+                    "recorded_at": f"2023-12-{day:02d}T23:00:00",
+                },
+            ]
+    assert rpc("health_batch_store_metrics", {"records": records})["error"] is None
+    with session_scope() as session:
+        session.execute(text("ANALYZE"))
+    with session_scope() as session:
+        return {result.name: result for result in query_plans.check_query_plans(session)}
+
+
+@pytest.mark.parametrize("name", SHAPES)
+def test_hot_query_uses_its_index(plans, name):
+    result = plans[name]
+    assert result.ok, f"{name}: expected {result.expected}, used {result.used}, sorted in memory: {result.sorted_in_memory}"
@@ -0,0 +1,41 @@
+"""Rebuilding the trend rollups reproduces the incrementally maintained rows."""
+
+from sqlalchemy import select
+
+from app import repositories
+from app.db import session_scope
+from app.db_init import rebuild_rollups
+from app.models import HealthMetricRollup
+
+USER = "rollup-rebuild-user"
+
+
+def _rollups():
+    table = HealthMetricRollup.__table__
+    with session_scope() as session:
+        rows = session.execute(select(table).where(table.c.user_id == USER)).mappings().all()
+        return sorted(
+            (row["type_code"], row["metric_field"], row["granularity"], row["bucket_start"], row["count"], round(row["total"], 6))
+            for row in rows
+        )
+
+
+def test_rebuild_spans_several_pages(rpc, monkeypatch):
+    records = [
+        {
+            "user_id": USER,
+            "type": "body/weight" if index % 3 else "sport/running_session",
+            "value": 60 + index % 17 if index % 3 else {"distance_km": index % 11},
+            # Several records share a timestamp, so pages also split ties.
+            "recorded_at": f"2024-{1 + index // 60 % 12:02d}-{1 + index // 3 % 20:02d}T08:00:00",
+        }
+        for index in range(150)
+    ]
+    assert rpc("health_batch_store_metrics", {"records": records})["error"] is None
+    maintained = _rollups()
+    assert maintained
+
+    monkeypatch.setattr(repositories, "ROLLUP_REBUILD_BATCH_SIZE", 7)
+    stored = len({(r["type"], r["recorded_at"], str(r["value"])) for r in records})
+    assert rebuild_rollups(USER) == stored
+    assert _rollups() == maintained
@@ -0,0 +1,33 @@
+"""Sharded dashboard counters add up to the raw record counts."""
+
+from sqlalchemy import func, select
+
+from app.db import session_scope
+from app.models import HealthMetric, MetricTypeStat
+from app.repositories import StatsRepository
+
+USER = "stats-user"
+TYPE = "body/blood_glucose"
+
+
+def test_sharded_counts_match_raw_rows(rpc):
+    for day in range(1, 9):
+        # Each request writes through its own session, hence its own shard.
+        rpc("health_store_metric", {"user_id": USER, "type": TYPE, "value": 5 + day / 10, "recorded_at": f"2024-02-{day:02d}T08:00:00"})
+    listed = rpc("health_query_metrics", {"user_id": USER, "type": TYPE, "limit": 1})["result"]["records"]
+    assert rpc("health_delete_record", {"user_id": USER, "record_id": listed[0]["record_id"]})["result"]["success"]
+
+    with session_scope() as session:
+        raw = session.execute(
+            select(func.count()).where(HealthMetric.type_code == TYPE, HealthMetric.deleted.is_(False))
+        ).scalar_one()
+        shards = session.execute(
+            select(func.count()).where(MetricTypeStat.type_code == TYPE)
+        ).scalar_one()
+        counts = dict(StatsRepository(session).type_counts())
+    assert raw == 7
+    assert counts[TYPE] == raw
+    assert shards >= 1
+
+    with session_scope() as session:
+        assert StatsRepository(session).reconcile()["corrected"] == 0